@@ -0,0 +1,374 @@
+"""
+Benchmark the Lambda handlers locally against the in-memory AWS stand-in
+
+Each scenario replays API Gateway (or S3) events against one handler and
+reports latency percentiles, peak memory allocated per request (measured
+with tracemalloc in a separate pass, so it does not distort the timings)
+and the AWS calls each request makes.
+
+    python benchmarks/bench_handlers.py                       # all scenarios, no injected latency
+    python benchmarks/bench_handlers.py --latency-scale 1     # with DEFAULT_LATENCY per AWS call
+    python benchmarks/bench_handlers.py --suite tasks --json before.json
+
+Needs boto3 and botocore importable (for boto3.dynamodb.conditions and
+ClientError); nothing is sent to AWS.
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from events import LambdaContext, api_event, s3_put_event
+from local_aws import DOCUMENT_TABLES, TASK_TABLES, LocalAWS
+
+ROOT = Path(__file__).resolve().parent.parent
+TASK_DIRECTORY = ROOT / 'lambda_functions'
+DOCUMENT_DIRECTORY = ROOT / 'lambda'
+
+DOCUMENT_BUCKET = 'smart-doc-storage-bench'
+
+PRIORITIES = ('low', 'medium', 'high')
+CATEGORIES = ('general', 'work', 'personal', 'shopping')
+STATUSES = ('pending', 'in-progress', 'completed')
+
+WORDS = (
+    'quarterly report budget review contract renewal invoice shipment schedule '
+    'meeting project roadmap customer support release planning hiring update '
+    'good great improved growth approved poor late risk problem declined'
+).split()
+NAMES = ('Amazon', 'Acme', 'Globex', 'Seattle', 'London', 'Berlin', 'Alice', 'Bob', 'Carol')
+
+
+class Scenario:
+    """
+    One measured request type: a handler and a function building its i-th event
+    """
+
+    def __init__(self, suite, name, handler, make_event):
+        self.suite = suite
+        self.name = name
+        self.handler = handler
+        self.make_event = make_event
+
+    def invoke(self, i):
+        return self.handler(self.make_event(i), LambdaContext(self.name))
+
+
+@contextlib.contextmanager
+def handler_directory(directory, module_names):
+    """
+    Import handler modules from one directory. lambda_functions/ and lambda/
+    both have an aws_clients module, so modules of the same name are dropped
+    from sys.modules first and the directory stays on sys.path while in use.
+    """
+    local_names = {path.stem for path in directory.glob('*.py')}
+    for name in local_names:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, str(directory))
+    try:
+        yield {name: importlib.import_module(name) for name in module_names}
+    finally:
+        sys.path.remove(str(directory))
+        for name in local_names:
+            sys.modules.pop(name, None)
+
+
+def random_task(rng, user_id):
+    due = datetime(2025, 1, 1) + timedelta(days=rng.randrange(365))
+    return {
+        'userId': user_id,
+        'title': ' '.join(rng.choice(WORDS) for _ in range(4)).capitalize(),
+        'description': ' '.join(rng.choice(WORDS) for _ in range(20)),
+        'priority': rng.choice(PRIORITIES),
+        'category': rng.choice(CATEGORIES),
+        'dueDate': due.date().isoformat()
+    }
+
+
+def random_document_text(rng, lines=30):
+    text = []
+    for _ in range(lines):
+        words = [rng.choice(WORDS) for _ in range(12)]
+        words.insert(rng.randrange(1, len(words)), rng.choice(NAMES))
+        text.append(' '.join(words).capitalize() + '.')
+    return '\n'.join(text)
+
+
+# --- Task API ----------------------------------------------------------------------
+
+def setup_task_environment(aws):
+    """
+    Create the task tables and point the handlers at them
+    """
+    names = aws.create_tables(TASK_TABLES, suffix='-bench')
+    os.environ['TABLE_NAME'] = names['Tasks']
+    os.environ['IDEMPOTENCY_TABLE'] = names['TaskIdempotency']
+    return names
+
+
+def seed_tasks(aws, create_task, table_name, users, tasks_per_user, rng, status_mix=True):
+    """
+    Put tasks for users user-0 .. user-{users - 1} in the table, created over
+    the last 60 days; returns {userId: [taskId, ...]}
+    """
+    task_ids = {}
+    items = []
+    now = datetime.utcnow()
+    for user in range(users):
+        user_id = f'user-{user}'
+        for _ in range(tasks_per_user):
+            created_at = (now - timedelta(minutes=rng.randrange(60 * 24 * 60))).isoformat()
+            task = create_task.build_task(random_task(rng, user_id), created_at)
+            if status_mix:
+                task['status'] = rng.choice(STATUSES)
+            items.append(task)
+            task_ids.setdefault(user_id, []).append(task['taskId'])
+    aws.dynamodb.Table(table_name).seed(items)
+    return task_ids
+
+
+def task_scenarios(aws, modules, args, rng):
+    table_name = os.environ['TABLE_NAME']
+    task_ids = seed_tasks(aws, modules['create_task'], table_name, args.users, args.tasks_per_user, rng)
+    users = sorted(task_ids)
+    spare_ids = seed_tasks(aws, modules['create_task'], table_name, 1, args.warmup + args.iterations + args.alloc_iterations + 10, rng)
+    deletable = iter(spare_ids['user-0'])
+    since = (datetime.utcnow() - timedelta(days=7)).isoformat()
+
+    get_tasks = modules['get_tasks'].handler
+    create_task = modules['create_task'].handler
+    update_task = modules['update_task'].handler
+    delete_task = modules['delete_task'].handler
+
+    def user(i):
+        return users[i % len(users)]
+
+    return [
+        Scenario('tasks', 'GET /tasks', get_tasks,
+                 lambda i: api_event('GET', '/tasks', query={'userId': user(i), 'limit': 50})),
+        Scenario('tasks', 'GET /tasks (filtered)', get_tasks,
+                 lambda i: api_event('GET', '/tasks', query={'userId': user(i), 'status': 'pending', 'priority': 'high', 'limit': 20})),
+        Scenario('tasks', 'GET /tasks (createdSince)', get_tasks,
+                 lambda i: api_event('GET', '/tasks', query={'userId': user(i), 'createdSince': since, 'limit': 50})),
+        Scenario('tasks', 'POST /tasks', create_task,
+                 lambda i: api_event('POST', '/tasks', body=random_task(rng, user(i)))),
+        Scenario('tasks', 'POST /tasks (replayed key)', create_task,
+                 lambda i: api_event('POST', '/tasks', body={'userId': 'user-0', 'title': 'Replayed'}, headers={'Idempotency-Key': 'bench-replay'})),
+        Scenario('tasks', 'POST /tasks/batch (25)', create_task,
+                 lambda i: api_event('POST', '/tasks/batch', body={'tasks': [random_task(rng, user(i)) for _ in range(25)]})),
+        Scenario('tasks', 'PUT /tasks/{taskId}', update_task,
+                 lambda i: api_event('PUT', '/tasks/{taskId}', path=f'/tasks/{task_ids[user(i)][0]}',
+                                     path_parameters={'taskId': task_ids[user(i)][0]}, body={'status': rng.choice(STATUSES)})),
+        Scenario('tasks', 'PATCH /tasks (20 ids)', update_task,
+                 lambda i: api_event('PATCH', '/tasks', body={'taskIds': task_ids[user(i)][:20], 'patch': {'priority': rng.choice(PRIORITIES)}})),
+        Scenario('tasks', 'PATCH /tasks (20 ids, atomic)', update_task,
+                 lambda i: api_event('PATCH', '/tasks', body={'taskIds': task_ids[user(i)][:20], 'patch': {'priority': rng.choice(PRIORITIES)}, 'atomic': True})),
+        Scenario('tasks', 'DELETE /tasks/{taskId}', delete_task,
+                 lambda i: (lambda task_id: api_event('DELETE', '/tasks/{taskId}', path=f'/tasks/{task_id}',
+                                                      path_parameters={'taskId': task_id}))(next(deletable))),
+    ]
+
+
+# --- Document system -----------------------------------------------------------------
+
+def setup_document_environment(aws):
+    """
+    Create the document tables and point the handlers at them and the bucket
+    """
+    names = aws.create_tables(DOCUMENT_TABLES, suffix='-bench')
+    os.environ['METADATA_TABLE'] = names['DocumentMetadata']
+    os.environ['INDEX_TABLE'] = names['DocumentIndex']
+    os.environ['IDEMPOTENCY_TABLE'] = names['DocumentIdempotency']
+    os.environ['DOCUMENT_BUCKET'] = DOCUMENT_BUCKET
+    return names
+
+
+def seed_document(aws, table_name, user_id, document_id, text, file_name='scan.png'):
+    """
+    Put an uploaded document in place: its object in the bucket and its metadata item
+    """
+    key = f'documents/{user_id}/{document_id}/{file_name}'
+    aws.s3.seed(DOCUMENT_BUCKET, key, text)
+    aws.dynamodb.Table(table_name).seed([{
+        'documentId': document_id,
+        'userId': user_id,
+        'fileName': file_name,
+        'fileType': 'image/png',
+        'fileSize': len(text),
+        's3Key': key,
+        'uploadDate': datetime.utcnow().isoformat(),
+        'status': 'uploading',
+        'entities': [],
+        'keyPhrases': []
+    }])
+    return key
+
+
+def document_scenarios(aws, modules, args, rng):
+    table_name = os.environ['METADATA_TABLE']
+    ulid = modules['ulid']
+    processing = modules['document_processing'].lambda_handler
+    search = modules['document_search'].lambda_handler
+    upload = modules['document_upload'].lambda_handler
+    users = [f'user-{user}' for user in range(args.users)]
+
+    # Process the seed documents once, without injected latency, to build the index
+    scale, aws.scale = aws.scale, 0
+    keys = [seed_document(aws, table_name, users[i % len(users)], ulid.generate(), random_document_text(rng)) for i in range(args.documents)]
+    for start in range(0, len(keys), 10):
+        processing(s3_put_event(DOCUMENT_BUCKET, *keys[start:start + 10]), LambdaContext('seed'))
+    aws.scale = scale
+
+    cached_text = random_document_text(rng)
+
+    def new_document(i, text=None):
+        key = seed_document(aws, table_name, users[i % len(users)], ulid.generate(), text or random_document_text(rng))
+        return s3_put_event(DOCUMENT_BUCKET, key)
+
+    def query(i, **params):
+        return api_event('GET', '/search', query=dict(params, userId=users[i % len(users)]))
+
+    return [
+        Scenario('documents', 'POST /upload', upload,
+                 lambda i: api_event('POST', '/upload', body={'userId': users[i % len(users)], 'fileName': 'scan.png', 'fileType': 'image/png', 'fileSize': 2048})),
+        Scenario('documents', 'process (new content)', processing, new_document),
+        Scenario('documents', 'process (cached content)', processing, lambda i: new_document(i, cached_text)),
+        Scenario('documents', 'GET /search (user listing)', search, lambda i: query(i, limit=20)),
+        Scenario('documents', 'GET /search (text)', search, lambda i: query(i, searchText=rng.choice(WORDS[:20]), limit=20)),
+        Scenario('documents', 'GET /search (relevance)', search,
+                 lambda i: query(i, searchText=' '.join(rng.sample(WORDS[:20], 2)), rank='relevance', operator='or', limit=10)),
+        Scenario('documents', 'GET /search (entity)', search, lambda i: query(i, entity=rng.choice(NAMES), limit=20)),
+        Scenario('documents', 'GET /search (lean fields)', search, lambda i: query(i, fields='fileName,uploadDate,sentiment', limit=50)),
+    ]
+
+
+# --- Measurement ---------------------------------------------------------------------
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def measure(aws, scenario, iterations, warmup, alloc_iterations):
+    for i in range(warmup):
+        scenario.invoke(i)
+
+    durations = []
+    statuses = Counter()
+    before = aws.snapshot()
+    for i in range(warmup, warmup + iterations):
+        event = scenario.make_event(i)
+        context = LambdaContext(scenario.name)
+        start = time.perf_counter()
+        response = scenario.handler(event, context)
+        durations.append(time.perf_counter() - start)
+        statuses[str(response.get('statusCode'))] += 1
+    calls = aws.snapshot() - before
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(warmup + iterations, warmup + iterations + alloc_iterations):
+            event = scenario.make_event(i)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            scenario.handler(event, LambdaContext(scenario.name))
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'suite': scenario.suite,
+        'scenario': scenario.name,
+        'iterations': iterations,
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'mean_ms': statistics.fmean(durations) * 1000 if durations else 0.0,
+        'max_ms': durations[-1] * 1000 if durations else 0.0,
+        'peak_alloc_kib': statistics.fmean(peaks) / 1024 if peaks else 0.0,
+        'calls_per_request': {f'{service}.{operation}': count / iterations for (service, operation), count in sorted(calls.items())},
+        'statuses': dict(statuses)
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':34} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'alloc KiB':>10}  {'status':12} calls/request"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        statuses = ','.join(f'{code}x{count}' for code, count in sorted(result['statuses'].items()))
+        calls = ' '.join(f'{name}={count:g}' for name, count in result['calls_per_request'].items())
+        print(f"{result['scenario']:34} {result['p50_ms']:8.2f} {result['p99_ms']:8.2f} {result['mean_ms']:8.2f} "
+              f"{result['peak_alloc_kib']:10.1f}  {statuses:12} {calls}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--suite', choices=('tasks', 'documents', 'all'), default='all')
+    parser.add_argument('--scenario', help='only run scenarios whose name contains this text')
+    parser.add_argument('--iterations', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests before measuring')
+    parser.add_argument('--alloc-iterations', type=int, default=30, help='requests traced with tracemalloc')
+    parser.add_argument('--latency-scale', type=float, default=0.0, help='multiplier for the injected AWS latency (0 = none)')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--tasks-per-user', type=int, default=50)
+    parser.add_argument('--documents', type=int, default=100, help='documents processed into the index before measuring')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help="show the handlers' own output")
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON (to compare runs across commits)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    suites = []
+    if args.suite in ('tasks', 'all'):
+        suites.append((TASK_DIRECTORY, ('aws_clients', 'create_task', 'get_tasks', 'update_task', 'delete_task'), setup_task_environment, task_scenarios))
+    if args.suite in ('documents', 'all'):
+        suites.append((DOCUMENT_DIRECTORY, ('aws_clients', 'ulid', 'document_upload', 'document_processing', 'document_search'), setup_document_environment, document_scenarios))
+
+    results = []
+    # The handlers log every request; keep that out of the report
+    devnull = open(os.devnull, 'w')
+    quiet = contextlib.redirect_stdout(devnull) if not args.verbose else contextlib.nullcontext()
+    for directory, module_names, setup, build_scenarios in suites:
+        aws = LocalAWS(scale=args.latency_scale, seed=args.seed)
+        setup(aws)
+        with handler_directory(directory, module_names) as modules, quiet:
+            aws.install(modules['aws_clients'])
+            for scenario in build_scenarios(aws, modules, args, rng):
+                if args.scenario and args.scenario.lower() not in scenario.name.lower():
+                    continue
+                results.append(measure(aws, scenario, args.iterations, args.warmup, args.alloc_iterations))
+
+    devnull.close()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'generatedAt': datetime.utcnow().isoformat(), 'arguments': vars(args), 'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Measure import time and cold-start duration of each Lambda function
+
+Every run starts a fresh interpreter per function (a cold start) and times:
+    import       importing the handler module
+    sdk init     importing boto3 if the handler has not, and creating the
+                 clients and resources the function uses (loads service models)
+    first call   the first invocation, against the in-memory AWS stand-ins
+    cold start   the three together
+    warm call    a second invocation in the same interpreter
+
+Handler code comes from lambda_functions/ or lambda/. The SDK comes from
+--build-dir/<FunctionName> when that exists, so the packages vendored by
+`sam build` (slimmed or not) are what gets measured, and otherwise from
+this environment.
+
+    python benchmarks/cold_start.py --json before.json
+    python scripts/slim_build.py --build-dir .aws-sam/build
+    python benchmarks/cold_start.py --compare before.json
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BENCHMARKS = Path(__file__).resolve().parent
+ROOT = BENCHMARKS.parent
+
+# Function name -> (source directory, handler module, handler function, AWS services used)
+FUNCTIONS = {
+    'GetTasksFunction': ('lambda_functions', 'get_tasks', 'handler', ('dynamodb',)),
+    'CreateTaskFunction': ('lambda_functions', 'create_task', 'handler', ('dynamodb',)),
+    'UpdateTaskFunction': ('lambda_functions', 'update_task', 'handler', ('dynamodb',)),
+    'DeleteTaskFunction': ('lambda_functions', 'delete_task', 'handler', ('dynamodb',)),
+    'TaskRouterFunction': ('lambda_functions', 'router', 'handler', ('dynamodb',)),
+    'DocumentUploadFunction': ('lambda', 'document_upload', 'lambda_handler', ('dynamodb', 's3')),
+    'DocumentProcessingFunction': ('lambda', 'document_processing', 'lambda_handler', ('dynamodb', 's3', 'textract', 'comprehend')),
+    'DocumentSearchFunction': ('lambda', 'document_search', 'lambda_handler', ('dynamodb', 's3')),
+}
+
+METRICS = ('import_ms', 'sdk_init_ms', 'first_call_ms', 'cold_start_ms', 'warm_call_ms')
+
+
+def elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+# --- Child process: one cold start ------------------------------------------------------
+
+def first_event(name, aws):
+    """
+    A representative request for the function, with any data it needs in place
+    """
+    from bench_handlers import DOCUMENT_BUCKET, seed_document
+    from events import api_event, s3_put_event
+
+    if name == 'GetTasksFunction' or name == 'TaskRouterFunction':
+        return api_event('GET', '/tasks', query={'userId': 'user-0'})
+    if name == 'CreateTaskFunction':
+        return api_event('POST', '/tasks', body={'userId': 'user-0', 'title': 'Cold start'})
+    if name == 'UpdateTaskFunction':
+        return api_event('PUT', '/tasks/{taskId}', path='/tasks/missing', path_parameters={'taskId': 'missing'}, body={'status': 'completed'})
+    if name == 'DeleteTaskFunction':
+        return api_event('DELETE', '/tasks/{taskId}', path='/tasks/missing', path_parameters={'taskId': 'missing'})
+    if name == 'DocumentUploadFunction':
+        return api_event('POST', '/upload', body={'userId': 'user-0', 'fileName': 'scan.png', 'fileType': 'image/png', 'fileSize': 2048})
+    if name == 'DocumentProcessingFunction':
+        key = seed_document(aws, os.environ['METADATA_TABLE'], 'user-0', 'cold-start', 'Invoice from Acme in Seattle.\nPayment approved.')
+        return s3_put_event(DOCUMENT_BUCKET, key)
+    return api_event('GET', '/search', query={'userId': 'user-0', 'searchText': 'invoice'})
+
+
+def measure_child(name, sdk_dir=None):
+    source_dir, module_name, handler_name, services = FUNCTIONS[name]
+    sys.path.insert(0, str(ROOT / source_dir))
+    if sdk_dir:
+        sys.path.insert(1, str(sdk_dir))
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'cold-start',
+        'AWS_SECRET_ACCESS_KEY': 'cold-start'
+    })
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_ms = elapsed_ms(start)
+    # The SDK is loaded by aws_clients on first use, never by the import itself
+    if 'botocore' in sys.modules:
+        raise RuntimeError(f'Importing {module_name} loaded botocore')
+
+    start = time.perf_counter()
+    aws_clients = importlib.import_module('aws_clients')
+    for service in services:
+        aws_clients.client(service)
+    aws_clients.resource('dynamodb')
+    sdk_init_ms = elapsed_ms(start)
+
+    # The stand-ins import boto3 themselves, so they are only loaded now
+    sys.path.append(str(BENCHMARKS))
+    from bench_handlers import setup_document_environment, setup_task_environment
+    from events import LambdaContext
+    from local_aws import LocalAWS
+
+    aws = LocalAWS(scale=0)
+    if source_dir == 'lambda_functions':
+        setup_task_environment(aws)
+    else:
+        setup_document_environment(aws)
+    aws.install(aws_clients)
+    handler = getattr(module, handler_name)
+
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        event = first_event(name, aws)
+        start = time.perf_counter()
+        handler(event, LambdaContext(name))
+        first_call_ms = elapsed_ms(start)
+
+        event = first_event(name, aws)
+        start = time.perf_counter()
+        handler(event, LambdaContext(name))
+        warm_call_ms = elapsed_ms(start)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return {
+        'import_ms': import_ms,
+        'sdk_init_ms': sdk_init_ms,
+        'first_call_ms': first_call_ms,
+        'cold_start_ms': import_ms + sdk_init_ms + first_call_ms,
+        'warm_call_ms': warm_call_ms
+    }
+
+
+# --- Parent process ----------------------------------------------------------------------
+
+def sdk_directory(name, build_dir):
+    if build_dir and (build_dir / name).is_dir():
+        return build_dir / name
+    return None
+
+
+def run_child(name, sdk_dir):
+    # -B: a real /var/task is read-only, so no bytecode is cached between cold starts
+    command = [sys.executable, '-B', str(Path(__file__).resolve()), '--child', name]
+    if sdk_dir:
+        command += ['--sdk-dir', str(sdk_dir)]
+    output = subprocess.run(command, capture_output=True, text=True, cwd=str(ROOT))
+    if output.returncode != 0:
+        raise RuntimeError(f'{name} failed:\n{output.stderr}')
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def measure(names, build_dir, runs):
+    results = {}
+    for name in names:
+        sdk_dir = sdk_directory(name, build_dir)
+        samples = [run_child(name, sdk_dir) for _ in range(runs)]
+        results[name] = dict(
+            {metric: statistics.median(sample[metric] for sample in samples) for metric in METRICS},
+            sdk_dir=str(sdk_dir) if sdk_dir else None,
+            package_mib=sum(path.stat().st_size for path in sdk_dir.rglob('*') if path.is_file()) / 2 ** 20 if sdk_dir else None
+        )
+    return results
+
+
+def print_report(results, baseline=None):
+    header = f"{'function':28} {'import':>8} {'sdk init':>9} {'1st call':>9} {'cold':>8} {'warm':>7} {'bundle MiB':>11}  (median ms)"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        size = f"{result['package_mib']:.1f}" if result['package_mib'] is not None else '-'
+        row = f"{name:28} {result['import_ms']:8.1f} {result['sdk_init_ms']:9.1f} {result['first_call_ms']:9.1f} " \
+              f"{result['cold_start_ms']:8.1f} {result['warm_call_ms']:7.2f} {size:>11}"
+        if baseline and name in baseline:
+            before = baseline[name]['cold_start_ms']
+            row += f"  cold {result['cold_start_ms'] - before:+.1f} ms ({(result['cold_start_ms'] / before - 1) * 100:+.0f}%)"
+        print(row)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--build-dir', type=Path, default=ROOT / '.aws-sam' / 'build',
+                        help='sam build output whose vendored SDK is used where it has the function (default .aws-sam/build)')
+    parser.add_argument('--source', action='store_true', help="ignore --build-dir and use this environment's SDK throughout")
+    parser.add_argument('--function', action='append', choices=sorted(FUNCTIONS), help='only these functions (repeatable)')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per function (the median is reported)')
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='show the change in cold start against an earlier --json file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--sdk-dir', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(measure_child(args.child, args.sdk_dir)))
+        return
+
+    build_dir = None if args.source else args.build_dir
+    results = measure(args.function or list(FUNCTIONS), build_dir, args.runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)['results']
+    print_report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'generatedAt': datetime.utcnow().isoformat(), 'python': sys.version.split()[0], 'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Lambda events and context objects shaped like the ones AWS delivers
+
+api_event() builds an API Gateway REST (proxy integration) event for the
+routes in template.yaml; s3_put_event() builds the S3 notification that
+triggers document_processing.
+"""
+import json
+import time
+import uuid
+from urllib.parse import quote_plus
+
+
+class LambdaContext:
+    """
+    The attributes and methods of the Lambda context object the handlers use
+    """
+
+    def __init__(self, function_name='local', timeout_seconds=30, memory_mb=512):
+        self.function_name = function_name
+        self.memory_limit_in_mb = memory_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = f'arn:aws:lambda:us-east-1:000000000000:function:{function_name}'
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def api_event(method, resource, path=None, query=None, body=None, path_parameters=None, headers=None):
+    """
+    An API Gateway proxy event; body may be a dict (JSON-encoded here) or a string
+    """
+    request_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+    request_headers.update(headers or {})
+    return {
+        'resource': resource,
+        'path': path or resource,
+        'httpMethod': method,
+        'headers': request_headers,
+        'multiValueHeaders': {name: [value] for name, value in request_headers.items()},
+        'queryStringParameters': {name: str(value) for name, value in query.items()} if query else None,
+        'multiValueQueryStringParameters': {name: [str(value)] for name, value in query.items()} if query else None,
+        'pathParameters': path_parameters,
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': resource,
+            'httpMethod': method,
+            'stage': 'dev',
+            'requestId': str(uuid.uuid4()),
+            'requestTimeEpoch': int(time.time() * 1000)
+        },
+        'body': json.dumps(body) if isinstance(body, (dict, list)) else body,
+        'isBase64Encoded': False
+    }
+
+
+def s3_put_event(bucket, *keys):
+    """
+    An S3 ObjectCreated notification for one or more keys
+    """
+    return {
+        'Records': [
+            {
+                'eventSource': 'aws:s3',
+                'eventName': 'ObjectCreated:Put',
+                's3': {
+                    'bucket': {'name': bucket},
+                    # Keys arrive URL-encoded, as in real notifications
+                    'object': {'key': quote_plus(key, safe='/')}
+                }
+            }
+            for key in keys
+        ]
+    }
@@ -0,0 +1,439 @@
+"""
+Synthetic load generator and replay tool for the Task Manager API
+
+Builds a workload shaped like production traffic on /tasks -- mostly GETs,
+with bursts of POST/PUT from one user at a time -- and plays it open-loop
+with asyncio: requests are sent at their scheduled times whether or not
+earlier ones have finished, so latency includes any time spent queued.
+
+Users are picked with a Zipf-like skew (--user-skew) and each starts with a
+log-normally distributed number of tasks (--tasks-per-user, --task-spread).
+
+Targets:
+    inprocess  the four handlers, imported from lambda_functions/, backed by
+               the in-memory stand-ins in local_aws.py (--latency-scale)
+    http       a running API such as `sam local start-api` (--endpoint)
+
+    python benchmarks/loadgen.py --rate 200 --duration 30 --json after.json
+    python benchmarks/loadgen.py --save workload.jsonl --duration 60
+    python benchmarks/loadgen.py --workload workload.jsonl --target http --endpoint http://127.0.0.1:3000
+
+A saved workload refers to tasks by user and position, so it replays the same
+traffic against freshly seeded data. Lines holding a raw API Gateway event
+({"at": seconds, "event": {...}}) are replayed as they are.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_handlers import (PRIORITIES, STATUSES, TASK_DIRECTORY, handler_directory, percentile,
+                            random_task, setup_task_environment)
+from events import LambdaContext, api_event
+from local_aws import LocalAWS
+
+TASK_MODULES = ('aws_clients', 'create_task', 'get_tasks', 'update_task', 'delete_task')
+ROUTES = {
+    ('GET', '/tasks'): 'get_tasks',
+    ('POST', '/tasks'): 'create_task',
+    ('POST', '/tasks/batch'): 'create_task',
+    ('PUT', '/tasks/{taskId}'): 'update_task',
+    ('PATCH', '/tasks'): 'update_task',
+    ('DELETE', '/tasks/{taskId}'): 'delete_task',
+    ('DELETE', '/tasks'): 'delete_task',
+}
+
+SEED_BATCH_SIZE = 500
+
+
+# --- Workload ------------------------------------------------------------------------
+
+class Workload:
+    """
+    The seed data ({userId: task count}) and a time-ordered list of operations
+
+    An operation is a dict with 'at' (seconds from start) and either 'event'
+    (sent as is) or 'method', 'user' and the pieces build_event() needs; PUT
+    and DELETE name their task by position in the user's seeded tasks.
+    """
+
+    def __init__(self, users, operations, settings=None):
+        self.users = users
+        self.operations = operations
+        self.settings = settings or {}
+
+    def save(self, path):
+        with open(path, 'w') as output:
+            output.write(json.dumps({'type': 'workload', 'users': self.users, 'settings': self.settings}) + '\n')
+            for operation in self.operations:
+                output.write(json.dumps(operation) + '\n')
+
+    @classmethod
+    def load(cls, path):
+        users, settings, operations = {}, {}, []
+        with open(path) as source:
+            for line in source:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('type') == 'workload':
+                    users, settings = record['users'], record.get('settings', {})
+                else:
+                    operations.append(record)
+        operations.sort(key=lambda operation: operation['at'])
+        return cls(users, operations, settings)
+
+
+def user_weights(count, skew):
+    """
+    Zipf-like activity weights: user k gets 1 / (k + 1) ** skew (0 = uniform)
+    """
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+def task_counts(rng, users, mean, spread):
+    """
+    Seeded tasks per user, log-normal with the given mean (spread 0 = exactly mean)
+    """
+    if spread <= 0:
+        return {f'user-{user}': mean for user in range(users)}
+    mu = math.log(max(mean, 1)) - spread ** 2 / 2
+    return {f'user-{user}': max(1, round(rng.lognormvariate(mu, spread))) for user in range(users)}
+
+
+def read_operation(rng, user_id):
+    query = {'userId': user_id}
+    shape = rng.random()
+    if shape < 0.2:
+        query['status'] = rng.choice(STATUSES)
+    elif shape < 0.3:
+        query['priority'] = rng.choice(PRIORITIES)
+    elif shape < 0.4:
+        query['limit'] = 20
+    return {'method': 'GET', 'user': user_id, 'query': query}
+
+
+def write_operation(rng, user_id, counts, deleted, mix):
+    choice = rng.choices(('POST', 'PUT', 'DELETE'), weights=mix)[0]
+    if choice == 'POST':
+        return {'method': 'POST', 'user': user_id, 'body': random_task(rng, user_id)}
+    remaining = [task for task in range(counts[user_id]) if (user_id, task) not in deleted]
+    if not remaining:
+        return {'method': 'POST', 'user': user_id, 'body': random_task(rng, user_id)}
+    task = rng.choice(remaining)
+    if choice == 'DELETE':
+        # Each seeded task is deleted at most once, and not updated afterwards
+        deleted.add((user_id, task))
+        return {'method': 'DELETE', 'user': user_id, 'task': task}
+    return {'method': 'PUT', 'user': user_id, 'task': task, 'body': {'status': rng.choice(STATUSES)}}
+
+
+def generate(args, rng):
+    """
+    A workload from the command-line settings: Poisson arrivals at --rate,
+    reads with probability --read-ratio, plus a burst of --burst-size writes
+    from a single user every --burst-interval seconds
+    """
+    counts = task_counts(rng, args.users, args.tasks_per_user, args.task_spread)
+    users = list(counts)
+    weights = user_weights(len(users), args.user_skew)
+    mix = (args.post_weight, args.put_weight, args.delete_weight)
+    deleted = set()
+    operations = []
+
+    at = rng.expovariate(args.rate)
+    while at < args.duration:
+        user_id = rng.choices(users, weights=weights)[0]
+        if rng.random() < args.read_ratio:
+            operation = read_operation(rng, user_id)
+        else:
+            operation = write_operation(rng, user_id, counts, deleted, mix)
+        operations.append(dict(operation, at=round(at, 6)))
+        at += rng.expovariate(args.rate)
+
+    if args.burst_size and args.burst_interval:
+        burst_at = args.burst_interval
+        while burst_at < args.duration:
+            user_id = rng.choices(users, weights=weights)[0]
+            for _ in range(args.burst_size):
+                # A burst is creates and updates only, like a client syncing its edits
+                operation = write_operation(rng, user_id, counts, deleted, mix[:2] + (0,))
+                operations.append(dict(operation, at=round(burst_at + rng.uniform(0, args.burst_window), 6)))
+            burst_at += args.burst_interval
+
+    operations.sort(key=lambda operation: operation['at'])
+    settings = {name: getattr(args, name) for name in (
+        'users', 'tasks_per_user', 'task_spread', 'user_skew', 'rate', 'duration', 'read_ratio',
+        'post_weight', 'put_weight', 'delete_weight', 'burst_size', 'burst_interval', 'burst_window', 'seed')}
+    return Workload(counts, operations, settings)
+
+
+def build_event(operation, task_ids):
+    """
+    The API Gateway event for an operation, with task positions resolved to seeded IDs
+    """
+    if 'event' in operation:
+        return operation['event']
+    method = operation['method']
+    if method == 'GET':
+        return api_event('GET', '/tasks', query=operation['query'])
+    if method == 'POST':
+        return api_event('POST', '/tasks', body=operation['body'])
+    task_id = task_ids[operation['user']][operation['task']]
+    return api_event(method, '/tasks/{taskId}', path=f'/tasks/{task_id}',
+                     path_parameters={'taskId': task_id}, body=operation.get('body'))
+
+
+def route_of(event):
+    return f"{event['httpMethod']} {event['resource']}"
+
+
+# --- Targets -------------------------------------------------------------------------
+
+class InProcessTarget:
+    """
+    Calls the handlers directly (or through router.py), backed by the local AWS stand-ins
+    """
+
+    def __init__(self, modules, layout='split'):
+        self.modules = modules
+        self.layout = layout
+
+    def invoke(self, event):
+        if self.layout == 'router':
+            module = self.modules['router']
+        else:
+            module = self.modules[ROUTES[(event['httpMethod'], event['resource'])]]
+        response = module.handler(event, LambdaContext(module.__name__))
+        return response.get('statusCode', 500), response.get('body')
+
+
+class HttpTarget:
+    """
+    Sends each event as an HTTP request to a running API
+    """
+
+    def __init__(self, endpoint, timeout):
+        self.endpoint = endpoint.rstrip('/')
+        self.timeout = timeout
+
+    def invoke(self, event):
+        url = self.endpoint + event['path']
+        if event.get('queryStringParameters'):
+            url += '?' + urllib.parse.urlencode(event['queryStringParameters'])
+        body = event.get('body')
+        request = urllib.request.Request(
+            url,
+            data=body.encode('utf-8') if body is not None else None,
+            headers=event.get('headers') or {},
+            method=event['httpMethod']
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode('utf-8')
+
+
+def seed(target, users):
+    """
+    Create each user's starting tasks through POST /tasks/batch; returns {userId: [taskId, ...]}
+    """
+    rng = random.Random(0)
+    task_ids = {}
+    for user_id, count in users.items():
+        task_ids[user_id] = []
+        for start in range(0, count, SEED_BATCH_SIZE):
+            tasks = [random_task(rng, user_id) for _ in range(min(SEED_BATCH_SIZE, count - start))]
+            status, body = target.invoke(api_event('POST', '/tasks/batch', body={'tasks': tasks}))
+            if status != 201:
+                raise RuntimeError(f'Seeding {user_id} failed with {status}: {body}')
+            created = [result['task']['taskId'] for result in json.loads(body)['results'] if result['status'] == 'created']
+            task_ids[user_id].extend(created)
+    return task_ids
+
+
+# --- Running -------------------------------------------------------------------------
+
+async def play(target, workload, task_ids, concurrency, speed):
+    """
+    Send every operation at its scheduled time; returns one sample per request
+
+    A sample holds the route, status, latency from the scheduled time (so a
+    backlog shows up) and service time from when the request was actually sent.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    slots = asyncio.Semaphore(concurrency)
+    samples = []
+    start = loop.time()
+
+    async def send(operation):
+        due = start + operation['at'] / speed
+        await asyncio.sleep(max(0.0, due - loop.time()))
+        event = build_event(operation, task_ids)
+        async with slots:
+            sent = loop.time()
+            try:
+                status, _ = await loop.run_in_executor(executor, target.invoke, event)
+            except Exception as e:
+                status = type(e).__name__
+            finished = loop.time()
+        samples.append({
+            'route': route_of(event),
+            'status': str(status),
+            'latency': finished - due,
+            'service': finished - sent
+        })
+
+    try:
+        await asyncio.gather(*(send(operation) for operation in workload.operations))
+    finally:
+        executor.shutdown(wait=False)
+    return samples, loop.time() - start
+
+
+def summarize(samples, elapsed):
+    """
+    Throughput and latency percentiles, overall and per route
+    """
+    def stats(group):
+        latencies = sorted(sample['latency'] for sample in group)
+        service = sorted(sample['service'] for sample in group)
+        return {
+            'requests': len(group),
+            'throughput_rps': len(group) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            'service_p50_ms': percentile(service, 50) * 1000,
+            'service_p99_ms': percentile(service, 99) * 1000,
+            'statuses': dict(Counter(sample['status'] for sample in group))
+        }
+
+    routes = defaultdict(list)
+    for sample in samples:
+        routes[sample['route']].append(sample)
+    return {
+        'elapsed_s': elapsed,
+        'overall': stats(samples),
+        'routes': {route: stats(group) for route, group in sorted(routes.items())}
+    }
+
+
+def print_report(summary):
+    header = f"{'route':24} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses"
+    print(header)
+    print('-' * len(header))
+    rows = list(summary['routes'].items()) + [('all', summary['overall'])]
+    for route, stats in rows:
+        statuses = ','.join(f'{code}x{count}' for code, count in sorted(stats['statuses'].items()))
+        print(f"{route:24} {stats['requests']:8d} {stats['throughput_rps']:8.1f} {stats['p50_ms']:8.2f} "
+              f"{stats['p90_ms']:8.2f} {stats['p99_ms']:8.2f} {stats['max_ms']:8.2f}  {statuses}")
+    print(f"\n{summary['overall']['requests']} requests in {summary['elapsed_s']:.2f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    target = parser.add_argument_group('target')
+    target.add_argument('--target', choices=('inprocess', 'http'), default='inprocess')
+    target.add_argument('--endpoint', help='API base URL for --target http, e.g. http://127.0.0.1:3000')
+    target.add_argument('--layout', choices=('split', 'router'), default='split',
+                        help='for --target inprocess: call each handler, or everything through router.py')
+    target.add_argument('--latency-scale', type=float, default=1.0, help='injected AWS latency multiplier for --target inprocess')
+    target.add_argument('--concurrency', type=int, default=50, help='requests in flight at once (like reserved concurrency)')
+    target.add_argument('--timeout', type=float, default=30.0, help='HTTP timeout in seconds')
+
+    workload = parser.add_argument_group('workload')
+    workload.add_argument('--workload', metavar='PATH', help='replay a saved workload instead of generating one')
+    workload.add_argument('--save', metavar='PATH', help='write the generated workload and exit')
+    workload.add_argument('--users', type=int, default=50)
+    workload.add_argument('--tasks-per-user', type=int, default=40, help='mean seeded tasks per user')
+    workload.add_argument('--task-spread', type=float, default=1.0, help='log-normal sigma of tasks per user (0 = all equal)')
+    workload.add_argument('--user-skew', type=float, default=1.1, help='Zipf exponent of user activity (0 = uniform)')
+    workload.add_argument('--rate', type=float, default=100.0, help='mean requests per second')
+    workload.add_argument('--duration', type=float, default=20.0, help='seconds of traffic')
+    workload.add_argument('--read-ratio', type=float, default=0.9, help='share of background requests that are GETs')
+    workload.add_argument('--post-weight', type=float, default=5.0)
+    workload.add_argument('--put-weight', type=float, default=4.0)
+    workload.add_argument('--delete-weight', type=float, default=1.0)
+    workload.add_argument('--burst-size', type=int, default=30, help='writes per burst (0 = no bursts)')
+    workload.add_argument('--burst-interval', type=float, default=5.0, help='seconds between bursts')
+    workload.add_argument('--burst-window', type=float, default=0.5, help='seconds a burst is spread over')
+    workload.add_argument('--speed', type=float, default=1.0, help='play the schedule this many times faster')
+    workload.add_argument('--seed', type=int, default=42)
+
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON (to compare runs across commits)')
+    args = parser.parse_args(argv)
+    if args.target == 'http' and not args.endpoint:
+        parser.error('--target http needs --endpoint')
+    return args
+
+
+def report(args, workload, samples, elapsed):
+    summary = summarize(samples, elapsed)
+    print_report(summary)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({
+                'generatedAt': datetime.utcnow().isoformat(),
+                'target': args.target,
+                'workload': dict(workload.settings, users=len(workload.users), operations=len(workload.operations)),
+                'concurrency': args.concurrency,
+                'speed': args.speed,
+                'layout': args.layout if args.target == 'inprocess' else None,
+                'latencyScale': args.latency_scale if args.target == 'inprocess' else None,
+                **summary
+            }, output, indent=2)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    workload = Workload.load(args.workload) if args.workload else generate(args, rng)
+    if args.save:
+        workload.save(args.save)
+        print(f'Wrote {len(workload.operations)} operations for {len(workload.users)} users to {args.save}')
+        return
+
+    if args.target == 'http':
+        target = HttpTarget(args.endpoint, args.timeout)
+        task_ids = seed(target, workload.users)
+        samples, elapsed = asyncio.run(play(target, workload, task_ids, args.concurrency, args.speed))
+        report(args, workload, samples, elapsed)
+        return
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    aws = LocalAWS(scale=0, seed=args.seed)
+    setup_task_environment(aws)
+    with handler_directory(TASK_DIRECTORY, TASK_MODULES + ('router',)) as modules, open(os.devnull, 'w') as devnull:
+        aws.install(modules['aws_clients'])
+        target = InProcessTarget(modules, args.layout)
+        # The handlers log every request; keep that out of the report
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            task_ids = seed(target, workload.users)
+            aws.scale = args.latency_scale
+            samples, elapsed = asyncio.run(play(target, workload, task_ids, args.concurrency, args.speed))
+        finally:
+            sys.stdout = stdout
+    report(args, workload, samples, elapsed)
+
+
+if __name__ == '__main__':
+    main()
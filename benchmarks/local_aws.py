@@ -0,0 +1,1164 @@
+"""
+In-memory stand-in for the AWS services the handlers call
+
+LocalAWS emulates, closely enough for the handlers in lambda_functions/ and
+lambda/ to run unchanged:
+
+- DynamoDB tables with their GSIs (GetItem, PutItem, UpdateItem, DeleteItem,
+  Query, Scan, BatchGetItem, BatchWriteItem, TransactWriteItems), including
+  condition, filter, key, projection and update expressions given as strings
+  or as boto3 condition objects. As in DynamoDB, Limit counts the items
+  read before FilterExpression is applied, a failed condition cancels a
+  whole transaction, and BatchWriteItem can return UnprocessedItems
+  (set dynamodb.unprocessed_rate)
+- an S3 bucket (PutObject, GetObject, HeadObject, DeleteObject, presigned URLs)
+- Textract text detection with canned LINE blocks, sync and job-based
+- Comprehend detect_* and batch_detect_* with deterministic results
+
+Every call is counted per (service, operation) and can be slowed down by an
+injected latency, so a benchmark sees the same call pattern and roughly the
+same waiting time as in AWS. install() hands the stand-ins to a handler
+directory's aws_clients module through aws_clients.override().
+
+Values go through boto3's own TypeSerializer on the way in and out, so the
+handlers get Decimal numbers back and floats are rejected just as with the
+real service.
+"""
+import copy
+import hashlib
+import io
+import random
+import re
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from types import SimpleNamespace
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+# Mean injected latency per call, in seconds; (service, None) is the service default
+DEFAULT_LATENCY = {
+    ('dynamodb', None): 0.004,
+    ('dynamodb', 'TransactWriteItems'): 0.012,
+    ('s3', None): 0.015,
+    ('s3', 'GeneratePresignedUrl'): 0.0,
+    ('textract', None): 0.05,
+    ('textract', 'DetectDocumentText'): 0.4,
+    ('comprehend', None): 0.06,
+    ('comprehend', 'BatchDetectSentiment'): 0.15,
+    ('comprehend', 'BatchDetectEntities'): 0.15,
+    ('comprehend', 'BatchDetectKeyPhrases'): 0.15,
+}
+
+# Key schemas of the tables defined in template.yaml and the CloudFormation template:
+# name -> (hash key, range key, {index name: (hash key, range key)})
+TASK_TABLES = {
+    'Tasks': ('taskId', None, {
+        'UserIndex': ('userId', 'dueDate'),
+        'UserCreatedIndex': ('userId', 'createdAt'),
+    }),
+    'TaskIdempotency': ('idempotencyKey', None, {}),
+}
+DOCUMENT_TABLES = {
+    'DocumentMetadata': ('documentId', None, {
+        'UserIndex': ('userId', 'uploadDate'),
+    }),
+    'DocumentIndex': ('pk', 'sk', {}),
+    'DocumentIdempotency': ('idempotencyKey', None, {}),
+}
+
+MISSING = object()
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def client_error(code, message, operation, **extra):
+    """
+    The botocore ClientError the real service would raise
+    """
+    response = {'Error': {'Code': code, 'Message': message}}
+    response.update(extra)
+    return ClientError(response, operation)
+
+
+def clean(value):
+    """
+    Round-trip a value through the DynamoDB type system (ints become Decimal,
+    floats raise TypeError, sets stay sets) and return an independent copy
+    """
+    return _deserializer.deserialize(_serializer.serialize(value))
+
+
+# --- Expressions ---------------------------------------------------------------
+
+TOKEN = re.compile(
+    r'\s*(?:(?P<name>#[A-Za-z0-9_]+)|(?P<value>:[A-Za-z0-9_]+)|(?P<number>\d+)'
+    r'|(?P<ident>[A-Za-z_][A-Za-z0-9_]*)|(?P<op><>|<=|>=|=|<|>|\(|\)|,|\.|\[|\]|\+|-))'
+)
+COMPARATORS = ('=', '<>', '<', '<=', '>', '>=')
+CONDITION_FUNCTIONS = ('attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains')
+UPDATE_CLAUSES = ('SET', 'REMOVE', 'ADD', 'DELETE')
+
+
+class Expression:
+    """
+    Recursive-descent parser for the DynamoDB expression language, producing
+    small tuple trees evaluated by the functions below
+    """
+
+    def __init__(self, text, names, values):
+        self.tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = TOKEN.match(text, position)
+            if not match or match.end() == position:
+                raise ValueError(f'Invalid expression near {text[position:]!r}')
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind)))
+            position = match.end()
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, expected=None):
+        kind, text = self.peek()
+        if kind is None or (expected is not None and (text or '').upper() != expected):
+            raise ValueError(f'Expected {expected or "token"}, got {text!r}')
+        self.position += 1
+        return kind, text
+
+    def keyword(self, word):
+        kind, text = self.peek()
+        return kind == 'ident' and text.upper() == word
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # Paths and operands
+
+    def path(self):
+        kind, text = self.take()
+        if kind == 'name':
+            if text not in self.names:
+                raise ValueError(f'Undefined attribute name {text}')
+            segments = [self.names[text]]
+        elif kind == 'ident':
+            segments = [text]
+        else:
+            raise ValueError(f'Expected attribute path, got {text!r}')
+        while True:
+            _, text = self.peek()
+            if text == '.':
+                self.take()
+                kind, name = self.take()
+                segments.append(self.names[name] if kind == 'name' else name)
+            elif text == '[':
+                self.take()
+                segments.append(int(self.take()[1]))
+                self.take(']')
+            else:
+                return ('path', tuple(segments))
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.take()
+            if text not in self.values:
+                raise ValueError(f'Undefined attribute value {text}')
+            return ('value', self.values[text])
+        if kind == 'ident' and text.lower() == 'size' and self.peek(1)[1] == '(':
+            self.take()
+            self.take('(')
+            path = self.path()
+            self.take(')')
+            return ('size', path)
+        return self.path()
+
+    # Conditions
+
+    def condition(self):
+        node = self.conjunction()
+        while self.keyword('OR'):
+            self.take()
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.keyword('AND'):
+            self.take()
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.keyword('NOT'):
+            self.take()
+            return ('not', self.negation())
+        return self.primary()
+
+    def primary(self):
+        kind, text = self.peek()
+        if text == '(':
+            self.take()
+            node = self.condition()
+            self.take(')')
+            return node
+        if kind == 'ident' and text.lower() in CONDITION_FUNCTIONS and self.peek(1)[1] == '(':
+            self.take()
+            self.take('(')
+            arguments = [self.operand()]
+            while self.peek()[1] == ',':
+                self.take()
+                arguments.append(self.operand())
+            self.take(')')
+            return ('function', text.lower(), arguments)
+
+        left = self.operand()
+        kind, text = self.peek()
+        if text in COMPARATORS:
+            self.take()
+            return ('compare', text, left, self.operand())
+        if self.keyword('BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('AND')
+            return ('between', left, low, self.operand())
+        if self.keyword('IN'):
+            self.take()
+            self.take('(')
+            options = [self.operand()]
+            while self.peek()[1] == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return ('in', left, options)
+        raise ValueError(f'Expected a comparison, got {text!r}')
+
+    # Update expressions
+
+    def set_operand(self):
+        kind, text = self.peek()
+        if kind == 'ident' and text.lower() in ('if_not_exists', 'list_append') and self.peek(1)[1] == '(':
+            self.take()
+            self.take('(')
+            first = self.path() if text.lower() == 'if_not_exists' else self.set_operand()
+            self.take(',')
+            second = self.set_operand()
+            self.take(')')
+            return (text.lower(), first, second)
+        return self.operand()
+
+    def set_value(self):
+        node = self.set_operand()
+        _, text = self.peek()
+        if text in ('+', '-'):
+            self.take()
+            return ('plus' if text == '+' else 'minus', node, self.set_operand())
+        return node
+
+    def update_actions(self):
+        actions = []
+        while not self.done():
+            clause = self.take()[1].upper()
+            if clause not in UPDATE_CLAUSES:
+                raise ValueError(f'Unknown update clause {clause}')
+            while True:
+                path = self.path()
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append(('SET', path, self.set_value()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', path, None))
+                else:
+                    actions.append((clause, path, self.operand()))
+                if self.peek()[1] != ',':
+                    break
+                self.take()
+        return actions
+
+    def projection_paths(self):
+        paths = [self.path()]
+        while self.peek()[1] == ',':
+            self.take()
+            paths.append(self.path())
+        return paths
+
+
+def parse_condition(text, names, values):
+    parser = Expression(text, names, values)
+    node = parser.condition()
+    if not parser.done():
+        raise ValueError(f'Unexpected {parser.peek()[1]!r} in condition')
+    return node
+
+
+def parse_update(text, names, values):
+    return Expression(text, names, values).update_actions()
+
+
+def parse_projection(text, names):
+    return Expression(text, names, {}).projection_paths()
+
+
+def get_path(item, segments):
+    value = item
+    for segment in segments:
+        if isinstance(segment, int):
+            if not isinstance(value, list) or segment >= len(value):
+                return MISSING
+            value = value[segment]
+        else:
+            if not isinstance(value, dict) or segment not in value:
+                return MISSING
+            value = value[segment]
+    return value
+
+
+def set_path(item, segments, value):
+    parent = get_path(item, segments[:-1]) if len(segments) > 1 else item
+    last = segments[-1]
+    if isinstance(last, int):
+        if not isinstance(parent, list):
+            raise ValueError('Document path provided in the update expression is invalid for update')
+        if last < len(parent):
+            parent[last] = value
+        else:
+            parent.append(value)
+    else:
+        if not isinstance(parent, dict):
+            raise ValueError('The document path provided in the update expression is invalid for update')
+        parent[last] = value
+
+
+def remove_path(item, segments):
+    parent = get_path(item, segments[:-1]) if len(segments) > 1 else item
+    last = segments[-1]
+    if isinstance(last, int):
+        if isinstance(parent, list) and last < len(parent):
+            del parent[last]
+    elif isinstance(parent, dict):
+        parent.pop(last, None)
+
+
+def operand_value(node, item):
+    kind = node[0]
+    if kind == 'value':
+        return node[1]
+    if kind == 'path':
+        return get_path(item, node[1])
+    if kind == 'size':
+        value = get_path(item, node[1][1])
+        return MISSING if value is MISSING or value is None else len(value)
+    if kind == 'if_not_exists':
+        value = get_path(item, node[1][1])
+        return operand_value(node[2], item) if value is MISSING else value
+    if kind == 'list_append':
+        return list(operand_value(node[1], item)) + list(operand_value(node[2], item))
+    if kind in ('plus', 'minus'):
+        left, right = operand_value(node[1], item), operand_value(node[2], item)
+        return left + right if kind == 'plus' else left - right
+    raise ValueError(f'Unsupported operand {kind}')
+
+
+def comparable(left, right):
+    """
+    DynamoDB only compares values of the same type; anything else is false
+    """
+    if left is MISSING or right is MISSING:
+        return False
+    return type(left) is type(right) or (_is_number(left) and _is_number(right))
+
+
+def _is_number(value):
+    return isinstance(value, (int, Decimal)) and not isinstance(value, bool)
+
+
+def evaluate(node, item):
+    """
+    Evaluate a parsed condition against an item (a missing item is {})
+    """
+    kind = node[0]
+    if kind == 'and':
+        return evaluate(node[1], item) and evaluate(node[2], item)
+    if kind == 'or':
+        return evaluate(node[1], item) or evaluate(node[2], item)
+    if kind == 'not':
+        return not evaluate(node[1], item)
+    if kind == 'compare':
+        operator = node[1]
+        left, right = operand_value(node[2], item), operand_value(node[3], item)
+        if operator == '=':
+            return comparable(left, right) and left == right
+        if operator == '<>':
+            return not (comparable(left, right) and left == right)
+        if not comparable(left, right) or isinstance(left, (dict, list, set, bool)):
+            return False
+        return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+    if kind == 'between':
+        value, low, high = (operand_value(part, item) for part in node[1:])
+        return comparable(value, low) and comparable(value, high) and low <= value <= high
+    if kind == 'in':
+        value = operand_value(node[1], item)
+        return any(comparable(value, option) and value == option for option in (operand_value(part, item) for part in node[2]))
+    if kind == 'function':
+        name, arguments = node[1], node[2]
+        value = operand_value(arguments[0], item)
+        if name == 'attribute_exists':
+            return value is not MISSING
+        if name == 'attribute_not_exists':
+            return value is MISSING
+        if value is MISSING:
+            return False
+        argument = operand_value(arguments[1], item)
+        if name == 'begins_with':
+            return isinstance(value, (str, bytes)) and type(value) is type(argument) and value.startswith(argument)
+        if name == 'contains':
+            if isinstance(value, str):
+                return isinstance(argument, str) and argument in value
+            if isinstance(value, (list, set)):
+                return argument in value
+            return False
+        if name == 'attribute_type':
+            return _serializer._get_dynamodb_type(value) == argument
+    raise ValueError(f'Unsupported condition {kind}')
+
+
+def project(item, paths):
+    """
+    Copy only the projected paths of an item; list elements selected by index
+    come back as a shorter list, as DynamoDB returns them
+    """
+    result = {}
+    for _, segments in paths:
+        value = get_path(item, segments)
+        if value is MISSING:
+            continue
+        # List elements are collected by index first and compacted below
+        target = result
+        for segment in segments[:-1]:
+            target = target.setdefault(segment, {})
+        target[segments[-1]] = copy.deepcopy(value)
+    return _compact_lists(result, item)
+
+
+def _compact_lists(projected, original):
+    for name, value in list(projected.items()):
+        source = original.get(name) if isinstance(original, dict) else None
+        if isinstance(source, list) and isinstance(value, dict):
+            projected[name] = [_compact_lists(value[index], source[index]) if isinstance(value[index], dict) else value[index] for index in sorted(value)]
+        elif isinstance(value, dict) and isinstance(source, dict):
+            projected[name] = _compact_lists(value, source)
+    return projected
+
+
+class Request:
+    """
+    Expression arguments of one request, with boto3 condition objects turned
+    into strings and placeholders the way boto3 itself does it
+    """
+
+    def __init__(self, params):
+        self.names = dict(params.get('ExpressionAttributeNames') or {})
+        self.values = dict(params.get('ExpressionAttributeValues') or {})
+        self.builder = ConditionExpressionBuilder()
+
+    def condition(self, expression, is_key_condition=False):
+        if expression is None:
+            return None
+        if isinstance(expression, ConditionBase):
+            built = self.builder.build_expression(expression, is_key_condition=is_key_condition)
+            self.names.update(built.attribute_name_placeholders)
+            self.values.update(built.attribute_value_placeholders)
+            expression = built.condition_expression
+        return parse_condition(expression, self.names, self.values)
+
+    def projection(self, expression):
+        return parse_projection(expression, self.names) if expression else None
+
+    def update(self, expression):
+        return parse_update(expression, self.names, self.values)
+
+
+# --- DynamoDB ------------------------------------------------------------------
+
+class LocalTable:
+    """
+    One DynamoDB table: items by primary key, plus a partition map per GSI so
+    a Query only looks at the items of its partition
+    """
+
+    def __init__(self, aws, name, hash_key, range_key=None, indexes=None):
+        self.aws = aws
+        self.name = self.table_name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = {None: (hash_key, range_key)}
+        self.indexes.update(indexes or {})
+        self.items = {}
+        self.partitions = {index: {} for index in self.indexes}
+        self.lock = threading.RLock()
+
+    # Keys
+
+    @property
+    def key_attributes(self):
+        return tuple(name for name in (self.hash_key, self.range_key) if name)
+
+    def key_of(self, item):
+        try:
+            return tuple(item[name] for name in self.key_attributes)
+        except KeyError as e:
+            raise client_error('ValidationException', f'Missing the key {e.args[0]} in the item', 'PutItem')
+
+    def _index_entry(self, index, item):
+        hash_key, range_key = self.indexes[index]
+        if hash_key not in item or (range_key and range_key not in item):
+            return None
+        return item[hash_key]
+
+    def _store(self, key, item):
+        """
+        Replace the item at key (None deletes it), keeping the partition maps in step
+        """
+        old = self.items.pop(key, None)
+        if old is not None:
+            for index in self.indexes:
+                partition = self._index_entry(index, old)
+                if partition is not None:
+                    members = self.partitions[index].get(partition)
+                    if members is not None:
+                        members.discard(key)
+                        if not members:
+                            del self.partitions[index][partition]
+        if item is not None:
+            self.items[key] = item
+            for index in self.indexes:
+                partition = self._index_entry(index, item)
+                if partition is not None:
+                    self.partitions[index].setdefault(partition, set()).add(key)
+        return old
+
+    def seed(self, items):
+        """
+        Load items directly, without latency or call counting
+        """
+        with self.lock:
+            for item in items:
+                item = clean(item)
+                self._store(self.key_of(item), item)
+
+    def _check(self, request, params, current, operation):
+        condition = request.condition(params.get('ConditionExpression'))
+        if condition is not None and not evaluate(condition, current or {}):
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', operation)
+
+    # Item operations
+
+    def get_item(self, Key, **params):
+        self.aws.record('dynamodb', 'GetItem')
+        request = Request(params)
+        with self.lock:
+            item = self.items.get(self.key_of(Key))
+            if item is None:
+                return {}
+            projection = request.projection(params.get('ProjectionExpression'))
+            return {'Item': project(item, projection) if projection else copy.deepcopy(item)}
+
+    def put_item(self, Item, **params):
+        self.aws.record('dynamodb', 'PutItem')
+        return self._put(Item, params, 'PutItem')
+
+    def _put(self, item, params, operation):
+        item = clean(item)
+        request = Request(params)
+        with self.lock:
+            key = self.key_of(item)
+            current = self.items.get(key)
+            self._check(request, params, current, operation)
+            self._store(key, item)
+        if params.get('ReturnValues') == 'ALL_OLD' and current is not None:
+            return {'Attributes': copy.deepcopy(current)}
+        return {}
+
+    def delete_item(self, Key, **params):
+        self.aws.record('dynamodb', 'DeleteItem')
+        return self._delete(Key, params, 'DeleteItem')
+
+    def _delete(self, key_item, params, operation):
+        request = Request(params)
+        with self.lock:
+            key = self.key_of(key_item)
+            current = self.items.get(key)
+            self._check(request, params, current, operation)
+            self._store(key, None)
+        if params.get('ReturnValues') == 'ALL_OLD' and current is not None:
+            return {'Attributes': current}
+        return {}
+
+    def update_item(self, Key, **params):
+        self.aws.record('dynamodb', 'UpdateItem')
+        return self._update(Key, params, 'UpdateItem')
+
+    def _update(self, key_item, params, operation):
+        request = Request(params)
+        actions = request.update(params['UpdateExpression'])
+        with self.lock:
+            key = self.key_of(key_item)
+            current = self.items.get(key)
+            self._check(request, params, current, operation)
+            item = copy.deepcopy(current) if current is not None else clean(dict(key_item))
+            touched = []
+            for action, (_, segments), operand in actions:
+                touched.append(segments[0])
+                if action == 'SET':
+                    set_path(item, segments, clean(operand_value(operand, item)))
+                elif action == 'REMOVE':
+                    remove_path(item, segments)
+                elif action == 'ADD':
+                    value = clean(operand_value(operand, item))
+                    existing = get_path(item, segments)
+                    if isinstance(value, set):
+                        set_path(item, segments, (existing if existing is not MISSING else set()) | value)
+                    else:
+                        set_path(item, segments, (existing if existing is not MISSING else 0) + value)
+                elif action == 'DELETE':
+                    existing = get_path(item, segments)
+                    if existing is not MISSING:
+                        remaining = existing - clean(operand_value(operand, item))
+                        if remaining:
+                            set_path(item, segments, remaining)
+                        else:
+                            remove_path(item, segments)
+            self._store(key, item)
+
+        return_values = params.get('ReturnValues', 'NONE')
+        if return_values == 'ALL_NEW':
+            return {'Attributes': copy.deepcopy(item)}
+        if return_values == 'ALL_OLD':
+            return {'Attributes': copy.deepcopy(current)} if current else {}
+        if return_values in ('UPDATED_OLD', 'UPDATED_NEW'):
+            source = (current or {}) if return_values == 'UPDATED_OLD' else item
+            attributes = {name: copy.deepcopy(source[name]) for name in touched if name in source}
+            return {'Attributes': attributes} if attributes else {}
+        return {}
+
+    # Reads
+
+    def _sort_key(self, index, item):
+        _, range_key = self.indexes[index]
+        table_key = tuple(str(part) for part in self.key_of(item))
+        return (item[range_key], table_key) if range_key else table_key
+
+    def _last_key(self, index, item):
+        names = set(self.key_attributes)
+        names.update(name for name in self.indexes[index] if name)
+        return {name: copy.deepcopy(item[name]) for name in names}
+
+    def _read(self, operation, candidates, index, params, request, key_condition=None, reverse=False):
+        filter_condition = request.condition(params.get('FilterExpression'))
+        projection = request.projection(params.get('ProjectionExpression'))
+        limit = params.get('Limit')
+
+        ordered = sorted(candidates, key=lambda item: self._sort_key(index, item), reverse=reverse)
+        start_key = params.get('ExclusiveStartKey')
+        if start_key:
+            boundary = self._sort_key(index, clean(start_key))
+            ordered = [item for item in ordered if (self._sort_key(index, item) < boundary if reverse else self._sort_key(index, item) > boundary)]
+
+        items = []
+        scanned = 0
+        last_key = None
+        for position, item in enumerate(ordered):
+            if key_condition is not None and not evaluate(key_condition, item):
+                continue
+            scanned += 1
+            if filter_condition is None or evaluate(filter_condition, item):
+                items.append(project(item, projection) if projection else copy.deepcopy(item))
+            if limit is not None and scanned >= limit:
+                if position < len(ordered) - 1:
+                    last_key = self._last_key(index, item)
+                break
+
+        response = {'Count': len(items), 'ScannedCount': scanned}
+        if params.get('Select') != 'COUNT':
+            response['Items'] = items
+        if last_key:
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def query(self, **params):
+        self.aws.record('dynamodb', 'Query')
+        request = Request(params)
+        index = params.get('IndexName')
+        if index not in self.indexes:
+            raise client_error('ValidationException', f'The table does not have the specified index: {index}', 'Query')
+        key_condition = request.condition(params['KeyConditionExpression'], is_key_condition=True)
+        partition = _partition_value(key_condition, self.indexes[index][0])
+        with self.lock:
+            candidates = [self.items[key] for key in self.partitions[index].get(partition, ())]
+            return self._read('Query', candidates, index, params, request, key_condition, reverse=params.get('ScanIndexForward', True) is False)
+
+    def scan(self, **params):
+        self.aws.record('dynamodb', 'Scan')
+        request = Request(params)
+        index = params.get('IndexName')
+        with self.lock:
+            candidates = [item for item in self.items.values() if index is None or self._index_entry(index, item) is not None]
+            return self._read('Scan', candidates, index, params, request)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return LocalBatchWriter(self)
+
+
+def _partition_value(node, hash_key):
+    """
+    The value a key condition fixes for the partition key
+    """
+    if node[0] == 'and':
+        for part in node[1:]:
+            value = _partition_value(part, hash_key)
+            if value is not MISSING:
+                return value
+        return MISSING
+    if node[0] == 'compare' and node[1] == '=' and node[2][0] == 'path' and node[2][1] == (hash_key,):
+        return node[3][1]
+    return MISSING
+
+
+class LocalBatchWriter:
+    """
+    Table.batch_writer(): buffers writes and sends them 25 at a time
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def put_item(self, Item):
+        self.pending.append({'PutRequest': {'Item': Item}})
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.pending.append({'DeleteRequest': {'Key': Key}})
+        if len(self.pending) >= 25:
+            self.flush()
+
+    def flush(self):
+        while self.pending:
+            chunk, self.pending = self.pending[:25], self.pending[25:]
+            response = self.table.aws.dynamodb.batch_write_item(RequestItems={self.table.name: chunk})
+            # Like boto3, resend whatever came back unprocessed
+            self.pending.extend(response['UnprocessedItems'].get(self.table.name, []))
+
+
+class LocalDynamoDBClient:
+    """
+    The parts of resource.meta.client the handlers use
+    """
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    def update_item(self, TableName, Key, **params):
+        return self.dynamodb.Table(TableName).update_item(Key=Key, **params)
+
+    def transact_write_items(self, TransactItems, **params):
+        aws = self.dynamodb.aws
+        aws.record('dynamodb', 'TransactWriteItems')
+        if len(TransactItems) > 100:
+            raise client_error('ValidationException', 'Member must have length less than or equal to 100', 'TransactWriteItems')
+
+        tables = []
+        for action in TransactItems:
+            (kind, spec), = action.items()
+            tables.append(self.dynamodb.Table(spec['TableName']))
+        locks = sorted({id(table): table for table in tables}.values(), key=id)
+        for table in locks:
+            table.lock.acquire()
+        try:
+            reasons = []
+            for action, table in zip(TransactItems, tables):
+                (kind, spec), = action.items()
+                request = Request(spec)
+                condition = request.condition(spec.get('ConditionExpression'))
+                key = table.key_of(spec['Item'] if kind == 'Put' else spec['Key'])
+                if condition is not None and not evaluate(condition, table.items.get(key) or {}):
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+                else:
+                    reasons.append({'Code': 'None'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise client_error(
+                    'TransactionCanceledException',
+                    'Transaction cancelled, please refer cancellation reasons for specific reasons',
+                    'TransactWriteItems',
+                    CancellationReasons=reasons
+                )
+            for action, table in zip(TransactItems, tables):
+                (kind, spec), = action.items()
+                spec = {name: value for name, value in spec.items() if name != 'ConditionExpression'}
+                if kind == 'Put':
+                    table._put(spec['Item'], spec, 'TransactWriteItems')
+                elif kind == 'Update':
+                    table._update(spec['Key'], spec, 'TransactWriteItems')
+                elif kind == 'Delete':
+                    table._delete(spec['Key'], spec, 'TransactWriteItems')
+        finally:
+            for table in locks:
+                table.lock.release()
+        return {}
+
+
+class LocalDynamoDB:
+    """
+    Stand-in for boto3.resource('dynamodb')
+    """
+
+    def __init__(self, aws):
+        self.aws = aws
+        self.tables = {}
+        self.meta = SimpleNamespace(client=LocalDynamoDBClient(self))
+        # Fraction of BatchWriteItem requests handed back as UnprocessedItems,
+        # as DynamoDB does when a partition is throttled
+        self.unprocessed_rate = 0.0
+
+    def create_table(self, name, hash_key, range_key=None, indexes=None):
+        self.tables[name] = LocalTable(self.aws, name, hash_key, range_key, indexes)
+        return self.tables[name]
+
+    def Table(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise client_error('ResourceNotFoundException', f'Requested resource not found: Table: {name} not found', 'DescribeTable')
+
+    def batch_get_item(self, RequestItems, **params):
+        self.aws.record('dynamodb', 'BatchGetItem')
+        if sum(len(spec['Keys']) for spec in RequestItems.values()) > 100:
+            raise client_error('ValidationException', 'Too many items requested for the BatchGetItem call', 'BatchGetItem')
+        responses = {}
+        for name, spec in RequestItems.items():
+            table = self.Table(name)
+            request = Request(spec)
+            projection = request.projection(spec.get('ProjectionExpression'))
+            found = []
+            with table.lock:
+                for key in spec['Keys']:
+                    item = table.items.get(table.key_of(key))
+                    if item is not None:
+                        found.append(project(item, projection) if projection else copy.deepcopy(item))
+            responses[name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **params):
+        self.aws.record('dynamodb', 'BatchWriteItem')
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise client_error('ValidationException', 'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            table = self.Table(name)
+            for request in requests:
+                if self.unprocessed_rate and self.aws.random.random() < self.unprocessed_rate:
+                    unprocessed.setdefault(name, []).append(request)
+                elif 'PutRequest' in request:
+                    table._put(request['PutRequest']['Item'], {}, 'BatchWriteItem')
+                else:
+                    table._delete(request['DeleteRequest']['Key'], {}, 'BatchWriteItem')
+        return {'UnprocessedItems': unprocessed}
+
+
+# --- S3 ------------------------------------------------------------------------
+
+class LocalS3:
+    """
+    Stand-in for the S3 client: objects in memory, keyed by (bucket, key)
+    """
+
+    def __init__(self, aws):
+        self.aws = aws
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def seed(self, bucket, key, body):
+        self.objects[(bucket, key)] = body.encode('utf-8') if isinstance(body, str) else bytes(body)
+
+    def put_object(self, Bucket, Key, Body=b'', **params):
+        self.aws.record('s3', 'PutObject')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            self.objects[(Bucket, Key)] = data
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def _object(self, bucket, key, operation):
+        with self.lock:
+            data = self.objects.get((bucket, key))
+        if data is None:
+            code = 'NoSuchKey' if operation == 'GetObject' else '404'
+            raise client_error(code, 'The specified key does not exist.', operation)
+        return data
+
+    def get_object(self, Bucket, Key, **params):
+        self.aws.record('s3', 'GetObject')
+        data = self._object(Bucket, Key, 'GetObject')
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def head_object(self, Bucket, Key, **params):
+        self.aws.record('s3', 'HeadObject')
+        data = self._object(Bucket, Key, 'HeadObject')
+        return {'ContentLength': len(data), 'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def delete_object(self, Bucket, Key, **params):
+        self.aws.record('s3', 'DeleteObject')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        self.aws.record('s3', 'GeneratePresignedUrl')
+        Params = Params or {}
+        return f"https://{Params.get('Bucket')}.s3.local/{Params.get('Key')}?X-Amz-Expires={ExpiresIn}"
+
+
+# --- Textract --------------------------------------------------------------------
+
+class LocalTextract:
+    """
+    Stand-in for Textract: the "OCR" result of an object is its UTF-8 text,
+    one LINE block per line. Jobs finish after job_polls status checks.
+    """
+
+    def __init__(self, aws, job_polls=0):
+        self.aws = aws
+        self.jobs = {}
+        self.job_polls = job_polls
+        self.lock = threading.Lock()
+
+    def _lines(self, bucket, key, operation):
+        try:
+            data = self.aws.s3._object(bucket, key, operation)
+        except ClientError:
+            raise client_error('InvalidS3ObjectException', 'Unable to get object metadata from S3.', operation)
+        text = data.decode('utf-8', errors='replace')
+        return [line for line in text.splitlines() if line.strip()]
+
+    @staticmethod
+    def _blocks(lines):
+        blocks = []
+        for line in lines:
+            blocks.append({'BlockType': 'LINE', 'Text': line, 'Confidence': 99.0})
+            blocks.extend({'BlockType': 'WORD', 'Text': word, 'Confidence': 99.0} for word in line.split())
+        return blocks
+
+    def detect_document_text(self, Document, **params):
+        self.aws.record('textract', 'DetectDocumentText')
+        location = Document['S3Object']
+        return {'Blocks': self._blocks(self._lines(location['Bucket'], location['Name'], 'DetectDocumentText'))}
+
+    def start_document_text_detection(self, DocumentLocation, ClientRequestToken=None, JobTag=None, **params):
+        self.aws.record('textract', 'StartDocumentTextDetection')
+        location = DocumentLocation['S3Object']
+        job_id = hashlib.sha1(f"{ClientRequestToken or time.time_ns()}:{location['Name']}".encode()).hexdigest()
+        with self.lock:
+            if job_id not in self.jobs:
+                self.jobs[job_id] = {
+                    'blocks': self._blocks(self._lines(location['Bucket'], location['Name'], 'StartDocumentTextDetection')),
+                    'polls': self.job_polls
+                }
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId, MaxResults=1000, NextToken=None, **params):
+        self.aws.record('textract', 'GetDocumentTextDetection')
+        with self.lock:
+            job = self.jobs.get(JobId)
+            if job is None:
+                raise client_error('InvalidJobIdException', 'Request has invalid Job Id', 'GetDocumentTextDetection')
+            if job['polls'] > 0:
+                job['polls'] -= 1
+                return {'JobStatus': 'IN_PROGRESS'}
+        start = int(NextToken or 0)
+        response = {'JobStatus': 'SUCCEEDED', 'Blocks': job['blocks'][start:start + MaxResults]}
+        if start + MaxResults < len(job['blocks']):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+
+# --- Comprehend ------------------------------------------------------------------
+
+POSITIVE_WORDS = frozenset(('good', 'great', 'excellent', 'happy', 'success', 'improved', 'growth', 'win', 'approved'))
+NEGATIVE_WORDS = frozenset(('bad', 'poor', 'failure', 'failed', 'loss', 'risk', 'late', 'problem', 'declined'))
+ENTITY_PATTERN = re.compile(r'\b[A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)*')
+KNOWN_ENTITIES = {
+    'Amazon': 'ORGANIZATION', 'Acme': 'ORGANIZATION', 'Globex': 'ORGANIZATION',
+    'Seattle': 'LOCATION', 'London': 'LOCATION', 'Berlin': 'LOCATION',
+    'Alice': 'PERSON', 'Bob': 'PERSON', 'Carol': 'PERSON',
+    'January': 'DATE', 'Monday': 'DATE',
+}
+
+
+class LocalComprehend:
+    """
+    Stand-in for Comprehend with deterministic, cheap "analysis": sentiment
+    from word lists, entities from capitalised words, key phrases from
+    word pairs. Enforces the 5000-byte and 25-text limits.
+    """
+
+    MAX_TEXT_BYTES = 5000
+    MAX_BATCH_TEXTS = 25
+
+    def __init__(self, aws):
+        self.aws = aws
+
+    def _check(self, text, operation):
+        if len(text.encode('utf-8')) > self.MAX_TEXT_BYTES:
+            raise client_error('TextSizeLimitExceededException', 'Input text size exceeds limit.', operation)
+
+    def _sentiment(self, text):
+        words = re.findall(r'[a-z]+', text.lower())
+        positive = sum(word in POSITIVE_WORDS for word in words)
+        negative = sum(word in NEGATIVE_WORDS for word in words)
+        total = positive + negative + 1
+        scores = {
+            'Positive': round(positive / total * 0.9, 4),
+            'Negative': round(negative / total * 0.9, 4),
+            'Neutral': round(1 / total * 0.9, 4),
+            'Mixed': 0.1 if positive and negative else 0.0
+        }
+        label = max(scores, key=scores.get)
+        return {'Sentiment': label.upper(), 'SentimentScore': scores}
+
+    def _entities(self, text):
+        entities = []
+        for match in ENTITY_PATTERN.finditer(text):
+            first = match.group().split()[0]
+            entity_type = KNOWN_ENTITIES.get(first)
+            if entity_type is None and match.start() > 0 and text[match.start() - 2:match.start()].strip() not in ('.', ''):
+                entity_type = 'OTHER'
+            if entity_type:
+                entities.append({'Text': match.group(), 'Type': entity_type, 'Score': 0.95, 'BeginOffset': match.start(), 'EndOffset': match.end()})
+        return {'Entities': entities}
+
+    def _key_phrases(self, text):
+        phrases = []
+        for match in re.finditer(r'\b([a-z]{4,}) ([a-z]{4,})\b', text):
+            phrases.append({'Text': match.group(), 'Score': 0.9, 'BeginOffset': match.start(), 'EndOffset': match.end()})
+            if len(phrases) == 20:
+                break
+        return {'KeyPhrases': phrases}
+
+    def detect_sentiment(self, Text, LanguageCode='en', **params):
+        self.aws.record('comprehend', 'DetectSentiment')
+        self._check(Text, 'DetectSentiment')
+        return self._sentiment(Text)
+
+    def detect_entities(self, Text, LanguageCode='en', **params):
+        self.aws.record('comprehend', 'DetectEntities')
+        self._check(Text, 'DetectEntities')
+        return self._entities(Text)
+
+    def detect_key_phrases(self, Text, LanguageCode='en', **params):
+        self.aws.record('comprehend', 'DetectKeyPhrases')
+        self._check(Text, 'DetectKeyPhrases')
+        return self._key_phrases(Text)
+
+    def _batch(self, operation, analyze, texts):
+        self.aws.record('comprehend', operation)
+        if len(texts) > self.MAX_BATCH_TEXTS:
+            raise client_error('BatchSizeLimitExceededException', 'The number of documents in the request exceeds the limit of 25.', operation)
+        results, errors = [], []
+        for index, text in enumerate(texts):
+            if len(text.encode('utf-8')) > self.MAX_TEXT_BYTES:
+                errors.append({'Index': index, 'ErrorCode': 'TEXT_SIZE_LIMIT_EXCEEDED', 'ErrorMessage': 'Document size exceeds limit'})
+            else:
+                results.append(dict(analyze(text), Index=index))
+        return {'ResultList': results, 'ErrorList': errors}
+
+    def batch_detect_sentiment(self, TextList, LanguageCode='en', **params):
+        return self._batch('BatchDetectSentiment', self._sentiment, TextList)
+
+    def batch_detect_entities(self, TextList, LanguageCode='en', **params):
+        return self._batch('BatchDetectEntities', self._entities, TextList)
+
+    def batch_detect_key_phrases(self, TextList, LanguageCode='en', **params):
+        return self._batch('BatchDetectKeyPhrases', self._key_phrases, TextList)
+
+
+# --- The whole stand-in ------------------------------------------------------------
+
+class LocalAWS:
+    """
+    All stand-in services, with per-call latency injection and call counting
+
+    latency maps (service, operation) to a mean delay in seconds, with
+    (service, None) as the service default; scale multiplies every delay
+    (0 turns injection off) and jitter spreads each one uniformly by that
+    fraction.
+    """
+
+    def __init__(self, latency=None, scale=1.0, jitter=0.2, seed=None, textract_job_polls=0):
+        self.latency = dict(DEFAULT_LATENCY if latency is None else latency)
+        self.scale = scale
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.calls_lock = threading.Lock()
+        self.dynamodb = LocalDynamoDB(self)
+        self.s3 = LocalS3(self)
+        self.textract = LocalTextract(self, textract_job_polls)
+        self.comprehend = LocalComprehend(self)
+
+    def record(self, service, operation):
+        """
+        Count a call and wait for its injected latency
+        """
+        with self.calls_lock:
+            self.calls[(service, operation)] += 1
+            delay = self.latency.get((service, operation), self.latency.get((service, None), 0.0)) * self.scale
+            if delay and self.jitter:
+                delay *= self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def create_tables(self, schemas, suffix=''):
+        """
+        Create tables from a {name: (hash, range, indexes)} map such as
+        TASK_TABLES; returns {name: table name with suffix}
+        """
+        names = {}
+        for name, (hash_key, range_key, indexes) in schemas.items():
+            names[name] = f'{name}{suffix}'
+            self.dynamodb.create_table(names[name], hash_key, range_key, indexes)
+        return names
+
+    def install(self, aws_clients):
+        """
+        Make a handler directory's aws_clients module hand out these stand-ins
+        """
+        aws_clients.reset()
+        aws_clients.override('dynamodb', client_stub=self.dynamodb.meta.client, resource_stub=self.dynamodb)
+        aws_clients.override('s3', client_stub=self.s3)
+        aws_clients.override('textract', client_stub=self.textract)
+        aws_clients.override('comprehend', client_stub=self.comprehend)
+
+    def snapshot(self):
+        """
+        A copy of the call counters, to diff around a measured block
+        """
+        with self.calls_lock:
+            return Counter(self.calls)
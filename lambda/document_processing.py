@@ -1,176 +1,437 @@
 import json
-import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from botocore.exceptions import ClientError
+from decimal import Decimal
+from urllib.parse import unquote_plus
 
-def lambda_handler(event, context):
+import aws_clients
+import metrics
+import result_cache
+import search_index
+import text_analysis
+import text_store
+import textract_jobs
+
+# Documents from one S3 event processed side by side
+MAX_PARALLEL_DOCUMENTS = int(os.environ.get('MAX_PARALLEL_DOCUMENTS', '4'))
+
+# Stored as the text when neither Textract nor a UTF-8 read works
+EXTRACTION_FAILED_TEXT = "Unable to extract text from document"
+
+def parse_targets(event, default_bucket):
     """
-    Lambda function to process uploaded documents
-    Uses Textract for OCR and Comprehend for AI analysis
+    List the work items in an event: S3 uploads to process, or Textract job
+    completions (SNS notifications or a direct {"jobId": ...} invocation)
     """
+    if 'Records' in event:
+        targets = []
+        for record in event['Records']:
+            if 'Sns' in record:
+                # Textract job completion notification
+                targets.append(textract_jobs.parse_completion(record))
+            else:
+                # S3 trigger event; object keys arrive URL-encoded
+                key = unquote_plus(record['s3']['object']['key'])
+                if text_store.is_text_key(key):
+                    # Our own extracted-text objects are not documents
+                    continue
+                targets.append({'bucket': record['s3']['bucket']['name'], 'key': key})
+        return targets
+    
+    # Direct invocation
+    if event.get('jobId'):
+        return [{
+            'jobId': event['jobId'],
+            'jobStatus': event.get('jobStatus', 'SUCCEEDED'),
+            'documentId': event.get('documentId'),
+            'bucket': event.get('bucket', default_bucket),
+            'key': event.get('key')
+        }]
+    return [{'bucket': event.get('bucket', default_bucket), 'key': event.get('key')}]
+
+def document_id_from_key(key):
+    """
+    Documents are stored as documents/{userId}/{documentId}/{fileName}
+    """
+    return key.split('/')[-2] if '/' in key else key.split('/')[-1]
+
+def document_owner(table, document_id, key):
+    """
+    The userId a document belongs to, from its S3 key or its metadata item
+    """
+    parts = (key or '').split('/')
+    if len(parts) == 4 and parts[0] == 'documents':
+        return parts[1]
+    item = table.get_item(Key={'documentId': document_id}, ProjectionExpression='userId').get('Item') or {}
+    return item.get('userId', 'anonymous')
+
+def extract_text_sync(bucket, key):
+    """
+    Extract text from a single-page image with detect_document_text, falling
+    back to reading the object as UTF-8 text
+    """
+    # Imported here so loading the module does not pull in botocore
+    from botocore.exceptions import ClientError
+    
+    textract_client = aws_clients.client('textract')
+    
+    # Extract text using Textract
     try:
-        # Initialize AWS clients
-        textract_client = boto3.client('textract')
-        comprehend_client = boto3.client('comprehend')
-        dynamodb = boto3.resource('dynamodb')
-        
-        # Get environment variables
-        bucket_name = os.environ['DOCUMENT_BUCKET']
-        table_name = os.environ['METADATA_TABLE']
-        
-        # Parse S3 event or direct invocation
-        if 'Records' in event:
-            # S3 trigger event
-            record = event['Records'][0]
-            bucket = record['s3']['bucket']['name']
-            key = record['s3']['object']['key']
-        else:
-            # Direct invocation
-            bucket = event.get('bucket', bucket_name)
-            key = event.get('key')
-        
-        if not key:
-            raise ValueError("No document key provided")
-        
-        # Extract document ID from S3 key
-        document_id = key.split('/')[-2] if '/' in key else key.split('/')[-1]
-        
-        print(f"Processing document: {key}")
-        
-        # Update status to processing
-        table = dynamodb.Table(table_name)
-        table.update_item(
-            Key={'documentId': document_id},
-            UpdateExpression='SET #status = :status, processingStartedAt = :started_at',
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={
-                ':status': 'processing',
-                ':started_at': datetime.utcnow().isoformat()
+        textract_response = textract_client.detect_document_text(
+            Document={
+                'S3Object': {
+                    'Bucket': bucket,
+                    'Name': key
+                }
             }
         )
         
+        # Extract text from Textract response
         extracted_text = ""
-        sentiment_result = None
-        entities_result = None
-        key_phrases_result = None
+        for block in textract_response['Blocks']:
+            if block['BlockType'] == 'LINE':
+                extracted_text += block['Text'] + '\n'
         
-        # Extract text using Textract
+    except ClientError as e:
+        print(f"Textract error: {str(e)}")
+        # If Textract fails, try to read as text file
         try:
-            textract_response = textract_client.detect_document_text(
-                Document={
-                    'S3Object': {
-                        'Bucket': bucket,
-                        'Name': key
-                    }
-                }
-            )
+            s3_client = aws_clients.client('s3')
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+            extracted_text = response['Body'].read().decode('utf-8')
+        except:
+            extracted_text = EXTRACTION_FAILED_TEXT
+    
+    return extracted_text
+
+def content_digest(bucket, key):
+    """
+    Content hash of an upload for the result cache, or None when the cache
+    is off or the hash cannot be read
+    """
+    from botocore.exceptions import ClientError
+    
+    if not result_cache.enabled() or not bucket or not key:
+        return None
+    try:
+        return result_cache.content_hash(bucket, key)
+    except ClientError as e:
+        print(f"Could not read content hash of {key}: {str(e)}")
+        return None
+
+def extract_text_from_job(job_id):
+    """
+    Assemble the text of a finished asynchronous job, streaming result pages
+    """
+    return ''.join(line + '\n' for line in textract_jobs.iter_text_lines(job_id))
+
+def analyze_documents(texts):
+    """
+    Run Comprehend over the full extracted text of each document
+    Texts are split into chunks within the Comprehend byte limit; a lone chunk
+    uses three concurrent detect_* calls, otherwise the chunks of every
+    document share batch_detect_* calls of up to 25 texts
+    Returns one merged (sentiment_result, entities_result, key_phrases_result)
+    per text, and per text whether every Comprehend call for it succeeded
+    """
+    from botocore.exceptions import ClientError
+    
+    analyses = [(None, None, None)] * len(texts)
+    complete = [True] * len(texts)
+    
+    # Analyze text with Comprehend only where text was extracted
+    chunked = [(i, text_analysis.split_into_chunks(text)) for i, text in enumerate(texts) if text and len(text.strip()) > 0]
+    chunk_texts = [chunk for _, chunks in chunked for _, chunk in chunks]
+    if not chunk_texts:
+        return analyses, complete
+    
+    try:
+        if len(chunk_texts) == 1:
+            results = [text_analysis.analyze_text(chunk_texts[0])]
+        else:
+            results = text_analysis.analyze_texts_batch(chunk_texts)
+    except ClientError as e:
+        print(f"Comprehend error: {str(e)}")
+        # Stored as UNKNOWN sentiment with no entities or key phrases
+        results = [(None, None, None)] * len(chunk_texts)
+    
+    position = 0
+    for i, chunks in chunked:
+        chunk_results = results[position:position + len(chunks)]
+        analyses[i] = text_analysis.merge_chunk_analyses(chunks, chunk_results)
+        complete[i] = all(part is not None for result in chunk_results for part in result)
+        position += len(chunks)
+    return analyses, complete
+
+def to_dynamodb(value):
+    """
+    Convert Comprehend output for DynamoDB, which rejects floats
+    """
+    return json.loads(json.dumps(value), parse_float=Decimal)
+
+def store_results(table, bucket_name, document_id, extracted_text, sentiment_result, entities_result, key_phrases_result):
+    """
+    Update document metadata with processing results
+    The full text goes to S3; the item keeps a pointer, a preview and the length
+    Only the best entities and key phrases are kept (text_analysis.capped),
+    but entityTypes covers every entity
+    """
+    entity_types = sorted({entity['Type'] for entity in (entities_result or {}).get('Entities', []) if entity.get('Type')})
+    _, entities_result, key_phrases_result = text_analysis.capped((sentiment_result, entities_result, key_phrases_result))
+    text_key = text_store.save_text(bucket_name, document_id, extracted_text)
+    
+    update_expression = 'SET #status = :status, processedAt = :processed_at, extractedTextKey = :text_key, extractedTextPreview = :text_preview, extractedTextLength = :text_length'
+    expression_attribute_names = {'#status': 'status'}
+    expression_attribute_values = {
+        ':status': 'completed',
+        ':processed_at': datetime.utcnow().isoformat(),
+        ':text_key': text_key,
+        ':text_preview': text_store.preview(extracted_text),
+        ':text_length': len(extracted_text)
+    }
+    
+    if sentiment_result:
+        update_expression += ', sentiment = :sentiment, sentimentScore = :sentiment_score'
+        expression_attribute_values[':sentiment'] = sentiment_result.get('Sentiment', 'UNKNOWN')
+        expression_attribute_values[':sentiment_score'] = to_dynamodb(sentiment_result.get('SentimentScore', {}))
+    
+    if entities_result:
+        update_expression += ', entities = :entities, entityTypes = :entity_types'
+        expression_attribute_values[':entities'] = to_dynamodb(entities_result.get('Entities', []))
+        # Compact summary for search facets, so they do not need the full entity list
+        expression_attribute_values[':entity_types'] = entity_types
+    
+    if key_phrases_result:
+        update_expression += ', keyPhrases = :key_phrases'
+        expression_attribute_values[':key_phrases'] = to_dynamodb(key_phrases_result.get('KeyPhrases', []))
+    
+    # Drop any inline text left by earlier versions
+    update_expression += ' REMOVE extractedText'
+    
+    table.update_item(
+        Key={'documentId': document_id},
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames=expression_attribute_names,
+        ExpressionAttributeValues=expression_attribute_values
+    )
+
+def set_status(table, document_id, status, **attributes):
+    """
+    Set the document status together with any extra attributes
+    """
+    update_expression = 'SET #status = :status'
+    expression_attribute_values = {':status': status}
+    for name, value in attributes.items():
+        update_expression += f', {name} = :{name}'
+        expression_attribute_values[f':{name}'] = value
+    table.update_item(
+        Key={'documentId': document_id},
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues=expression_attribute_values
+    )
+
+def fail_document(table, document_id, key, error):
+    """
+    Mark a document as failed and build its result entry
+    """
+    print(f"Error processing {key or document_id}: {str(error)}")
+    
+    # Update document status to failed
+    try:
+        if document_id:
+            set_status(table, document_id, 'failed', errorMessage=str(error))
+    except:
+        pass
+    
+    return {
+        'documentId': document_id,
+        'key': key,
+        'status': 'failed',
+        'error': str(error)
+    }
+
+def extract_document(target, table_name, context=None):
+    """
+    Run OCR for one document
+    Returns a result with status 'extracted' and the text, or a final result
+    Multi-page documents start an asynchronous Textract job and are finished
+    when its completion notification arrives
+    Content processed before is not sent to Textract: the result then also
+    carries the cached analysis
+    """
+    table = aws_clients.table(table_name)
+    key = target.get('key')
+    document_id = target.get('documentId')
+    
+    try:
+        if 'jobId' in target:
+            # Textract job completion: stream the results and finish the document
+            if not document_id:
+                raise ValueError("Job completion without a documentId")
+            print(f"Textract job {target['jobId']} for {document_id}: {target['jobStatus']}")
+            if target['jobStatus'] != 'SUCCEEDED':
+                raise RuntimeError(f"Textract job {target['jobId']} finished with status {target['jobStatus']}")
+            extracted_text = extract_text_from_job(target['jobId'])
+            digest = content_digest(target.get('bucket'), key)
+        else:
+            if not key:
+                raise ValueError("No document key provided")
             
-            # Extract text from Textract response
-            extracted_text = ""
-            for block in textract_response['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    extracted_text += block['Text'] + '\n'
+            # Extract document ID from S3 key
+            document_id = document_id_from_key(key)
             
-            print(f"Extracted text length: {len(extracted_text)}")
+            print(f"Processing document: {key}")
             
-        except ClientError as e:
-            print(f"Textract error: {str(e)}")
-            # If Textract fails, try to read as text file
-            try:
-                s3_client = boto3.client('s3')
-                response = s3_client.get_object(Bucket=bucket, Key=key)
-                extracted_text = response['Body'].read().decode('utf-8')
-            except:
-                extracted_text = "Unable to extract text from document"
-        
-        # Analyze text with Comprehend if text was extracted
-        if extracted_text and len(extracted_text.strip()) > 0:
-            try:
-                # Limit text to 5000 characters for Comprehend
-                text_for_analysis = extracted_text[:5000]
-                
-                # Detect sentiment
-                sentiment_result = comprehend_client.detect_sentiment(
-                    Text=text_for_analysis,
-                    LanguageCode='en'
-                )
-                
-                # Detect entities
-                entities_result = comprehend_client.detect_entities(
-                    Text=text_for_analysis,
-                    LanguageCode='en'
-                )
+            # Update status to processing
+            set_status(table, document_id, 'processing', processingStartedAt=datetime.utcnow().isoformat())
+            
+            # Identical content processed before: reuse its text and analysis
+            digest = content_digest(target['bucket'], key)
+            cached = result_cache.lookup(target['bucket'], digest) if digest else None
+            if cached:
+                print(f"Reusing cached results for {key}")
+                extracted_text, analysis = cached
+                return {'documentId': document_id, 'key': key, 'status': 'extracted', 'text': extracted_text, 'analysis': analysis, 'contentHash': digest}
+            
+            if textract_jobs.is_async_document(key):
+                job_id = textract_jobs.start_text_detection(target['bucket'], key, document_id)
+                set_status(table, document_id, 'extracting', textractJobId=job_id)
                 
-                # Detect key phrases
-                key_phrases_result = comprehend_client.detect_key_phrases(
-                    Text=text_for_analysis,
-                    LanguageCode='en'
-                )
+                if textract_jobs.notification_channel():
+                    # The SNS notification re-invokes this function when the job is done
+                    return {'documentId': document_id, 'key': key, 'status': 'extracting', 'jobId': job_id}
                 
-            except ClientError as e:
-                print(f"Comprehend error: {str(e)}")
-                sentiment_result = {'Sentiment': 'UNKNOWN', 'SentimentScore': {}}
-                entities_result = {'Entities': []}
-                key_phrases_result = {'KeyPhrases': []}
-        
-        # Update document metadata with processing results
-        update_expression = 'SET #status = :status, processedAt = :processed_at, extractedText = :text'
-        expression_attribute_names = {'#status': 'status'}
-        expression_attribute_values = {
-            ':status': 'completed',
-            ':processed_at': datetime.utcnow().isoformat(),
-            ':text': extracted_text
+                job_status = textract_jobs.wait_for_job(job_id, context)
+                if job_status is None:
+                    # Out of time; a later {"jobId": ...} invocation can finish the document
+                    return {'documentId': document_id, 'key': key, 'status': 'extracting', 'jobId': job_id}
+                if job_status != 'SUCCEEDED':
+                    raise RuntimeError(f"Textract job {job_id} finished with status {job_status}")
+                extracted_text = extract_text_from_job(job_id)
+            else:
+                extracted_text = extract_text_sync(target['bucket'], key)
+        
+        print(f"Extracted text length: {len(extracted_text)}")
+        
+        return {'documentId': document_id, 'key': key, 'status': 'extracted', 'text': extracted_text, 'contentHash': digest}
+        
+    except Exception as e:
+        return fail_document(table, document_id, key, e)
+
+def finish_document(extracted, analysis, table_name, bucket_name, complete=True):
+    """
+    Record the extracted text and Comprehend results for one document, and
+    cache freshly computed ones under the content hash
+    Results are only cached when the text was extracted and every Comprehend
+    call succeeded (complete), so a failure is retried on the next upload
+    """
+    table = aws_clients.table(table_name)
+    sentiment_result, entities_result, key_phrases_result = analysis
+    
+    try:
+        store_results(table, bucket_name, extracted['documentId'], extracted['text'], sentiment_result, entities_result, key_phrases_result)
+        
+        # Add the document to the full-text, entity and sentiment indexes used by document_search
+        if search_index.enabled():
+            user_id = document_owner(table, extracted['documentId'], extracted['key'])
+            search_index.index_document(extracted['documentId'], user_id, extracted['text'])
+            search_index.index_facets(
+                extracted['documentId'],
+                user_id,
+                sentiment_result.get('Sentiment') if sentiment_result else None,
+                (entities_result or {}).get('Entities', [])
+            )
+        
+        cache_hit = 'analysis' in extracted
+        cacheable = complete and extracted['text'] != EXTRACTION_FAILED_TEXT
+        if extracted.get('contentHash') and cacheable and not cache_hit:
+            # Best effort: the document is complete even if its results are not cached
+            try:
+                result_cache.save(extracted['contentHash'], extracted['documentId'], text_analysis.capped(analysis))
+            except Exception as e:
+                print(f"Could not cache results for {extracted['documentId']}: {str(e)}")
+
+        return {
+            'documentId': extracted['documentId'],
+            'key': extracted['key'],
+            'status': 'completed',
+            'extractedTextLength': len(extracted['text']),
+            'sentiment': sentiment_result.get('Sentiment', 'UNKNOWN') if sentiment_result else None,
+            'cached': cache_hit
         }
         
-        if sentiment_result:
-            update_expression += ', sentiment = :sentiment, sentimentScore = :sentiment_score'
-            expression_attribute_values[':sentiment'] = sentiment_result.get('Sentiment', 'UNKNOWN')
-            expression_attribute_values[':sentiment_score'] = sentiment_result.get('SentimentScore', {})
+    except Exception as e:
+        return fail_document(table, extracted['documentId'], extracted['key'], e)
+
+def process_documents(targets, table_name, bucket_name, context=None):
+    """
+    Extract every document, analyze all extracted texts together, then store
+    the results; returns one result per target, in order
+    """
+    workers = min(MAX_PARALLEL_DOCUMENTS, len(targets))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with metrics.phase('extract'):
+            results = list(executor.map(lambda target: extract_document(target, table_name, context), targets))
         
-        if entities_result:
-            update_expression += ', entities = :entities'
-            expression_attribute_values[':entities'] = entities_result.get('Entities', [])
+        ready = [i for i, result in enumerate(results) if result['status'] == 'extracted']
         
-        if key_phrases_result:
-            update_expression += ', keyPhrases = :key_phrases'
-            expression_attribute_values[':key_phrases'] = key_phrases_result.get('KeyPhrases', [])
+        # Documents served from the result cache already have their analysis
+        fresh = [i for i in ready if 'analysis' not in results[i]]
+        with metrics.phase('analyze'):
+            fresh_analyses, fresh_complete = analyze_documents([results[i]['text'] for i in fresh])
+        analyses = dict(zip(fresh, fresh_analyses))
+        analyses.update((i, results[i]['analysis']) for i in ready if i not in analyses)
+        complete = dict(zip(fresh, fresh_complete))
         
-        table.update_item(
-            Key={'documentId': document_id},
-            UpdateExpression=update_expression,
-            ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
-        )
+        with metrics.phase('store'):
+            finished = executor.map(
+                lambda i: finish_document(results[i], analyses[i], table_name, bucket_name, complete.get(i, True)),
+                ready
+            )
+            for i, result in zip(ready, finished):
+                results[i] = result
+    
+    return results
+
+@metrics.handler
+def lambda_handler(event, context):
+    """
+    Lambda function to process uploaded documents
+    Uses Textract for OCR and Comprehend for AI analysis
+    Every record of an S3 event is processed, several documents at a time
+    SNS records carry Textract completions for multi-page documents
+    """
+    try:
+        # Get environment variables
+        bucket_name = os.environ['DOCUMENT_BUCKET']
+        table_name = os.environ['METADATA_TABLE']
+        
+        targets = parse_targets(event, bucket_name)
+        results = process_documents(targets, table_name, bucket_name, context) if targets else []
+        
+        failed_count = sum(1 for result in results if result['status'] == 'failed')
+        if failed_count == 0:
+            status_code = 200
+        elif failed_count == len(results):
+            status_code = 500
+        else:
+            status_code = 207
         
         return {
-            'statusCode': 200,
+            'statusCode': status_code,
             'body': json.dumps({
-                'message': 'Document processed successfully',
-                'documentId': document_id,
-                'extractedTextLength': len(extracted_text),
-                'sentiment': sentiment_result.get('Sentiment', 'UNKNOWN') if sentiment_result else None
+                'message': 'Document processing finished',
+                'processed': len(results) - failed_count,
+                'failed': failed_count,
+                'results': results
             })
         }
         
     except Exception as e:
         print(f"Error in document processing: {str(e)}")
         
-        # Update document status to failed
-        try:
-            if 'document_id' in locals():
-                table.update_item(
-                    Key={'documentId': document_id},
-                    UpdateExpression='SET #status = :status, errorMessage = :error',
-                    ExpressionAttributeNames={'#status': 'status'},
-                    ExpressionAttributeValues={
-                        ':status': 'failed',
-                        ':error': str(e)
-                    }
-                )
-        except:
-            pass
-        
         return {
             'statusCode': 500,
             'body': json.dumps({
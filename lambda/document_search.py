@@ -1,17 +1,262 @@
+import base64
 import json
-import boto3
 import os
+from collections import Counter
+from itertools import islice
 from datetime import datetime
+from decimal import Decimal
 
+import aws_clients
+import metrics
+import search_index
+import text_store
+
+# BatchGetItem accepts at most 100 keys per call
+BATCH_GET_SIZE = 100
+
+# Documents per response page
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Filtered reads: items evaluated per page, and the read budget for one request
+SCAN_PAGE_SIZE = 100
+MAX_ITEMS_EVALUATED = 1000
+
+# Keys used to resume a read after a given item: the table's primary key,
+# and for the UserIndex GSI (userId + uploadDate) the index key as well
+USER_INDEX = 'UserIndex'
+TABLE_KEY_ATTRIBUTES = ('documentId',)
+USER_INDEX_KEY_ATTRIBUTES = ('documentId', 'userId', 'uploadDate')
+
+# Searches through the inverted index resume from a position instead: the
+# number of ranked documents already returned, or the last document ID
+# returned (newest first, since document IDs are ULIDs)
+RANKED_CURSOR_KEYS = ('offset',)
+INDEX_CURSOR_KEYS = ('after',)
+
+# Response fields a client can ask for with fields= (all of them by default) and
+# the item attributes each one reads. Entity and key phrase lists are cut to
+# their first MAX_LIST_ELEMENTS entries by DynamoDB rather than after the read.
+MAX_LIST_ELEMENTS = 10
+RESPONSE_FIELDS = {
+    'documentId': ('documentId',),
+    'fileName': ('fileName',),
+    'fileType': ('fileType',),
+    'fileSize': ('fileSize',),
+    'uploadDate': ('uploadDate',),
+    'status': ('status',),
+    'sentiment': ('sentiment',),
+    'sentimentScore': ('sentimentScore',),
+    'entities': tuple(f'entities[{i}]' for i in range(MAX_LIST_ELEMENTS)),
+    'keyPhrases': tuple(f'keyPhrases[{i}]' for i in range(MAX_LIST_ELEMENTS)),
+    'extractedTextPreview': ('extractedTextPreview',)
+}
+
+# Read whatever the fields: the keys a cursor resumes from and what facet counts use
+BASE_ATTRIBUTES = USER_INDEX_KEY_ATTRIBUTES + ('sentiment', 'entityTypes')
+
+def json_default(value):
+    """
+    Serialize DynamoDB numbers (Decimal) in responses
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def encode_cursor(last_evaluated_key):
+    """
+    Wrap a DynamoDB LastEvaluatedKey in an opaque, URL-safe cursor string
+    """
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(',', ':'), sort_keys=True, default=json_default)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor produced by encode_cursor back into an ExclusiveStartKey
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, dict):
+        raise ValueError('Invalid cursor')
+    return key
+
+def parse_cursor(cursor, key_attributes):
+    """
+    Decode a cursor and check it holds exactly key_attributes, so a cursor
+    from another kind of search is rejected instead of being misread
+    """
+    key = decode_cursor(cursor)
+    if sorted(key) != sorted(key_attributes):
+        raise ValueError('Invalid cursor')
+    if 'offset' in key and (type(key['offset']) is not int or key['offset'] < 0):
+        raise ValueError('Invalid cursor')
+    if any(not isinstance(key[name], str) for name in key_attributes if name != 'offset'):
+        raise ValueError('Invalid cursor')
+    return key
+
+def parse_limit(value):
+    """
+    Validate the limit query parameter, falling back to DEFAULT_LIMIT
+    """
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, MAX_LIMIT)
+
+def parse_fields(value):
+    """
+    Validate the comma-separated fields query parameter, falling back to
+    every response field
+    """
+    if not value:
+        return list(RESPONSE_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in RESPONSE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return list(dict.fromkeys(['documentId'] + fields))
+
+def build_projection(attribute_paths):
+    """
+    ProjectionExpression and ExpressionAttributeNames for a list of attribute
+    paths such as 'status' or 'entities[3]'. List elements are left out when
+    the whole list is projected, since DynamoDB rejects overlapping paths.
+    """
+    whole = {path for path in attribute_paths if '[' not in path}
+    names = {}
+    expressions = []
+    for path in dict.fromkeys(attribute_paths):
+        name, bracket, index = path.partition('[')
+        if bracket and name in whole:
+            continue
+        names[f'#{name}'] = name
+        expressions.append(f'#{name}{bracket}{index}')
+    return ', '.join(expressions), names
+
+def read_until_filled(read_page, request, limit, accept, key_attributes, start_key=None):
+    """
+    Keep reading pages (scan or query) until `limit` items pass `accept` or
+    MAX_ITEMS_EVALUATED items have been read. DynamoDB applies Limit before
+    the FilterExpression, so a single call can return far fewer matches than
+    asked for. Returns (items, next_key); next_key resumes right after the
+    last returned item, or is None when the table is exhausted.
+    """
+    items = []
+    evaluated = 0
+    next_key = start_key
+    while True:
+        page_request = dict(request, Limit=min(SCAN_PAGE_SIZE, MAX_ITEMS_EVALUATED - evaluated))
+        if next_key:
+            page_request['ExclusiveStartKey'] = next_key
+        response = read_page(**page_request)
+        page = response.get('Items', [])
+        evaluated += response.get('ScannedCount', page_request['Limit'])
+        next_key = response.get('LastEvaluatedKey')
+        
+        for position, item in enumerate(page):
+            if not accept(item):
+                continue
+            items.append(item)
+            if len(items) == limit:
+                if position < len(page) - 1:
+                    # Stop mid-page: resume after this item, not after the whole page
+                    next_key = {name: item[name] for name in key_attributes}
+                return items, next_key
+        
+        if not next_key or evaluated >= MAX_ITEMS_EVALUATED:
+            return items, next_key
+
+def fetch_documents(table_name, document_ids, projection=None):
+    """
+    Load metadata items for a set of document IDs with BatchGetItem,
+    optionally only the attributes of a (ProjectionExpression, names) pair
+    """
+    dynamodb = aws_clients.resource('dynamodb')
+    document_ids = list(document_ids)
+    items = []
+    for start in range(0, len(document_ids), BATCH_GET_SIZE):
+        request = {table_name: {'Keys': [{'documentId': document_id} for document_id in document_ids[start:start + BATCH_GET_SIZE]]}}
+        if projection:
+            request[table_name]['ProjectionExpression'], request[table_name]['ExpressionAttributeNames'] = projection
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            request = response.get('UnprocessedKeys') or None
+    return items
+
+def top_documents(table_name, ranked, limit, projection=None):
+    """
+    Take documents from a best-first (documentId, score) stream until limit
+    of them still exist; metadata is fetched one batch at a time
+    Returns (items, scores, consumed), consumed being the number of stream
+    entries up to and including the last document taken
+    """
+    items = []
+    scores = {}
+    consumed = 0
+    batch_size = min(max(limit, 1), BATCH_GET_SIZE)
+    while len(items) < limit:
+        batch = [candidate for _, candidate in zip(range(batch_size), ranked)]
+        if not batch:
+            break
+        scores.update(batch)
+        fetched = {item['documentId']: item for item in fetch_documents(table_name, [document_id for document_id, _ in batch], projection)}
+        for document_id, _ in batch:
+            if len(items) == limit:
+                break
+            consumed += 1
+            if document_id in fetched:
+                items.append(fetched[document_id])
+    return items, scores, consumed
+
+def matches_filters(item, sentiment_filter, entity_filter, entity_type=None):
+    """
+    Apply the sentiment and entity filters to a metadata item, comparing
+    entities the way search_index normalises them
+    """
+    if sentiment_filter and item.get('sentiment') != sentiment_filter.upper():
+        return False
+    if entity_filter:
+        wanted = search_index.normalize_entity(entity_filter)
+        if not any(
+            search_index.normalize_entity(entity.get('Text', '')) == wanted
+            and (not entity_type or entity.get('Type') == entity_type.upper())
+            for entity in item.get('entities') or []
+        ):
+            return False
+    return True
+
+def facet_counts(items):
+    """
+    Number of documents per sentiment and per entity type among items
+    """
+    sentiments = Counter(item['sentiment'] for item in items if item.get('sentiment'))
+    entity_types = Counter()
+    for item in items:
+        types = item.get('entityTypes')
+        if types is None:
+            types = {entity['Type'] for entity in item.get('entities') or [] if entity.get('Type')}
+        entity_types.update(set(types))
+    return {'sentiment': dict(sentiments), 'entityType': dict(entity_types)}
+
+@metrics.handler
 def lambda_handler(event, context):
     """
     Lambda function to search documents
     Supports search by text content, metadata, and AI analysis results
     """
     try:
-        # Initialize AWS clients
-        dynamodb = boto3.resource('dynamodb')
-        
         # Get environment variables
         table_name = os.environ['METADATA_TABLE']
         
@@ -22,68 +267,173 @@ def lambda_handler(event, context):
         search_text = query_params.get('searchText', '')
         sentiment_filter = query_params.get('sentiment')
         entity_filter = query_params.get('entity')
-        limit = int(query_params.get('limit', 20))
+        entity_type = query_params.get('entityType')
+        operator = query_params.get('operator', 'and').lower()
+        rank = query_params.get('rank', 'date').lower()
         
-        table = dynamodb.Table(table_name)
+        if not search_index.valid_user_id(user_id):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': "userId must be a non-empty string without '#'"})
+            }
         
-        # Build scan parameters
-        scan_params = {
-            'Limit': limit
-        }
+        if operator not in ('and', 'or') or rank not in ('date', 'relevance'):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'operator must be "and" or "or"; rank must be "date" or "relevance"'})
+            }
+        
+        # Ranked and filtered searches read the inverted index; the rest read the table
+        ranked = bool(search_text) and search_index.enabled() and rank == 'relevance'
+        indexed = search_index.enabled() and bool(search_text or sentiment_filter or entity_filter)
+        if ranked:
+            cursor_keys = RANKED_CURSOR_KEYS
+        elif indexed:
+            cursor_keys = INDEX_CURSOR_KEYS
+        elif user_id != 'anonymous':
+            cursor_keys = USER_INDEX_KEY_ATTRIBUTES
+        else:
+            cursor_keys = TABLE_KEY_ATTRIBUTES
         
-        # Add filters
-        filter_expressions = []
-        expression_attribute_values = {}
+        try:
+            limit = parse_limit(query_params.get('limit'))
+            fields = parse_fields(query_params.get('fields'))
+            cursor = query_params.get('cursor')
+            start_key = parse_cursor(cursor, cursor_keys) if cursor else None
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': str(e)})
+            }
         
-        # Filter by user ID
-        if user_id != 'anonymous':
-            filter_expressions.append('userId = :user_id')
-            expression_attribute_values[':user_id'] = user_id
+        scores = None
+        next_key = None
+        owner = None if user_id == 'anonymous' else user_id
         
-        # Filter by sentiment
-        if sentiment_filter:
-            filter_expressions.append('sentiment = :sentiment')
-            expression_attribute_values[':sentiment'] = sentiment_filter
+        table = aws_clients.table(table_name)
         
-        # Filter by entity
-        if entity_filter:
-            filter_expressions.append('contains(entities, :entity)')
-            expression_attribute_values[':entity'] = {'Text': entity_filter}
+        # Entity and sentiment filters are key lookups in the index
+        facet_ids = None
+        if search_index.enabled() and (sentiment_filter or entity_filter):
+            facet_ids = search_index.find_by_facets(sentiment_filter, entity_filter, entity_type, owner)
         
-        # Filter by text content
-        if search_text:
-            filter_expressions.append('contains(extractedText, :search_text)')
-            expression_attribute_values[':search_text'] = search_text
+        # Read only what the response shows, plus keys and facet attributes
+        attribute_paths = list(BASE_ATTRIBUTES)
+        for field in fields:
+            attribute_paths.extend(RESPONSE_FIELDS[field])
+        projection = build_projection(attribute_paths)
         
-        if filter_expressions:
-            scan_params['FilterExpression'] = ' AND '.join(filter_expressions)
-            scan_params['ExpressionAttributeValues'] = expression_attribute_values
+        if ranked:
+            # BM25 ranking from the index; only the metadata of the page's documents is read
+            scores = search_index.score_documents(search_text, operator, owner)
+            if facet_ids is not None:
+                scores = {document_id: score for document_id, score in scores.items() if document_id in facet_ids}
+            offset = start_key['offset'] if start_key else 0
+            total = len(scores)
+            items, scores, consumed = top_documents(table_name, islice(search_index.iter_ranked(scores), offset, None), limit, projection)
+            if offset + consumed < total:
+                next_key = {'offset': offset + consumed}
+            matched = items
+        elif indexed:
+            # Text search through the inverted index: read only the postings of the query terms,
+            # then the metadata of one page of matches, newest first
+            document_ids = search_index.find_documents(search_text, operator, owner) if search_text else facet_ids
+            if search_text and facet_ids is not None:
+                document_ids &= facet_ids
+            document_ids = sorted(document_ids, reverse=True)
+            if start_key:
+                document_ids = [document_id for document_id in document_ids if document_id < start_key['after']]
+            page = document_ids[:limit]
+            fetched = {item['documentId']: item for item in fetch_documents(table_name, page, projection)}
+            items = [fetched[document_id] for document_id in page if document_id in fetched]
+            if len(document_ids) > limit:
+                next_key = {'after': page[-1]}
+            matched = items
+        else:
+            # The filters below need the full entity list and the text location
+            if entity_filter:
+                attribute_paths.append('entities')
+            if search_text:
+                attribute_paths.extend(('extractedTextKey', 'extractedText'))
+            projection_expression, expression_attribute_names = build_projection(attribute_paths)
+            
+            # Build read parameters
+            read_params = {
+                'ProjectionExpression': projection_expression,
+                'ExpressionAttributeNames': expression_attribute_names
+            }
+            
+            # Add filters
+            filter_expressions = []
+            expression_attribute_values = {}
+            
+            # Filter by sentiment
+            if sentiment_filter:
+                filter_expressions.append('sentiment = :sentiment')
+                expression_attribute_values[':sentiment'] = sentiment_filter.upper()
+            
+            if filter_expressions:
+                read_params['FilterExpression'] = ' AND '.join(filter_expressions)
+            
+            if user_id != 'anonymous':
+                # One user's documents: query the UserIndex GSI, newest first
+                read_params['IndexName'] = USER_INDEX
+                read_params['KeyConditionExpression'] = 'userId = :user_id'
+                read_params['ScanIndexForward'] = False
+                expression_attribute_values[':user_id'] = user_id
+                read_page, key_attributes = table.query, USER_INDEX_KEY_ATTRIBUTES
+            else:
+                read_page, key_attributes = table.scan, TABLE_KEY_ATTRIBUTES
+            
+            if expression_attribute_values:
+                read_params['ExpressionAttributeValues'] = expression_attribute_values
+            
+            # Without an index, entities are matched here (they are maps with scores and
+            # offsets, which a FilterExpression cannot compare), and text content last:
+            # the full text lives in S3 and is only read here
+            def accept(item):
+                if not matches_filters(item, None, entity_filter, entity_type):
+                    return False
+                return not search_text or search_text in text_store.item_text(item, os.environ['DOCUMENT_BUCKET'])
+            
+            # Read until the page is full or the read budget is spent
+            items, next_key = read_until_filled(read_page, read_params, limit, accept, key_attributes, start_key)
+            matched = items
         
-        # Perform scan
-        response = table.scan(**scan_params)
+        # A cross-user scan comes back in table order; sort it by upload date (newest first).
+        # UserIndex queries and index searches are already ordered.
+        if user_id == 'anonymous' and not indexed:
+            items.sort(key=lambda item: item.get('uploadDate') or '', reverse=True)
         
         # Process results
         documents = []
-        for item in response.get('Items', []):
-            # Format document for response
-            document = {
-                'documentId': item.get('documentId'),
-                'fileName': item.get('fileName'),
-                'fileType': item.get('fileType'),
-                'fileSize': item.get('fileSize'),
-                'uploadDate': item.get('uploadDate'),
-                'status': item.get('status'),
-                'sentiment': item.get('sentiment'),
-                'sentimentScore': item.get('sentimentScore'),
-                'entities': item.get('entities', [])[:10],  # Limit to first 10 entities
-                'keyPhrases': item.get('keyPhrases', [])[:10],  # Limit to first 10 phrases
-                'extractedTextPreview': item.get('extractedText', '')[:500] + '...' if item.get('extractedText') else ''
-            }
+        for item in items:
+            # Format document for response, with only the requested fields
+            document = {}
+            for field in fields:
+                if field == 'extractedTextPreview':
+                    preview = text_store.item_preview(item)
+                    document[field] = preview + '...' if preview else ''
+                elif field in ('entities', 'keyPhrases'):
+                    document[field] = (item.get(field) or [])[:MAX_LIST_ELEMENTS]
+                else:
+                    document[field] = item.get(field)
+            if scores is not None:
+                document['score'] = round(scores[item['documentId']], 4)
             documents.append(document)
         
-        # Sort by upload date (newest first)
-        documents.sort(key=lambda x: x.get('uploadDate', ''), reverse=True)
-        
         return {
             'statusCode': 200,
             'headers': {
@@ -95,13 +445,20 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'documents': documents,
                 'count': len(documents),
+                'nextCursor': encode_cursor(next_key),
+                # Counts over every matching document read for this response
+                'facets': facet_counts(matched),
                 'searchParams': {
                     'userId': user_id,
                     'searchText': search_text,
                     'sentiment': sentiment_filter,
-                    'entity': entity_filter
+                    'entity': entity_filter,
+                    'entityType': entity_type,
+                    'operator': operator,
+                    'rank': rank,
+                    'fields': fields
                 }
-            })
+            }, default=json_default)
         }
         
     except Exception as e:
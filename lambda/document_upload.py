@@ -1,18 +1,38 @@
 import json
-import boto3
-import uuid
 from datetime import datetime
 import os
 
+import aws_clients
+import idempotency
+import metrics
+import search_index
+import ulid
+
+# Lifetime of the presigned upload URL
+UPLOAD_URL_EXPIRES_SECONDS = 3600
+
+# A replayed response must not hand out an expired URL; the margin covers
+# the time between signing the URL and storing the response
+REPLAY_TTL_SECONDS = UPLOAD_URL_EXPIRES_SECONDS - 60
+
+@metrics.handler
 def lambda_handler(event, context):
     """
     Lambda function to handle document upload requests
     Generates presigned URLs for secure S3 uploads
+    A retried request with the same Idempotency-Key gets the original
+    documentId and URL instead of a second upload record, for as long as
+    the URL is valid
+    """
+    return idempotency.run(event, 'document_upload', lambda: create_upload(event), ttl=REPLAY_TTL_SECONDS)
+
+def create_upload(event):
+    """
+    Register a new document and return a presigned upload URL for it
     """
     try:
-        # Initialize AWS clients
-        s3_client = boto3.client('s3')
-        dynamodb = boto3.resource('dynamodb')
+        # Shared AWS clients (reused across warm invocations)
+        s3_client = aws_clients.client('s3')
         
         # Get bucket name from environment variable
         bucket_name = os.environ['DOCUMENT_BUCKET']
@@ -28,8 +48,19 @@ def lambda_handler(event, context):
         file_type = body.get('fileType', 'application/octet-stream')
         file_size = body.get('fileSize', 0)
         
-        # Generate unique document ID
-        document_id = str(uuid.uuid4())
+        # The search index keys documents by "{userId}#{documentId}"
+        if not search_index.valid_user_id(user_id):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': "userId must be a non-empty string without '#'"})
+            }
+        
+        # Generate unique, time-ordered document ID
+        document_id = ulid.generate()
         
         # Create S3 key
         s3_key = f"documents/{user_id}/{document_id}/{file_name}"
@@ -42,11 +73,11 @@ def lambda_handler(event, context):
                 'Key': s3_key,
                 'ContentType': file_type
             },
-            ExpiresIn=3600  # 1 hour
+            ExpiresIn=UPLOAD_URL_EXPIRES_SECONDS
         )
         
         # Store document metadata in DynamoDB
-        table = dynamodb.Table(os.environ['METADATA_TABLE'])
+        table = aws_clients.table(os.environ['METADATA_TABLE'])
         table.put_item(
             Item={
                 'documentId': document_id,
@@ -58,7 +89,6 @@ def lambda_handler(event, context):
                 'uploadDate': datetime.utcnow().isoformat(),
                 'status': 'uploading',
                 'processedAt': None,
-                'extractedText': None,
                 'sentiment': None,
                 'entities': [],
                 'keyPhrases': []
@@ -71,7 +101,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type,Idempotency-Key'
             },
             'body': json.dumps({
                 'documentId': document_id,
@@ -0,0 +1,221 @@
+"""
+Idempotency-Key handling for document upload requests
+
+A client that sends an Idempotency-Key header can retry a request as often
+as it likes: the first request claims the key with a conditional put in the
+table named by IDEMPOTENCY_TABLE, and the response it produces is stored
+under the key. A retry with the same key gets that stored response back
+without the work being done again. Keys are scoped to the operation and to
+the user the request is for, so two users cannot collide on a key. Records
+expire through the table's TTL attribute (expiresAt).
+
+Without the header, or without IDEMPOTENCY_TABLE, requests run as before.
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from urllib.parse import quote
+
+import aws_clients
+
+HEADER = 'idempotency-key'
+MAX_KEY_LENGTH = 255
+
+# How long a completed response is replayed, and how long an unfinished
+# claim blocks retries before another request may take the key over
+RECORD_TTL_SECONDS = 24 * 60 * 60
+IN_PROGRESS_TTL_SECONDS = 60
+
+# Stored responses stay well below the 400 KB item limit
+MAX_STORED_RESPONSE_BYTES = 350 * 1024
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+
+def enabled():
+    """
+    Whether an idempotency table is configured for this function
+    """
+    return bool(os.environ.get('IDEMPOTENCY_TABLE'))
+
+
+def request_key(event):
+    """
+    The Idempotency-Key header of a request (header names are case-insensitive)
+    """
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == HEADER and value:
+            return value.strip()
+    return None
+
+
+def request_user(event):
+    """
+    The user a request is for: the userId of the body, or of the first task
+    of a batch; '' when the body has none
+    """
+    body = event.get('body')
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return ''
+    if not isinstance(body, dict):
+        return ''
+    tasks = body.get('tasks')
+    if 'userId' not in body and isinstance(tasks, list) and tasks and isinstance(tasks[0], dict):
+        body = tasks[0]
+    user_id = body.get('userId')
+    return user_id if isinstance(user_id, str) else ''
+
+
+def record_key_for(scope, user_id, key):
+    """
+    Table key of an Idempotency-Key; '#' in the user ID is escaped so the
+    parts cannot run into each other
+    """
+    return f"{scope}#{quote(user_id, safe='')}#{key}"
+
+
+def fingerprint(event):
+    """
+    Hash of the request body, so a key reused for a different request is caught
+    """
+    body = event.get('body')
+    if not isinstance(body, str):
+        body = json.dumps(body, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256((body or '').encode('utf-8')).hexdigest()
+
+
+def error_response(status_code, message):
+    """
+    JSON error response in the handlers' format
+    """
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({'error': message})
+    }
+
+
+def claim(table, record_key, request_hash):
+    """
+    Claim a key for this request. Returns None when the claim succeeded,
+    otherwise the existing record.
+    """
+    # Imported here so loading the module does not pull in boto3
+    from boto3.dynamodb.conditions import Attr
+    from botocore.exceptions import ClientError
+
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item={
+                'idempotencyKey': record_key,
+                'state': IN_PROGRESS,
+                'requestHash': request_hash,
+                'expiresAt': now + IN_PROGRESS_TTL_SECONDS
+            },
+            # TTL deletes lazily, so an expired record counts as absent
+            ConditionExpression=Attr('idempotencyKey').not_exists() | Attr('expiresAt').lt(now)
+        )
+        return None
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    return table.get_item(Key={'idempotencyKey': record_key}, ConsistentRead=True).get('Item') or {}
+
+
+def replay(record, request_hash):
+    """
+    The response for a retry, from the record that holds the key, or None
+    when the stored response is unreadable and the request should run again
+    """
+    if not record:
+        # Released between the failed claim and the read; the retry can go again
+        return error_response(409, 'A request with this Idempotency-Key is being retried, try again')
+    if record.get('requestHash') != request_hash:
+        return error_response(422, 'Idempotency-Key was already used with a different request')
+    if record.get('state') != COMPLETED:
+        return error_response(409, 'A request with this Idempotency-Key is still in progress')
+    response = stored_response(record)
+    if response is None:
+        return None
+    response.setdefault('headers', {})['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def stored_response(record):
+    """
+    The response saved in a completed record, or None if it cannot be read
+    """
+    try:
+        response = json.loads(gzip.decompress(bytes(record['response'])).decode('utf-8'))
+    except (KeyError, TypeError, ValueError, OSError, EOFError) as e:
+        print(f"Unreadable idempotent response for {record.get('idempotencyKey')}: {str(e)}")
+        return None
+    return response if isinstance(response, dict) else None
+
+
+def record_response(table, record_key, request_hash, response, ttl=RECORD_TTL_SECONDS):
+    """
+    Store the response for replay for ttl seconds, or release the key if it
+    should not be kept (server errors, so a retry runs again, and responses
+    too large to store)
+    """
+    payload = gzip.compress(json.dumps(response).encode('utf-8'))
+    if response.get('statusCode', 500) >= 500 or len(payload) > MAX_STORED_RESPONSE_BYTES:
+        table.delete_item(Key={'idempotencyKey': record_key})
+        return
+    table.put_item(Item={
+        'idempotencyKey': record_key,
+        'state': COMPLETED,
+        'requestHash': request_hash,
+        'response': payload,
+        'expiresAt': int(time.time()) + ttl
+    })
+
+
+def run(event, scope, work, ttl=RECORD_TTL_SECONDS):
+    """
+    Run work() (which returns the Lambda response) at most once per
+    Idempotency-Key; keys are kept apart per scope (the operation) and per
+    user (request_user).
+    ttl caps how long the response is replayed, for responses that go stale
+    """
+    key = request_key(event)
+    if not key or not enabled():
+        return work()
+    if len(key) > MAX_KEY_LENGTH:
+        return error_response(400, f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters')
+
+    table = aws_clients.table(os.environ['IDEMPOTENCY_TABLE'])
+    record_key = record_key_for(scope, request_user(event), key)
+    request_hash = fingerprint(event)
+    try:
+        record = claim(table, record_key, request_hash)
+        if record is not None:
+            response = replay(record, request_hash)
+            if response is not None:
+                return response
+            # Treat the unreadable record as absent: take the key over and run again
+            table.delete_item(Key={'idempotencyKey': record_key})
+            record = claim(table, record_key, request_hash)
+            if record is not None:
+                return replay(record, request_hash) or error_response(409, 'A request with this Idempotency-Key is being retried, try again')
+    except Exception as e:
+        return error_response(500, str(e))
+
+    response = work()
+    try:
+        record_response(table, record_key, request_hash, response, ttl)
+    except Exception as e:
+        # The work is done; a retry after the claim expires would repeat it, but failing now would too
+        print(f"Could not store idempotent response for {record_key}: {str(e)}")
+    return response
@@ -0,0 +1,106 @@
+"""
+Processing results cached by document content
+
+Identical bytes give identical OCR text and Comprehend analysis, so after a
+document is processed its results are recorded under the content hash of
+the uploaded S3 object, in the DocumentIndex table:
+
+    pk = CONTENT#{hash}    sk = RESULT    textKey, analysis, sourceDocumentId,
+                                          version, expiresAt
+
+The hash is the object's SHA-256 checksum when S3 has one, otherwise its
+ETag (the MD5 of the bytes for a single-part upload). A re-upload of the
+same file finds the entry before Textract is called, reads the cached text
+from S3 and is stored and indexed under its own documentId without any
+Textract or Comprehend calls.
+
+Only complete results are cached: a document whose text could not be
+extracted, or for which any Comprehend call failed, is processed again on
+its next upload. Entries expire after CACHE_TTL_SECONDS (through the
+table's TTL), and bumping CACHE_VERSION invalidates every existing entry.
+"""
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import aws_clients
+import search_index
+import text_store
+
+
+# Entries written with another version are ignored
+CACHE_VERSION = 2
+CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+
+def enabled():
+    """
+    The cache lives in the index table, so it is on whenever that is configured
+    """
+    return search_index.enabled()
+
+
+def content_hash(bucket, key):
+    """
+    Hash identifying the content of an S3 object, or None if S3 has none
+    """
+    response = aws_clients.client('s3').head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    checksum = response.get('ChecksumSHA256')
+    if checksum and '-' not in checksum:
+        return f'sha256:{checksum}'
+    etag = (response.get('ETag') or '').strip('"')
+    return f'etag:{etag}' if etag else None
+
+
+def from_dynamodb(value):
+    """
+    Turn DynamoDB numbers back into the ints and floats Comprehend returns
+    """
+    def number(decimal):
+        if not isinstance(decimal, Decimal):
+            raise TypeError(f'Object of type {type(decimal).__name__} is not JSON serializable')
+        return int(decimal) if decimal == decimal.to_integral_value() else float(decimal)
+    return json.loads(json.dumps(value, default=number))
+
+
+def lookup(bucket, digest):
+    """
+    Cached (text, analysis) for a content hash, or None on a miss
+    analysis is a (sentiment, entities, key_phrases) tuple as returned by
+    document_processing.analyze_documents
+    """
+    # Imported here so loading the module does not pull in botocore
+    from botocore.exceptions import ClientError
+
+    item = search_index.index_table().get_item(Key={'pk': f'CONTENT#{digest}', 'sk': 'RESULT'}).get('Item')
+    if not item or item.get('version') != CACHE_VERSION:
+        return None
+    # TTL deletes lazily, so an expired entry counts as absent
+    if int(item.get('expiresAt', 0)) < time.time():
+        return None
+    try:
+        text = text_store.load_text(bucket, item['textKey'])
+    except ClientError as e:
+        # The source document's text is gone; process this one from scratch
+        print(f"Cached text for {digest} unavailable: {str(e)}")
+        return None
+    analysis = from_dynamodb(item.get('analysis') or [None, None, None])
+    return text, tuple(analysis)
+
+
+def save(digest, document_id, analysis):
+    """
+    Record a processed document's results under its content hash
+    """
+    search_index.index_table().put_item(Item={
+        'pk': f'CONTENT#{digest}',
+        'sk': 'RESULT',
+        'textKey': text_store.text_key(document_id),
+        # DynamoDB rejects floats
+        'analysis': json.loads(json.dumps(list(analysis)), parse_float=Decimal),
+        'sourceDocumentId': document_id,
+        'cachedAt': datetime.utcnow().isoformat(),
+        'version': CACHE_VERSION,
+        'expiresAt': int(time.time()) + CACHE_TTL_SECONDS
+    })
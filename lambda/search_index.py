@@ -0,0 +1,385 @@
+"""
+Inverted full-text index for document search
+
+When document_processing finishes a document it writes one posting per
+distinct term to the DocumentIndex table (INDEX_TABLE):
+
+    pk = TERM#{term}    sk = {userId}#{documentId}    tf, dl
+
+tf is the term frequency in the document and dl the document length in
+terms. A search reads only the postings of its query terms (restricted to
+one user with a begins_with on sk), so its cost follows the size of the
+matching posting lists rather than the number of documents.
+
+For BM25 ranking the table also keeps each document's length
+(pk = DOC#{documentId}, sk = LENGTH) and running document counts and
+total lengths, overall (pk = STATS, sk = ALL) and per user
+(sk = USER#{userId}).
+
+Comprehend results are indexed the same way, so entity and sentiment
+filters are key lookups instead of table scans:
+
+    pk = ENTITY#{TYPE}#{normalised text}    sk = {userId}#{documentId}
+    pk = SENTIMENT#{SENTIMENT}              sk = {userId}#{documentId}
+
+The keys written for a document are remembered on pk = DOC#{documentId},
+sk = FACETS, and its distinct terms (gzip-compressed) on sk = TERMS, so
+re-processing removes the postings and keys that no longer apply.
+
+userId is the prefix of every sort key, so it may not contain '#': a user
+"a" would otherwise also match the postings of a user "a#b".
+"""
+import gzip
+import heapq
+import math
+import os
+import re
+from collections import Counter
+
+import aws_clients
+
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+ENTITY_SEPARATORS = re.compile(r'[\W_]+', re.UNICODE)
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Comprehend DetectEntities types, searched in turn when a filter names no type
+ENTITY_TYPES = (
+    'PERSON', 'LOCATION', 'ORGANIZATION', 'COMMERCIAL_ITEM', 'EVENT',
+    'DATE', 'QUANTITY', 'TITLE', 'OTHER'
+)
+
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he',
+    'in', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'to', 'was', 'were',
+    'will', 'with', 'this', 'but', 'not', 'they', 'we', 'you', 'have', 'had'
+))
+
+
+def enabled():
+    """
+    Whether an index table is configured for this function
+    """
+    return bool(os.environ.get('INDEX_TABLE'))
+
+
+def index_table():
+    """
+    The DocumentIndex table holding the postings
+    """
+    return aws_clients.table(os.environ['INDEX_TABLE'])
+
+
+def tokenize(text):
+    """
+    Lower-cased index terms of a text, in order, stopwords removed
+    """
+    terms = []
+    for match in TERM_PATTERN.finditer(text.lower()):
+        term = match.group()
+        if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH and term not in STOPWORDS and term.strip('_'):
+            terms.append(term)
+    return terms
+
+
+def valid_user_id(user_id):
+    """
+    Whether a userId can be used in index sort keys
+    """
+    return isinstance(user_id, str) and bool(user_id) and '#' not in user_id
+
+
+def document_sort_key(user_id, document_id):
+    """
+    Sort key of a document's postings, entity and sentiment items
+    """
+    if not valid_user_id(user_id):
+        raise ValueError(f"Invalid userId for the search index: {user_id!r}")
+    return f'{user_id}#{document_id}'
+
+
+def split_sort_key(sk):
+    """
+    (userId, documentId) from a posting's sort key
+    """
+    user_id, _, document_id = sk.rpartition('#')
+    return user_id, document_id
+
+
+def posting_key(term, user_id=None, document_id=None):
+    """
+    Partition key for a term and, when known, the sort key of one posting
+    """
+    pk = f'TERM#{term}'
+    if document_id is None:
+        return pk, None
+    return pk, document_sort_key(user_id, document_id)
+
+
+def pack_terms(terms):
+    """
+    A document's distinct terms as one compressed binary attribute; a term
+    list can approach the 400 KB item limit uncompressed
+    """
+    return gzip.compress('\n'.join(sorted(terms)).encode('utf-8'))
+
+
+def unpack_terms(value):
+    """
+    The set of terms stored by pack_terms (empty for a new document)
+    """
+    if not value:
+        return set()
+    # boto3 returns binary attributes wrapped in boto3.dynamodb.types.Binary
+    data = value.value if hasattr(value, 'value') else bytes(value)
+    return set(filter(None, gzip.decompress(data).decode('utf-8').split('\n')))
+
+
+def index_document(document_id, user_id, text):
+    """
+    Write the postings for a processed document, deleting those of terms an
+    earlier version of it had; returns the document length
+    """
+    terms = tokenize(text)
+    frequencies = Counter(terms)
+    document_length = len(terms)
+
+    table = index_table()
+    response = table.update_item(
+        Key={'pk': f'DOC#{document_id}', 'sk': 'TERMS'},
+        UpdateExpression='SET terms = :terms, userId = :user_id',
+        ExpressionAttributeValues={':terms': pack_terms(frequencies), ':user_id': user_id},
+        ReturnValues='UPDATED_OLD'
+    )
+    stale = unpack_terms(response.get('Attributes', {}).get('terms')) - set(frequencies)
+
+    with table.batch_writer() as batch:
+        for term in stale:
+            pk, sk = posting_key(term, user_id, document_id)
+            batch.delete_item(Key={'pk': pk, 'sk': sk})
+        for term, tf in frequencies.items():
+            pk, sk = posting_key(term, user_id, document_id)
+            batch.put_item(Item={'pk': pk, 'sk': sk, 'tf': tf, 'dl': document_length})
+
+    record_document_length(document_id, user_id, document_length)
+    return document_length
+
+
+def record_document_length(document_id, user_id, document_length):
+    """
+    Keep the collection statistics BM25 needs (document count and total
+    length, overall and per user) in step with an indexed document
+    """
+    table = index_table()
+    response = table.update_item(
+        Key={'pk': f'DOC#{document_id}', 'sk': 'LENGTH'},
+        UpdateExpression='SET dl = :dl, userId = :user_id',
+        ExpressionAttributeValues={':dl': document_length, ':user_id': user_id},
+        ReturnValues='UPDATED_OLD'
+    )
+    previous_length = response.get('Attributes', {}).get('dl')
+
+    # A re-indexed document only changes the total length, not the count
+    new_documents = 0 if previous_length is not None else 1
+    length_delta = document_length - int(previous_length or 0)
+    for sk in ('ALL', f'USER#{user_id}'):
+        table.update_item(
+            Key={'pk': 'STATS', 'sk': sk},
+            UpdateExpression='ADD docCount :documents, totalLength :length',
+            ExpressionAttributeValues={':documents': new_documents, ':length': length_delta}
+        )
+
+
+def collection_stats(user_id=None):
+    """
+    (document count, average document length) for all documents or one user's
+    """
+    sk = f'USER#{user_id}' if user_id else 'ALL'
+    item = index_table().get_item(Key={'pk': 'STATS', 'sk': sk}).get('Item') or {}
+    document_count = int(item.get('docCount', 0))
+    total_length = int(item.get('totalLength', 0))
+    average_length = total_length / document_count if document_count else 0.0
+    return document_count, average_length
+
+
+def iter_partition(pk, user_id=None):
+    """
+    Yield every index item under pk, only one user's when user_id is given
+    """
+    # Imported here so loading the module does not pull in boto3
+    from boto3.dynamodb.conditions import Key
+
+    condition = Key('pk').eq(pk)
+    if user_id:
+        condition = condition & Key('sk').begins_with(document_sort_key(user_id, ''))
+
+    query_kwargs = {'KeyConditionExpression': condition}
+    table = index_table()
+    while True:
+        response = table.query(**query_kwargs)
+        yield from response.get('Items', [])
+        if not response.get('LastEvaluatedKey'):
+            return
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def iter_postings(term, user_id=None):
+    """
+    Yield (userId, documentId, tf, dl) for every document containing term
+    """
+    pk, _ = posting_key(term)
+    for item in iter_partition(pk, user_id):
+        posting_user, document_id = split_sort_key(item['sk'])
+        yield posting_user, document_id, int(item['tf']), int(item['dl'])
+
+
+def find_documents(query_text, operator='and', user_id=None):
+    """
+    Document IDs matching all (operator='and') or any (operator='or') of the
+    query terms
+    """
+    terms = list(dict.fromkeys(tokenize(query_text)))
+    if not terms:
+        return set()
+
+    matches = None
+    for term in terms:
+        documents = {document_id for _, document_id, _, _ in iter_postings(term, user_id)}
+        if matches is None:
+            matches = documents
+        elif operator == 'or':
+            matches |= documents
+        else:
+            matches &= documents
+        if operator != 'or' and not matches:
+            # No document can match every term any more
+            break
+    return matches
+
+
+def score_documents(query_text, operator='and', user_id=None):
+    """
+    BM25 score of every document matching the query, as {documentId: score}
+    Only the postings of the query terms and the collection statistics are read
+    """
+    terms = list(dict.fromkeys(tokenize(query_text)))
+    if not terms:
+        return {}
+
+    document_count, average_length = collection_stats(user_id)
+    scores = {}
+    matched_terms = Counter()
+
+    for term in terms:
+        postings = list(iter_postings(term, user_id))
+        if not postings:
+            if operator != 'or':
+                return {}
+            continue
+
+        document_frequency = len(postings)
+        # Collection stats can lag the postings slightly; keep the IDF positive
+        total_documents = max(document_count, document_frequency)
+        idf = math.log(1 + (total_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+        for _, document_id, tf, dl in postings:
+            length_ratio = dl / average_length if average_length else 1.0
+            weight = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+            scores[document_id] = scores.get(document_id, 0.0) + idf * weight
+            matched_terms[document_id] += 1
+
+    if operator != 'or':
+        scores = {document_id: score for document_id, score in scores.items() if matched_terms[document_id] == len(terms)}
+    return scores
+
+
+def iter_ranked(scores):
+    """
+    Yield (documentId, score) from highest to lowest score, popping from a heap
+    so only as many documents as the caller consumes are ordered
+    """
+    heap = [(-score, document_id) for document_id, score in scores.items()]
+    heapq.heapify(heap)
+    while heap:
+        negative_score, document_id = heapq.heappop(heap)
+        yield document_id, -negative_score
+
+
+def normalize_entity(text):
+    """
+    Case- and punctuation-insensitive form of an entity's text
+    ("Amazon.com, Inc." and "amazon com inc" normalise the same)
+    """
+    return ' '.join(ENTITY_SEPARATORS.sub(' ', text.lower()).split())
+
+
+def entity_key(entity_type, text):
+    """
+    Partition key of the documents mentioning one entity
+    """
+    return f'ENTITY#{entity_type.upper()}#{normalize_entity(text)}'
+
+
+def sentiment_key(sentiment):
+    """
+    Partition key of the documents with one overall sentiment
+    """
+    return f'SENTIMENT#{sentiment.upper()}'
+
+
+def index_facets(document_id, user_id, sentiment, entities):
+    """
+    Write the entity and sentiment items for a processed document and delete
+    the ones an earlier analysis left behind
+    """
+    keys = set()
+    if sentiment and sentiment != 'UNKNOWN':
+        keys.add(sentiment_key(sentiment))
+    for entity in entities:
+        if entity.get('Type') and normalize_entity(entity.get('Text', '')):
+            keys.add(entity_key(entity['Type'], entity['Text']))
+
+    sk = document_sort_key(user_id, document_id)
+    table = index_table()
+    response = table.update_item(
+        Key={'pk': f'DOC#{document_id}', 'sk': 'FACETS'},
+        UpdateExpression='SET facetKeys = :keys, userId = :user_id',
+        ExpressionAttributeValues={':keys': sorted(keys), ':user_id': user_id},
+        ReturnValues='UPDATED_OLD'
+    )
+    stale = set(response.get('Attributes', {}).get('facetKeys') or ()) - keys
+
+    with table.batch_writer() as batch:
+        for pk in stale:
+            batch.delete_item(Key={'pk': pk, 'sk': sk})
+        for pk in keys:
+            batch.put_item(Item={'pk': pk, 'sk': sk})
+    return keys
+
+
+def facet_documents(pk, user_id=None):
+    """
+    IDs of the documents indexed under one entity or sentiment key
+    """
+    return {split_sort_key(item['sk'])[1] for item in iter_partition(pk, user_id)}
+
+
+def find_by_facets(sentiment=None, entity=None, entity_type=None, user_id=None):
+    """
+    Document IDs with the given sentiment and mentioning the given entity
+    (of entity_type, or of any type when none is given)
+    """
+    matches = None
+    if sentiment:
+        matches = facet_documents(sentiment_key(sentiment), user_id)
+    if entity and (matches is None or matches):
+        entity_types = (entity_type,) if entity_type else ENTITY_TYPES
+        mentioning = set()
+        for candidate_type in entity_types:
+            mentioning |= facet_documents(entity_key(candidate_type, entity), user_id)
+        matches = mentioning if matches is None else matches & mentioning
+    return matches if matches is not None else set()
@@ -0,0 +1,253 @@
+"""
+Comprehend analysis for extracted document text
+
+Text is split into chunks on line and sentence boundaries so each fits the
+Comprehend byte limit, and nothing past the first 5000 bytes is dropped.
+A single chunk's sentiment, entity and key phrase requests are issued
+concurrently; several chunks (from one document or many) are grouped into
+BatchDetect* calls of up to 25 texts, with the three batch operations for
+each group also running concurrently. Per-chunk results are merged back
+into one analysis per document with document-level offsets.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_clients
+
+LANGUAGE_CODE = 'en'
+
+# Comprehend limits: 5000 bytes per text for sentiment and for batch calls, 25 texts per batch
+MAX_TEXT_BYTES = 5000
+MAX_BATCH_TEXTS = 25
+
+# Shared pool for Comprehend calls, kept for the life of the execution environment
+_executor = ThreadPoolExecutor(max_workers=12)
+
+EMPTY_SENTIMENT = {'Sentiment': 'UNKNOWN', 'SentimentScore': {}}
+
+# Sentence ends: terminal punctuation followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+# Entities and key phrases stored per document, highest score first; a long
+# document can yield thousands, which would push the metadata and result
+# cache items past the 400 KB DynamoDB item limit. The facet index gets them all.
+MAX_ENTITIES = 100
+MAX_KEY_PHRASES = 100
+
+SENTIMENT_LABELS = {
+    'Positive': 'POSITIVE',
+    'Negative': 'NEGATIVE',
+    'Neutral': 'NEUTRAL',
+    'Mixed': 'MIXED'
+}
+
+
+def truncate_utf8(text, max_bytes=MAX_TEXT_BYTES):
+    """
+    Cut text to at most max_bytes of UTF-8 without splitting a character
+    """
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', errors='ignore')
+
+
+def _split_segment(segment, max_bytes):
+    """
+    Break a segment that is too large on its own: first at sentence ends,
+    then at whitespace, then at the byte limit
+    """
+    pieces = []
+    last = 0
+    for match in SENTENCE_BOUNDARY.finditer(segment):
+        pieces.append(segment[last:match.end()])
+        last = match.end()
+    pieces.append(segment[last:])
+
+    for piece in pieces:
+        while len(piece.encode('utf-8')) > max_bytes:
+            head = truncate_utf8(piece, max_bytes)
+            space = max(head.rfind(' '), head.rfind('\t'))
+            if space > 0:
+                head = head[:space + 1]
+            yield head
+            piece = piece[len(head):]
+        if piece:
+            yield piece
+
+
+def split_into_chunks(text, max_bytes=MAX_TEXT_BYTES):
+    """
+    Split text into (offset, chunk) pairs of at most max_bytes UTF-8 bytes,
+    cutting on line boundaries and, for long lines, on sentence boundaries.
+    Each chunk is the exact slice text[offset:offset + len(chunk)], so
+    Comprehend offsets within it map back to the document by adding offset.
+    Whitespace-only chunks are skipped.
+    """
+    chunks = []
+    start = 0
+    current = []
+    current_bytes = 0
+    position = 0
+
+    def flush():
+        chunk = ''.join(current)
+        if chunk.strip():
+            chunks.append((start, chunk))
+
+    for line in text.splitlines(keepends=True):
+        for segment in (_split_segment(line, max_bytes) if len(line.encode('utf-8')) > max_bytes else (line,)):
+            size = len(segment.encode('utf-8'))
+            if current and current_bytes + size > max_bytes:
+                flush()
+                current, current_bytes = [], 0
+            if not current:
+                start = position
+            current.append(segment)
+            current_bytes += size
+            position += len(segment)
+
+    if current:
+        flush()
+    return chunks
+
+
+def merge_chunk_analyses(chunks, analyses):
+    """
+    Merge per-chunk (sentiment, entities, key_phrases) results into one
+    document analysis. Sentiment scores are averaged weighted by chunk size;
+    entities and key phrases are deduplicated case-insensitively, keeping the
+    highest score, the first document-level offsets and an occurrence count,
+    and are returned best first.
+    """
+    totals = {}
+    total_weight = 0
+    entities = {}
+    key_phrases = {}
+
+    for (offset, chunk), (sentiment, chunk_entities, chunk_key_phrases) in zip(chunks, analyses):
+        scores = (sentiment or {}).get('SentimentScore') or {}
+        if scores:
+            weight = len(chunk)
+            total_weight += weight
+            for name, score in scores.items():
+                totals[name] = totals.get(name, 0.0) + score * weight
+
+        for entity in (chunk_entities or {}).get('Entities', []):
+            _merge_span(entities, (entity.get('Type'), entity['Text'].lower()), entity, offset)
+
+        for phrase in (chunk_key_phrases or {}).get('KeyPhrases', []):
+            _merge_span(key_phrases, phrase['Text'].lower(), phrase, offset)
+
+    if total_weight:
+        sentiment_score = {name: total / total_weight for name, total in totals.items()}
+        dominant = max(sentiment_score, key=sentiment_score.get)
+        sentiment_result = {'Sentiment': SENTIMENT_LABELS.get(dominant, dominant.upper()), 'SentimentScore': sentiment_score}
+    else:
+        sentiment_result = dict(EMPTY_SENTIMENT)
+
+    return (
+        sentiment_result,
+        {'Entities': _best_first(entities.values())},
+        {'KeyPhrases': _best_first(key_phrases.values())}
+    )
+
+
+def capped(analysis):
+    """
+    A merged analysis with only its MAX_ENTITIES best entities and
+    MAX_KEY_PHRASES best key phrases, small enough to store on one item
+    """
+    sentiment, entities, key_phrases = analysis
+    if entities:
+        entities = dict(entities, Entities=entities.get('Entities', [])[:MAX_ENTITIES])
+    if key_phrases:
+        key_phrases = dict(key_phrases, KeyPhrases=key_phrases.get('KeyPhrases', [])[:MAX_KEY_PHRASES])
+    return sentiment, entities, key_phrases
+
+
+def _best_first(spans):
+    """
+    Merged spans from the highest score down, more frequent ones first on a tie
+    """
+    return sorted(spans, key=lambda span: (span.get('Score', 0), span['Occurrences']), reverse=True)
+
+
+def _merge_span(merged, key, span, offset):
+    """
+    Fold one entity/key phrase into the merged map, shifting its offsets by
+    the chunk offset
+    """
+    existing = merged.get(key)
+    if existing is None:
+        span = dict(span)
+        if 'BeginOffset' in span:
+            span['BeginOffset'] += offset
+            span['EndOffset'] += offset
+        span['Occurrences'] = 1
+        merged[key] = span
+        return
+    existing['Occurrences'] += 1
+    if span.get('Score', 0) > existing.get('Score', 0):
+        existing['Score'] = span['Score']
+
+
+def analyze_text(text):
+    """
+    Detect sentiment, entities and key phrases for one text, all three at once
+    Returns (sentiment_result, entities_result, key_phrases_result)
+    """
+    comprehend_client = aws_clients.client('comprehend')
+    text = truncate_utf8(text)
+
+    sentiment = _executor.submit(comprehend_client.detect_sentiment, Text=text, LanguageCode=LANGUAGE_CODE)
+    entities = _executor.submit(comprehend_client.detect_entities, Text=text, LanguageCode=LANGUAGE_CODE)
+    key_phrases = _executor.submit(comprehend_client.detect_key_phrases, Text=text, LanguageCode=LANGUAGE_CODE)
+
+    return sentiment.result(), entities.result(), key_phrases.result()
+
+
+def _batch_results(operation, texts):
+    """
+    Call a BatchDetect* operation and return one result per text (None on error)
+    """
+    # Imported here so loading the module does not pull in botocore
+    from botocore.exceptions import ClientError
+
+    try:
+        response = operation(TextList=texts, LanguageCode=LANGUAGE_CODE)
+    except ClientError as e:
+        print(f"Comprehend batch error: {str(e)}")
+        return [None] * len(texts)
+
+    results = [None] * len(texts)
+    for item in response.get('ResultList', []):
+        results[item['Index']] = item
+    for error in response.get('ErrorList', []):
+        print(f"Comprehend error for text {error['Index']}: {error.get('ErrorMessage')}")
+    return results
+
+
+def analyze_texts_batch(texts):
+    """
+    Analyze many texts with BatchDetectSentiment/Entities/KeyPhrases in groups
+    of 25. Returns one (sentiment, entities, key_phrases) tuple per input text,
+    with None for any result Comprehend did not return.
+    """
+    comprehend_client = aws_clients.client('comprehend')
+    texts = [truncate_utf8(text) for text in texts]
+
+    futures = []
+    for start in range(0, len(texts), MAX_BATCH_TEXTS):
+        group = texts[start:start + MAX_BATCH_TEXTS]
+        futures.append((
+            _executor.submit(_batch_results, comprehend_client.batch_detect_sentiment, group),
+            _executor.submit(_batch_results, comprehend_client.batch_detect_entities, group),
+            _executor.submit(_batch_results, comprehend_client.batch_detect_key_phrases, group)
+        ))
+
+    analyses = []
+    for sentiment_future, entities_future, key_phrases_future in futures:
+        for sentiment, entities, key_phrases in zip(sentiment_future.result(), entities_future.result(), key_phrases_future.result()):
+            analyses.append((sentiment, entities, key_phrases))
+    return analyses
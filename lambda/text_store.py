@@ -0,0 +1,80 @@
+"""
+Extracted document text kept in S3 instead of the DynamoDB metadata item
+
+The full text is stored gzip-compressed under extracted/{documentId}.txt.gz
+in the document bucket. The metadata item only carries a pointer
+(extractedTextKey), a short preview and the text length, so it stays far
+below the 400 KB item limit and table reads stay cheap. Callers fetch the
+full text with load_text() only when they actually need it.
+"""
+import gzip
+
+import aws_clients
+
+TEXT_PREFIX = 'extracted/'
+PREVIEW_CHARS = 500
+
+
+def text_key(document_id):
+    """
+    S3 key of a document's extracted text
+    """
+    return f'{TEXT_PREFIX}{document_id}.txt.gz'
+
+
+def is_text_key(key):
+    """
+    Whether an S3 key belongs to the extracted-text area (not an upload)
+    """
+    return key.startswith(TEXT_PREFIX)
+
+
+def preview(text):
+    """
+    The leading part of the text stored on the metadata item
+    """
+    return text[:PREVIEW_CHARS]
+
+
+def save_text(bucket, document_id, text):
+    """
+    Compress and upload the extracted text; returns its S3 key
+    """
+    key = text_key(document_id)
+    aws_clients.client('s3').put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=gzip.compress(text.encode('utf-8')),
+        ContentType='text/plain; charset=utf-8',
+        ContentEncoding='gzip'
+    )
+    return key
+
+
+def load_text(bucket, key):
+    """
+    Download and decompress extracted text
+    """
+    response = aws_clients.client('s3').get_object(Bucket=bucket, Key=key)
+    return gzip.decompress(response['Body'].read()).decode('utf-8')
+
+
+def item_text(item, bucket):
+    """
+    Full extracted text of a metadata item, loaded from S3 on demand
+    Items written before the text moved to S3 still carry it inline
+    """
+    if item.get('extractedText') is not None:
+        return item['extractedText']
+    if item.get('extractedTextKey'):
+        return load_text(bucket, item['extractedTextKey'])
+    return ''
+
+
+def item_preview(item):
+    """
+    Preview text of a metadata item, old or new layout
+    """
+    if item.get('extractedTextPreview') is not None:
+        return item['extractedTextPreview']
+    return preview(item.get('extractedText') or '')
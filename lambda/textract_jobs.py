@@ -0,0 +1,111 @@
+"""
+Asynchronous Textract text detection for multi-page documents
+
+The synchronous detect_document_text call only accepts single-page images,
+so PDFs and TIFFs are sent through StartDocumentTextDetection instead.
+Textract publishes the job outcome to the SNS topic named by
+TEXTRACT_SNS_TOPIC_ARN (using TEXTRACT_ROLE_ARN); the processing Lambda is
+subscribed to that topic and streams the result pages when it is notified.
+Without a topic the job is polled within the invocation's remaining time.
+"""
+import json
+import os
+import time
+
+import aws_clients
+
+# File types that need the asynchronous, multi-page API
+ASYNC_EXTENSIONS = ('.pdf', '.tif', '.tiff')
+
+# Blocks per GetDocumentTextDetection page (the API maximum)
+RESULT_PAGE_SIZE = 1000
+
+# Polling fallback when no notification channel is configured
+POLL_INTERVAL_SECONDS = 2
+POLL_SAFETY_MARGIN_MS = 10000
+
+
+def is_async_document(key):
+    """
+    Whether a document should go through the job-based API
+    """
+    return key.lower().endswith(ASYNC_EXTENSIONS)
+
+
+def notification_channel():
+    """
+    The SNS notification channel for job completion, if one is configured
+    """
+    topic_arn = os.environ.get('TEXTRACT_SNS_TOPIC_ARN')
+    role_arn = os.environ.get('TEXTRACT_ROLE_ARN')
+    if topic_arn and role_arn:
+        return {'SNSTopicArn': topic_arn, 'RoleArn': role_arn}
+    return None
+
+
+def start_text_detection(bucket, key, document_id):
+    """
+    Start an asynchronous text detection job and return its JobId
+    """
+    params = {
+        'DocumentLocation': {'S3Object': {'Bucket': bucket, 'Name': key}},
+        # JobTag lets the completion handler find the document again
+        'JobTag': document_id,
+        # Textract returns the same JobId for a repeated token, so S3 event retries do not start a second job
+        'ClientRequestToken': document_id
+    }
+    channel = notification_channel()
+    if channel:
+        params['NotificationChannel'] = channel
+    response = aws_clients.client('textract').start_document_text_detection(**params)
+    return response['JobId']
+
+
+def parse_completion(record):
+    """
+    Read a Textract completion notification from an SNS event record
+    """
+    message = json.loads(record['Sns']['Message'])
+    location = message.get('DocumentLocation', {})
+    return {
+        'jobId': message['JobId'],
+        'jobStatus': message['Status'],
+        'documentId': message.get('JobTag'),
+        'bucket': location.get('S3Bucket'),
+        'key': location.get('S3ObjectName')
+    }
+
+
+def wait_for_job(job_id, context):
+    """
+    Poll a job until it leaves IN_PROGRESS or the invocation is about to run
+    out of time. Returns the job status, or None if the deadline was reached.
+    """
+    textract_client = aws_clients.client('textract')
+    while True:
+        response = textract_client.get_document_text_detection(JobId=job_id, MaxResults=1)
+        if response['JobStatus'] != 'IN_PROGRESS':
+            return response['JobStatus']
+        if context is not None and context.get_remaining_time_in_millis() < POLL_SAFETY_MARGIN_MS:
+            return None
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def iter_text_lines(job_id):
+    """
+    Yield the LINE text of a finished job one result page at a time, so only
+    a single page of blocks is held in memory
+    """
+    textract_client = aws_clients.client('textract')
+    params = {'JobId': job_id, 'MaxResults': RESULT_PAGE_SIZE}
+    while True:
+        response = textract_client.get_document_text_detection(**params)
+        if response['JobStatus'] != 'SUCCEEDED':
+            raise RuntimeError(f"Textract job {job_id} finished with status {response['JobStatus']}")
+        for block in response.get('Blocks', []):
+            if block['BlockType'] == 'LINE':
+                yield block['Text']
+        next_token = response.get('NextToken')
+        if not next_token:
+            return
+        params['NextToken'] = next_token
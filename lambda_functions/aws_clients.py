@@ -0,0 +1,95 @@
+"""
+Shared boto3 clients and resources for the task handlers
+
+Clients are created once per Lambda execution environment and reused by
+every warm invocation, so the session, service models and pooled HTTPS
+connections survive between requests. boto3 itself is imported on first
+use, so importing a handler stays cheap and a request that never reaches
+AWS (a validation error, an unknown route) does not pay for it. Tests can
+install a stand-in with override() and drop it again with reset().
+Every client is instrumented for per-request call timings (metrics.py).
+"""
+import threading
+
+import metrics
+
+# Keep idle connections open between invocations and retry throttles with backoff
+CLIENT_OPTIONS = dict(
+    tcp_keepalive=True,
+    max_pool_connections=25,
+    retries={'max_attempts': 5, 'mode': 'standard'}
+)
+
+_lock = threading.Lock()
+_session = None
+_config = None
+_clients = {}
+_resources = {}
+_tables = {}
+
+
+def _get_session():
+    global _session, _config
+    if _session is None:
+        import boto3
+        from botocore.config import Config
+        _config = Config(**CLIENT_OPTIONS)
+        _session = boto3.session.Session()
+    return _session
+
+
+def client(service_name):
+    """
+    Return the shared low-level client for a service
+    """
+    if service_name not in _clients:
+        with _lock:
+            if service_name not in _clients:
+                _clients[service_name] = metrics.instrument(_get_session().client(service_name, config=_config))
+    return _clients[service_name]
+
+
+def resource(service_name):
+    """
+    Return the shared resource object for a service
+    """
+    if service_name not in _resources:
+        with _lock:
+            if service_name not in _resources:
+                _resources[service_name] = _get_session().resource(service_name, config=_config)
+                metrics.instrument(_resources[service_name].meta.client)
+    return _resources[service_name]
+
+
+def table(table_name):
+    """
+    Return a cached DynamoDB Table resource
+    """
+    if table_name not in _tables:
+        _tables[table_name] = resource('dynamodb').Table(table_name)
+    return _tables[table_name]
+
+
+def override(service_name, client_stub=None, resource_stub=None):
+    """
+    Install a stand-in client and/or resource for a service (used by tests)
+    """
+    with _lock:
+        if client_stub is not None:
+            _clients[service_name] = client_stub
+        if resource_stub is not None:
+            _resources[service_name] = resource_stub
+        if service_name == 'dynamodb':
+            _tables.clear()
+
+
+def reset():
+    """
+    Forget every cached client, resource and table
+    """
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
@@ -0,0 +1,64 @@
+"""
+Chunked BatchWriteItem with retries for UnprocessedItems
+"""
+import random
+import time
+
+import aws_clients
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_CHUNK_SIZE = 25
+
+# Retry schedule for UnprocessedItems (exponential backoff with full jitter)
+MAX_BATCH_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 2.0
+
+RETRYABLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException')
+
+
+def request_task_id(request):
+    """
+    The taskId a PutRequest or DeleteRequest refers to
+    """
+    if 'PutRequest' in request:
+        return request['PutRequest']['Item']['taskId']
+    return request['DeleteRequest']['Key']['taskId']
+
+
+def write_batch(table_name, requests):
+    """
+    Send PutRequest/DeleteRequest entries in 25-item chunks, retrying
+    UnprocessedItems with backoff. Returns a dict of taskId -> error message
+    for the writes that could not be completed.
+    """
+    # Imported here so loading the module does not pull in botocore
+    from botocore.exceptions import ClientError
+
+    dynamodb = aws_clients.resource('dynamodb')
+    failed = {}
+
+    for start in range(0, len(requests), BATCH_WRITE_CHUNK_SIZE):
+        pending = requests[start:start + BATCH_WRITE_CHUNK_SIZE]
+
+        for attempt in range(MAX_BATCH_ATTEMPTS):
+            if attempt:
+                delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+            try:
+                response = dynamodb.batch_write_item(RequestItems={table_name: pending})
+            except ClientError as e:
+                if e.response['Error']['Code'] in RETRYABLE_ERRORS:
+                    continue
+                for request in pending:
+                    failed[request_task_id(request)] = str(e)
+                pending = []
+                break
+            pending = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not pending:
+                break
+
+        for request in pending:
+            failed[request_task_id(request)] = 'Write not processed after retries'
+
+    return failed
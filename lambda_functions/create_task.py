@@ -1,36 +1,130 @@
 import json
-import boto3
 import os
-import uuid
 from datetime import datetime
 
+import aws_clients
+import idempotency
+import metrics
+import ulid
+from batch_write import write_batch
+
+MAX_BATCH_TASKS = 1000
+
+BATCH_RESOURCE = '/tasks/batch'
+
+def build_task(body, created_at):
+    """
+    Build a new task item from a request payload
+    """
+    return {
+        # Time-ordered, so task IDs sort by creation
+        'taskId': ulid.generate(),
+        'userId': body.get('userId', 'default-user'),
+        'title': body.get('title'),
+        'description': body.get('description', ''),
+        'status': 'pending',
+        'priority': body.get('priority', 'medium'),
+        'category': body.get('category', 'general'),
+        'dueDate': body.get('dueDate', 'no-due-date'),
+        'createdAt': created_at,
+        'updatedAt': created_at
+    }
+
+def is_batch_request(event, body):
+    """
+    A batch create is either POST /tasks/batch or a body of the form {"tasks": [...]}
+    """
+    if event.get('resource') == BATCH_RESOURCE or (event.get('path') or '').endswith(BATCH_RESOURCE):
+        return True
+    return isinstance(body, dict) and isinstance(body.get('tasks'), list)
+
+def create_tasks_batch(table_name, payloads):
+    """
+    Create many tasks in one request and report the outcome of each one
+    """
+    created_at = datetime.utcnow().isoformat()
+    results = []
+    tasks = []
+    
+    for index, payload in enumerate(payloads):
+        if not isinstance(payload, dict):
+            results.append({'index': index, 'status': 'failed', 'error': 'Task must be a JSON object'})
+            continue
+        task = build_task(payload, created_at)
+        tasks.append(task)
+        results.append({'index': index, 'status': 'created', 'taskId': task['taskId'], 'task': task})
+    
+    failed = write_batch(table_name, [{'PutRequest': {'Item': task}} for task in tasks])
+    
+    for result in results:
+        error = failed.get(result.get('taskId'))
+        if error:
+            result['status'] = 'failed'
+            result['error'] = error
+            del result['task']
+    
+    return results
+
+@metrics.handler
 def handler(event, context):
     """
-    Lambda function to create a new task
+    Lambda function to create a new task, or many tasks via POST /tasks/batch
+    Requests with an Idempotency-Key header are created once; retries get the original response
+    """
+    return idempotency.run(event, 'create_task', lambda: create(event))
+
+def create(event):
+    """
+    Create the task(s) described by the request body
     """
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(os.environ['TABLE_NAME'])
+        table_name = os.environ['TABLE_NAME']
+        table = aws_clients.table(table_name)
         
         # Parse request body
         body = json.loads(event['body'])
         
-        task_id = str(uuid.uuid4())
-        created_at = datetime.utcnow().isoformat()
+        if is_batch_request(event, body):
+            payloads = body.get('tasks') if isinstance(body, dict) else body
+            if not isinstance(payloads, list) or not payloads:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': 'A non-empty "tasks" array is required'})
+                }
+            if len(payloads) > MAX_BATCH_TASKS:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': f'At most {MAX_BATCH_TASKS} tasks can be created per request'})
+                }
+            
+            results = create_tasks_batch(table_name, payloads)
+            failed_count = sum(1 for result in results if result['status'] == 'failed')
+            
+            return {
+                'statusCode': 201 if failed_count == 0 else 207,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Idempotency-Key'
+                },
+                'body': json.dumps({
+                    'message': 'Batch processed',
+                    'created': len(results) - failed_count,
+                    'failed': failed_count,
+                    'results': results
+                })
+            }
         
-        # Create task item
-        task = {
-            'taskId': task_id,
-            'userId': body.get('userId', 'default-user'),
-            'title': body.get('title'),
-            'description': body.get('description', ''),
-            'status': 'pending',
-            'priority': body.get('priority', 'medium'),
-            'category': body.get('category', 'general'),
-            'dueDate': body.get('dueDate', 'no-due-date'),
-            'createdAt': created_at,
-            'updatedAt': created_at
-        }
+        task = build_task(body, datetime.utcnow().isoformat())
         
         # Save to DynamoDB
         table.put_item(Item=task)
@@ -41,14 +135,14 @@ def handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Idempotency-Key'
             },
             'body': json.dumps({
                 'message': 'Task created successfully',
                 'task': task
             })
         }
-        
+    
     except Exception as e:
         return {
             'statusCode': 500,
@@ -58,4 +152,3 @@ def handler(event, context):
             },
             'body': json.dumps({'error': str(e)})
         }
-
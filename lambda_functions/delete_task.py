@@ -1,19 +1,96 @@
 import json
-import boto3
 import os
 
+import aws_clients
+import metrics
+from batch_write import write_batch
+from get_tasks import FILTER_FIELDS, iter_user_tasks
+
+MAX_BULK_DELETE = 1000
+
+def resolve_delete_targets(table, query_params, body):
+    """
+    Work out which tasks a bulk delete covers. Returns (task_ids, has_more).
+    Accepts {"taskIds": [...]} in the body, or a userId plus at least one of
+    status/priority/category from the body's "filter" or the query string.
+    """
+    if 'taskIds' in body:
+        task_ids = body['taskIds']
+        if not isinstance(task_ids, list) or not all(isinstance(task_id, str) for task_id in task_ids):
+            raise ValueError('taskIds must be a list of strings')
+        task_ids = list(dict.fromkeys(task_ids))
+        if len(task_ids) > MAX_BULK_DELETE:
+            raise ValueError(f'At most {MAX_BULK_DELETE} tasks can be deleted per request')
+        return task_ids, False
+    
+    task_filter = body.get('filter') if isinstance(body.get('filter'), dict) else query_params
+    user_id = task_filter.get('userId')
+    filters = {field: task_filter[field] for field in FILTER_FIELDS if task_filter.get(field)}
+    if not user_id or not filters:
+        raise ValueError('Either taskIds or a userId with a status, priority or category filter is required')
+    
+    # Find the keys through the UserIndex GSI, fetching only the key attribute
+    task_ids = []
+    for item in iter_user_tasks(table, user_id, filters, projection='taskId'):
+        if len(task_ids) == MAX_BULK_DELETE:
+            return task_ids, True
+        task_ids.append(item['taskId'])
+    return task_ids, False
+
+@metrics.handler
 def handler(event, context):
     """
-    Lambda function to delete a task
+    Lambda function to delete a task, or many tasks via DELETE /tasks
     """
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(os.environ['TABLE_NAME'])
+        table_name = os.environ['TABLE_NAME']
+        table = aws_clients.table(table_name)
         
         # Get task ID from path parameters
         path_params = event.get('pathParameters') or {}
         task_id = path_params.get('taskId')
         
+        if not task_id and event.get('resource') == '/tasks':
+            query_params = event.get('queryStringParameters') or {}
+            body = json.loads(event['body']) if event.get('body') else {}
+            try:
+                task_ids, has_more = resolve_delete_targets(table, query_params, body)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            # Remove them with chunked batch_write_item delete requests
+            failed = write_batch(table_name, [{'DeleteRequest': {'Key': {'taskId': task_id}}} for task_id in task_ids])
+            results = []
+            for task_id in task_ids:
+                if task_id in failed:
+                    results.append({'taskId': task_id, 'status': 'failed', 'error': failed[task_id]})
+                else:
+                    results.append({'taskId': task_id, 'status': 'deleted'})
+            
+            return {
+                'statusCode': 200 if not failed else 207,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+                },
+                'body': json.dumps({
+                    'message': 'Bulk delete processed',
+                    'deleted': len(task_ids) - len(failed),
+                    'failed': len(failed),
+                    'hasMore': has_more,
+                    'results': results
+                })
+            }
+        
         if not task_id:
             return {
                 'statusCode': 400,
@@ -40,7 +117,7 @@ def handler(event, context):
                 'taskId': task_id
             })
         }
-        
+    
     except Exception as e:
         return {
             'statusCode': 500,
@@ -50,4 +127,3 @@ def handler(event, context):
             },
             'body': json.dumps({'error': str(e)})
         }
-
@@ -1,32 +1,258 @@
+import base64
 import json
-import boto3
 import os
+from datetime import datetime, timezone
 
+import aws_clients
+import metrics
+
+USER_INDEX = 'UserIndex'
+
+# userId + createdAt GSI for "created since/before" range reads
+CREATED_INDEX = 'UserCreatedIndex'
+
+# Attributes of a LastEvaluatedKey from each index: the table key and the index key
+USER_INDEX_KEY_ATTRIBUTES = ('taskId', 'userId', 'dueDate')
+CREATED_INDEX_KEY_ATTRIBUTES = ('taskId', 'userId', 'createdAt')
+
+# Query string parameters that map directly onto task attributes
+FILTER_FIELDS = ('status', 'priority', 'category')
+
+# Task attributes a client can ask for with fields=; the default projection.
+# taskId is always returned.
+TASK_FIELDS = (
+    'taskId', 'userId', 'title', 'description', 'status', 'priority',
+    'category', 'dueDate', 'createdAt', 'updatedAt'
+)
+
+# Page size bounds for the limit query parameter
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Upper bound on DynamoDB round trips per request when filters discard most items
+MAX_PAGES_PER_REQUEST = 10
+
+def encode_cursor(last_evaluated_key):
+    """
+    Wrap a DynamoDB LastEvaluatedKey in an opaque, URL-safe cursor string
+    """
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor produced by encode_cursor back into an ExclusiveStartKey
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, dict):
+        raise ValueError('Invalid cursor')
+    return key
+
+def parse_cursor(cursor, key_attributes, user_id):
+    """
+    Decode a cursor and check it was issued for the same index and user, so a
+    mismatched one is rejected instead of becoming an invalid ExclusiveStartKey
+    """
+    key = decode_cursor(cursor)
+    if sorted(key) != sorted(key_attributes) or not all(isinstance(value, str) for value in key.values()):
+        raise ValueError('Invalid cursor')
+    if key['userId'] != user_id:
+        raise ValueError('Invalid cursor')
+    return key
+
+def parse_limit(value):
+    """
+    Validate the limit query parameter, falling back to DEFAULT_LIMIT
+    """
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, MAX_LIMIT)
+
+def parse_fields(value):
+    """
+    Validate the comma-separated fields query parameter, falling back to TASK_FIELDS
+    """
+    if not value:
+        return list(TASK_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in TASK_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return list(dict.fromkeys(['taskId'] + fields))
+
+def apply_projection(query_kwargs, fields):
+    """
+    Have DynamoDB return only the given attributes. Names go through
+    placeholders because several (status, name, ...) are reserved words.
+    """
+    names = query_kwargs.setdefault('ExpressionAttributeNames', {})
+    placeholders = []
+    for field in fields:
+        names[f'#{field}'] = field
+        placeholders.append(f'#{field}')
+    query_kwargs['ProjectionExpression'] = ', '.join(placeholders)
+    return query_kwargs
+
+def parse_timestamp(value, name):
+    """
+    Validate an ISO 8601 timestamp parameter and express it the way createdAt
+    is stored (naive UTC isoformat), so string comparison orders correctly
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 timestamp')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+def build_created_query(user_id, filters, created_since=None, created_before=None):
+    """
+    Query arguments for a user's tasks created in [created_since, created_before),
+    newest first, read as a range of the UserCreatedIndex GSI
+    """
+    # Imported here so loading the module does not pull in boto3
+    from boto3.dynamodb.conditions import Attr, Key
+    
+    condition = Key('userId').eq(user_id)
+    if created_since and created_before:
+        # BETWEEN is inclusive; the upper bound is dropped by the filter below
+        condition = condition & Key('createdAt').between(created_since, created_before)
+    elif created_since:
+        condition = condition & Key('createdAt').gte(created_since)
+    else:
+        condition = condition & Key('createdAt').lt(created_before)
+    
+    query_kwargs = {
+        'IndexName': CREATED_INDEX,
+        'KeyConditionExpression': condition,
+        'ScanIndexForward': False
+    }
+    filter_expression = build_filter_expression(filters)
+    if created_since and created_before:
+        before = Attr('createdAt').lt(created_before)
+        filter_expression = before if filter_expression is None else filter_expression & before
+    if filter_expression is not None:
+        query_kwargs['FilterExpression'] = filter_expression
+    return query_kwargs
+
+def build_user_query(user_id, filters):
+    """
+    Query arguments for one user's partition of the UserIndex GSI (dueDate order)
+    """
+    from boto3.dynamodb.conditions import Key
+    
+    query_kwargs = {
+        'IndexName': USER_INDEX,
+        'KeyConditionExpression': Key('userId').eq(user_id),
+        'ScanIndexForward': True
+    }
+    filter_expression = build_filter_expression(filters)
+    if filter_expression is not None:
+        query_kwargs['FilterExpression'] = filter_expression
+    return query_kwargs
+
+def iter_user_tasks(table, user_id, filters, projection=None):
+    """
+    Yield every task of a user matching the filters, following LastEvaluatedKey
+    """
+    query_kwargs = build_user_query(user_id, filters)
+    if projection:
+        query_kwargs['ProjectionExpression'] = projection
+    while True:
+        response = table.query(**query_kwargs)
+        for item in response.get('Items', []):
+            yield item
+        if not response.get('LastEvaluatedKey'):
+            return
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def query_page(table, query_kwargs, limit, exclusive_start_key=None):
+    """
+    Read up to `limit` matching items, following LastEvaluatedKey when a
+    FilterExpression leaves a page short. Returns (items, last_evaluated_key).
+    """
+    items = []
+    last_evaluated_key = exclusive_start_key
+    for _ in range(MAX_PAGES_PER_REQUEST):
+        request = dict(query_kwargs, Limit=limit - len(items))
+        if last_evaluated_key:
+            request['ExclusiveStartKey'] = last_evaluated_key
+        response = table.query(**request)
+        items.extend(response.get('Items', []))
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key or len(items) >= limit:
+            break
+    return items, last_evaluated_key
+
+def build_filter_expression(query_params):
+    """
+    Combine the optional status/priority/category filters into one condition
+    """
+    from boto3.dynamodb.conditions import Attr
+    
+    filter_expression = None
+    for field in FILTER_FIELDS:
+        value = query_params.get(field)
+        if not value:
+            continue
+        condition = Attr(field).eq(value)
+        filter_expression = condition if filter_expression is None else filter_expression & condition
+    return filter_expression
+
+@metrics.handler
 def handler(event, context):
     """
     Lambda function to get all tasks with optional filtering
     """
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(os.environ['TABLE_NAME'])
+        table = aws_clients.table(os.environ['TABLE_NAME'])
         
         # Get query parameters
         query_params = event.get('queryStringParameters') or {}
         user_id = query_params.get('userId', 'default-user')
-        status = query_params.get('status')
         
-        # Scan table with optional filters
-        if status:
-            response = table.scan(
-                FilterExpression=boto3.dynamodb.conditions.Attr('userId').eq(user_id) & 
-                              boto3.dynamodb.conditions.Attr('status').eq(status)
-            )
+        try:
+            limit = parse_limit(query_params.get('limit'))
+            fields = parse_fields(query_params.get('fields'))
+            created_since = query_params.get('createdSince')
+            created_before = query_params.get('createdBefore')
+            created_since = parse_timestamp(created_since, 'createdSince') if created_since else None
+            created_before = parse_timestamp(created_before, 'createdBefore') if created_before else None
+            cursor = query_params.get('cursor')
+            key_attributes = CREATED_INDEX_KEY_ATTRIBUTES if created_since or created_before else USER_INDEX_KEY_ATTRIBUTES
+            exclusive_start_key = parse_cursor(cursor, key_attributes, user_id) if cursor else None
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': str(e)})
+            }
+        
+        if created_since or created_before:
+            # Creation-time range on the UserCreatedIndex GSI; results come back newest first
+            query_kwargs = build_created_query(user_id, query_params, created_since, created_before)
         else:
-            response = table.scan(
-                FilterExpression=boto3.dynamodb.conditions.Attr('userId').eq(user_id)
-            )
+            # Query the user's partition of the UserIndex GSI; results come back in dueDate order
+            query_kwargs = build_user_query(user_id, query_params)
+        query_kwargs = apply_projection(query_kwargs, fields)
         
-        tasks = response.get('Items', [])
+        tasks, last_evaluated_key = query_page(table, query_kwargs, limit, exclusive_start_key)
         
         return {
             'statusCode': 200,
@@ -38,7 +264,8 @@ def handler(event, context):
             },
             'body': json.dumps({
                 'tasks': tasks,
-                'count': len(tasks)
+                'count': len(tasks),
+                'nextCursor': encode_cursor(last_evaluated_key)
             })
         }
         
@@ -0,0 +1,215 @@
+"""
+Per-request latency metrics for the task handlers, in CloudWatch Embedded Metric Format
+
+handler() wraps a Lambda handler: it times the invocation and, through
+botocore's before-call/after-call events (hooked up by aws_clients on every
+client it creates), each AWS call made while it runs, including calls made
+from worker threads. When the handler returns, one EMF JSON line is printed;
+CloudWatch Logs turns it into metrics with Route and Status dimensions:
+
+    Duration                  the whole invocation
+    HandlerDuration           time not spent waiting on AWS calls
+    <Service>Duration/Calls   per downstream service, e.g. DynamoDBDuration
+
+The same line carries the slowest individual calls and any phase() timings
+as plain properties, so a slow request's hot spot can be found with Logs
+Insights. METRICS_NAMESPACE sets the namespace; METRICS_ENABLED=false
+turns the output off.
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+DEFAULT_NAMESPACE = 'TaskManager'
+
+# Metric names for the services the handlers call
+SERVICE_NAMES = {
+    'dynamodb': 'DynamoDB',
+    's3': 'S3',
+    'textract': 'Textract',
+    'comprehend': 'Comprehend',
+}
+
+# Individual calls reported with each request, slowest first
+MAX_REPORTED_CALLS = 10
+
+_START = 'metrics_start'
+
+_active = None
+_cold_start = True
+
+
+class Recorder:
+    """
+    Timings collected during one invocation
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.calls = []
+        self.phases = {}
+
+    def add_call(self, service, operation, milliseconds, error=None):
+        with self.lock:
+            self.calls.append((service, operation, milliseconds, error))
+
+    def add_phase(self, name, milliseconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + milliseconds
+
+
+def enabled():
+    return os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+
+def _before_call(context=None, **kwargs):
+    if _active is not None and context is not None:
+        context[_START] = time.perf_counter()
+
+
+def _record_call(context, service, operation, error):
+    recorder = _active
+    if recorder is None or context is None or _START not in context:
+        return
+    milliseconds = (time.perf_counter() - context.pop(_START)) * 1000
+    recorder.add_call(service, operation, milliseconds, error)
+
+
+def _after_call(model=None, context=None, parsed=None, **kwargs):
+    error = parsed['Error'].get('Code') if parsed and 'Error' in parsed else None
+    _record_call(context, model.service_model.service_name, model.name, error)
+
+
+def _after_call_error(event_name=None, context=None, exception=None, **kwargs):
+    # Sent when the request itself failed (connection errors, timeouts after
+    # retries) and without the operation model: the names come from the event,
+    # "after-call-error.<service>.<Operation>"
+    _, service, operation = (event_name or '..').split('.', 2)
+    _record_call(context, service or 'unknown', operation or 'unknown', type(exception).__name__ if exception else 'Error')
+
+
+def instrument(client):
+    """
+    Time every call a boto3 client makes (stand-ins without botocore events are left alone)
+    """
+    events = getattr(getattr(client, 'meta', None), 'events', None)
+    if events is None:
+        return client
+    # First, so the clock starts even if a later before-call handler supplies the response
+    events.register_first('before-call.*.*', _before_call, unique_id='metrics-before-call')
+    events.register_first('after-call.*.*', _after_call, unique_id='metrics-after-call')
+    events.register_first('after-call-error.*.*', _after_call_error, unique_id='metrics-after-call-error')
+    return client
+
+
+class phase:
+    """
+    Context manager timing a named stage of the handler's work
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _active is not None:
+            _active.add_phase(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+def route_of(event):
+    """
+    Route dimension: "METHOD /resource" for API Gateway, the event source otherwise
+    """
+    if not isinstance(event, dict):
+        return 'invoke'
+    if event.get('httpMethod'):
+        return f"{event['httpMethod']} {event.get('resource') or event.get('path') or ''}"
+    records = event.get('Records') or []
+    if records and isinstance(records[0], dict):
+        return records[0].get('eventSource') or records[0].get('EventSource') or 'event'
+    return 'invoke'
+
+
+def build_document(recorder, route, status, context, cold_start):
+    """
+    The EMF document for one finished invocation
+    """
+    duration = (time.perf_counter() - recorder.started) * 1000
+    values = {'Duration': duration}
+    units = {'Duration': 'Milliseconds'}
+    waiting = 0.0
+    with recorder.lock:
+        calls = list(recorder.calls)
+        phases = dict(recorder.phases)
+    for service, operation, milliseconds, error in calls:
+        name = SERVICE_NAMES.get(service, service.capitalize())
+        values[f'{name}Duration'] = values.get(f'{name}Duration', 0.0) + milliseconds
+        values[f'{name}Calls'] = values.get(f'{name}Calls', 0) + 1
+        units[f'{name}Duration'] = 'Milliseconds'
+        units[f'{name}Calls'] = 'Count'
+        waiting += milliseconds
+    # Calls made in parallel can add up to more than the wall-clock time
+    values['HandlerDuration'] = max(0.0, duration - waiting)
+    units['HandlerDuration'] = 'Milliseconds'
+
+    slowest = sorted(calls, key=lambda call: call[2], reverse=True)[:MAX_REPORTED_CALLS]
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE),
+                'Dimensions': [['Route', 'Status']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]
+            }]
+        },
+        'Route': route,
+        'Status': str(status),
+        'ColdStart': cold_start,
+        'Calls': [
+            dict({'service': service, 'operation': operation, 'ms': round(milliseconds, 2)}, **({'error': error} if error else {}))
+            for service, operation, milliseconds, error in slowest
+        ]
+    }
+    if phases:
+        document['Phases'] = {name: round(milliseconds, 2) for name, milliseconds in phases.items()}
+    if context is not None:
+        document['FunctionName'] = getattr(context, 'function_name', None)
+        document['RequestId'] = getattr(context, 'aws_request_id', None)
+    document.update({name: round(value, 2) if isinstance(value, float) else value for name, value in values.items()})
+    return document
+
+
+def handler(function):
+    """
+    Decorator for Lambda handlers: time the invocation and emit its metrics.
+    A handler called from another instrumented handler (the router) is
+    counted once, under the outer one.
+    """
+    @functools.wraps(function)
+    def wrapper(event, context):
+        global _active, _cold_start
+        if _active is not None or not enabled():
+            return function(event, context)
+
+        _active = recorder = Recorder()
+        cold_start, _cold_start = _cold_start, False
+        status = 'error'
+        try:
+            response = function(event, context)
+            if isinstance(response, dict):
+                status = response.get('statusCode', 'none')
+            return response
+        finally:
+            _active = None
+            try:
+                print(json.dumps(build_document(recorder, route_of(event), status, context, cold_start)))
+            except Exception as e:
+                print(f"Could not emit metrics: {str(e)}")
+    return wrapper
@@ -0,0 +1,55 @@
+"""
+Single entry point for every task route
+
+Deployed as one function (template.yaml, FunctionLayout=router), this
+dispatches on the request's httpMethod and resource to the same handlers
+the four-function layout deploys separately, so one warm execution
+environment serves list, create, update and delete. Handler modules are
+imported the first time one of their routes is called.
+"""
+import importlib
+import json
+
+import metrics
+
+# (httpMethod, resource) -> handler module, matching the events in template.yaml
+ROUTES = {
+    ('GET', '/tasks'): 'get_tasks',
+    ('POST', '/tasks'): 'create_task',
+    ('POST', '/tasks/batch'): 'create_task',
+    ('PATCH', '/tasks'): 'update_task',
+    ('DELETE', '/tasks'): 'delete_task',
+    ('PUT', '/tasks/{taskId}'): 'update_task',
+    ('DELETE', '/tasks/{taskId}'): 'delete_task',
+}
+
+
+def route_error(status_code, message, allow=None):
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    if allow:
+        headers['Allow'] = ', '.join(allow)
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': json.dumps({'error': message})
+    }
+
+
+@metrics.handler
+def handler(event, context):
+    """
+    Lambda function serving all task routes
+    """
+    method = (event.get('httpMethod') or '').upper()
+    resource = event.get('resource') or ''
+    module_name = ROUTES.get((method, resource))
+    if module_name is not None:
+        return importlib.import_module(module_name).handler(event, context)
+
+    allowed = sorted(route_method for route_method, route_resource in ROUTES if route_resource == resource)
+    if allowed:
+        return route_error(405, f'Method {method} is not allowed on {resource}', allowed)
+    return route_error(404, f'No route for {method} {resource}')
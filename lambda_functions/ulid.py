@@ -0,0 +1,62 @@
+"""
+Time-ordered identifiers (ULIDs)
+
+A ULID is 26 Crockford base32 characters: a 48-bit millisecond timestamp
+followed by 80 random bits. IDs sort as strings in creation order, so new
+items land at the end of any index keyed on them. Within one millisecond
+the random part is incremented instead of redrawn, keeping IDs from the
+same execution environment strictly increasing.
+"""
+import os
+import threading
+import time
+
+ENCODING = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+RANDOM_BITS = 80
+
+_lock = threading.Lock()
+_last_time = -1
+_last_random = 0
+
+
+def _encode(value, length):
+    """
+    Crockford base32 encoding of an integer, zero-padded to length characters
+    """
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(ENCODING[remainder])
+    return ''.join(reversed(chars))
+
+
+def generate(timestamp_ms=None):
+    """
+    A new ULID, greater than every ULID generated before it in this process
+    """
+    global _last_time, _last_random
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+    with _lock:
+        if timestamp_ms <= _last_time:
+            # Same (or earlier, after a clock step back) millisecond: stay monotonic
+            timestamp_ms = _last_time
+            _last_random += 1
+            if _last_random >> RANDOM_BITS:
+                # Random part exhausted within this millisecond; borrow the next one
+                timestamp_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), 'big')
+        else:
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        _last_time = timestamp_ms
+        return _encode(timestamp_ms, 10) + _encode(_last_random, 16)
+
+
+def timestamp(value):
+    """
+    Millisecond timestamp encoded in a ULID
+    """
+    result = 0
+    for char in value[:10].upper():
+        result = result * 32 + ENCODING.index(char)
+    return result
@@ -1,64 +1,229 @@
 import json
-import boto3
 import os
 from datetime import datetime
 
+import aws_clients
+import metrics
+from get_tasks import FILTER_FIELDS, iter_user_tasks
+
+# Fields a client may change on an existing task
+UPDATABLE_FIELDS = ('title', 'description', 'status', 'priority', 'category', 'dueDate')
+
+MAX_BULK_TASKS = 1000
+BULK_UPDATE_CONCURRENCY = 10
+
+# TransactWriteItems accepts at most 100 actions per transaction
+MAX_TRANSACTION_ITEMS = 100
+
+def build_update_params(body):
+    """
+    Build the UpdateExpression and attribute maps for the fields present in body
+    """
+    # Build update expression with expression attribute names for reserved keywords
+    update_expression = "SET updatedAt = :updated_at"
+    expression_attribute_values = {
+        ':updated_at': datetime.utcnow().isoformat()
+    }
+    expression_attribute_names = {}
+    
+    # Add fields to update
+    if 'title' in body:
+        update_expression += ", title = :title"
+        expression_attribute_values[':title'] = body['title']
+    
+    if 'description' in body:
+        update_expression += ", description = :description"
+        expression_attribute_values[':description'] = body['description']
+    
+    if 'status' in body:
+        update_expression += ", #status = :status"
+        expression_attribute_names['#status'] = 'status'
+        expression_attribute_values[':status'] = body['status']
+    
+    if 'priority' in body:
+        update_expression += ", priority = :priority"
+        expression_attribute_values[':priority'] = body['priority']
+    
+    if 'category' in body:
+        update_expression += ", category = :category"
+        expression_attribute_values[':category'] = body['category']
+    
+    if 'dueDate' in body:
+        update_expression += ", dueDate = :due_date"
+        expression_attribute_values[':due_date'] = body['dueDate']
+    
+    update_params = {
+        'UpdateExpression': update_expression,
+        'ExpressionAttributeValues': expression_attribute_values
+    }
+    
+    # Only add ExpressionAttributeNames if we have reserved keywords
+    if expression_attribute_names:
+        update_params['ExpressionAttributeNames'] = expression_attribute_names
+    
+    return update_params
+
+def resolve_task_ids(table, body):
+    """
+    Collect the target task IDs from an explicit list or a {"filter": {...}} spec
+    """
+    if 'taskIds' in body:
+        task_ids = body['taskIds']
+        if not isinstance(task_ids, list) or not all(isinstance(task_id, str) for task_id in task_ids):
+            raise ValueError('taskIds must be a list of strings')
+        # Preserve request order but drop duplicates
+        return list(dict.fromkeys(task_ids))
+    
+    task_filter = body.get('filter')
+    if not isinstance(task_filter, dict) or not task_filter.get('userId'):
+        raise ValueError('Either taskIds or a filter with userId is required')
+    
+    filters = {field: task_filter[field] for field in FILTER_FIELDS if task_filter.get(field)}
+    task_ids = []
+    for item in iter_user_tasks(table, task_filter['userId'], filters, projection='taskId'):
+        task_ids.append(item['taskId'])
+        if len(task_ids) > MAX_BULK_TASKS:
+            break
+    return task_ids
+
+def update_one(client, table_name, task_id, update_params):
+    """
+    Apply the patch to a single existing task and return its outcome
+    """
+    # Imported here so loading the module does not pull in botocore
+    from botocore.exceptions import ClientError
+    
+    try:
+        client.update_item(
+            TableName=table_name,
+            Key={'taskId': task_id},
+            ConditionExpression='attribute_exists(taskId)',
+            **update_params
+        )
+        return {'taskId': task_id, 'status': 'updated'}
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return {'taskId': task_id, 'status': 'not_found'}
+        return {'taskId': task_id, 'status': 'failed', 'error': str(e)}
+
+def update_parallel(table_name, task_ids, update_params):
+    """
+    Run independent update_item calls with bounded concurrency
+    The workers share the resource's low-level client: botocore clients are
+    thread-safe, boto3 resources and Table objects are not (the resource's
+    client still converts plain Python values to DynamoDB attribute values)
+    """
+    # Only bulk PATCH requests need a thread pool
+    from concurrent.futures import ThreadPoolExecutor
+    
+    client = aws_clients.resource('dynamodb').meta.client
+    with ThreadPoolExecutor(max_workers=BULK_UPDATE_CONCURRENCY) as executor:
+        return list(executor.map(lambda task_id: update_one(client, table_name, task_id, update_params), task_ids))
+
+def update_atomic(table_name, task_ids, update_params):
+    """
+    Apply the patch to every task in one TransactWriteItems call (all or nothing)
+    """
+    from botocore.exceptions import ClientError
+    
+    transact_items = []
+    for task_id in task_ids:
+        update = dict(update_params, TableName=table_name, Key={'taskId': task_id},
+                      ConditionExpression='attribute_exists(taskId)')
+        transact_items.append({'Update': update})
+    
+    try:
+        aws_clients.resource('dynamodb').meta.client.transact_write_items(TransactItems=transact_items)
+        return [{'taskId': task_id, 'status': 'updated'} for task_id in task_ids]
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        # Report why each action was cancelled; 'None' means the item itself was fine
+        reasons = e.response.get('CancellationReasons') or [{}] * len(task_ids)
+        results = []
+        for task_id, reason in zip(task_ids, reasons):
+            code = reason.get('Code', 'None')
+            if code == 'ConditionalCheckFailed':
+                results.append({'taskId': task_id, 'status': 'not_found'})
+            elif code == 'None':
+                results.append({'taskId': task_id, 'status': 'rolled_back'})
+            else:
+                results.append({'taskId': task_id, 'status': 'failed', 'error': reason.get('Message', code)})
+        return results
+
+def bulk_update(table_name, table, body):
+    """
+    Handle PATCH /tasks: apply one field patch to many tasks
+    """
+    patch = body.get('patch')
+    if not isinstance(patch, dict) or not any(field in patch for field in UPDATABLE_FIELDS):
+        raise ValueError(f'patch must set at least one of: {", ".join(UPDATABLE_FIELDS)}')
+    
+    task_ids = resolve_task_ids(table, body)
+    if len(task_ids) > MAX_BULK_TASKS:
+        raise ValueError(f'At most {MAX_BULK_TASKS} tasks can be updated per request')
+    
+    atomic = bool(body.get('atomic'))
+    if atomic and len(task_ids) > MAX_TRANSACTION_ITEMS:
+        raise ValueError(f'Atomic updates are limited to {MAX_TRANSACTION_ITEMS} tasks')
+    
+    if not task_ids:
+        return []
+    
+    update_params = build_update_params(patch)
+    if atomic:
+        return update_atomic(table_name, task_ids, update_params)
+    return update_parallel(table_name, task_ids, update_params)
+
+@metrics.handler
 def handler(event, context):
     """
-    Lambda function to update an existing task
+    Lambda function to update an existing task, or many tasks via PATCH /tasks
     """
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(os.environ['TABLE_NAME'])
+        table_name = os.environ['TABLE_NAME']
+        table = aws_clients.table(table_name)
         
         # Parse request body and path parameters
         body = json.loads(event['body'])
-        task_id = event['pathParameters']['taskId']
-        
-        # Build update expression with expression attribute names for reserved keywords
-        update_expression = "SET updatedAt = :updated_at"
-        expression_attribute_values = {
-            ':updated_at': datetime.utcnow().isoformat()
-        }
-        expression_attribute_names = {}
         
-        # Add fields to update
-        if 'title' in body:
-            update_expression += ", title = :title"
-            expression_attribute_values[':title'] = body['title']
+        if event.get('httpMethod') == 'PATCH':
+            try:
+                results = bulk_update(table_name, table, body)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            updated_count = sum(1 for result in results if result['status'] == 'updated')
+            
+            return {
+                'statusCode': 200 if updated_count == len(results) else 207,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+                },
+                'body': json.dumps({
+                    'message': 'Bulk update processed',
+                    'updated': updated_count,
+                    'failed': len(results) - updated_count,
+                    'results': results
+                })
+            }
         
-        if 'description' in body:
-            update_expression += ", description = :description"
-            expression_attribute_values[':description'] = body['description']
-        
-        if 'status' in body:
-            update_expression += ", #status = :status"
-            expression_attribute_names['#status'] = 'status'
-            expression_attribute_values[':status'] = body['status']
-        
-        if 'priority' in body:
-            update_expression += ", priority = :priority"
-            expression_attribute_values[':priority'] = body['priority']
-        
-        if 'category' in body:
-            update_expression += ", category = :category"
-            expression_attribute_values[':category'] = body['category']
-        
-        if 'dueDate' in body:
-            update_expression += ", dueDate = :due_date"
-            expression_attribute_values[':due_date'] = body['dueDate']
+        task_id = event['pathParameters']['taskId']
         
         # Update item in DynamoDB
-        update_params = {
-            'Key': {'taskId': task_id},
-            'UpdateExpression': update_expression,
-            'ExpressionAttributeValues': expression_attribute_values,
-            'ReturnValues': 'ALL_NEW'
-        }
-        
-        # Only add ExpressionAttributeNames if we have reserved keywords
-        if expression_attribute_names:
-            update_params['ExpressionAttributeNames'] = expression_attribute_names
+        update_params = build_update_params(body)
+        update_params['Key'] = {'taskId': task_id}
+        update_params['ReturnValues'] = 'ALL_NEW'
         
         table.update_item(**update_params)
         
@@ -75,7 +240,7 @@ def handler(event, context):
                 'taskId': task_id
             })
         }
-        
+    
     except Exception as e:
         return {
             'statusCode': 500,
@@ -85,4 +250,3 @@ def handler(event, context):
             },
             'body': json.dumps({'error': str(e)})
         }
-
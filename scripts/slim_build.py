@@ -0,0 +1,174 @@
+"""
+Trim a `sam build` output for faster cold starts
+
+`sam build` vendors boto3, botocore (service models for ~400 services),
+s3transfer, jmespath, dateutil, six and urllib3 into every function
+directory. This removes what the task functions never load, then
+precompiles the remaining modules, since /var/task is read-only and
+Lambda would otherwise compile every imported module on each cold start.
+
+    sam build && python scripts/slim_build.py && sam deploy
+
+Default mode, per function directory:
+  - botocore/data keeps its top-level files and the newest API version of
+    the services in --keep-service (dynamodb by default), without the
+    examples-1.json files, which are only read to render docstrings
+  - s3transfer goes unless s3 is kept (boto3 imports it for S3 clients only)
+  - stale __pycache__ directories go, and .pyc files are written with
+    unchecked-hash invalidation when this interpreter matches the runtime
+
+botocore.docs and boto3.docs stay: creating any client or resource imports
+them. --use-runtime-sdk instead drops the vendored SDK altogether and runs
+on the boto3 that ships with the Lambda Python runtime (whose version AWS
+chooses).
+"""
+import argparse
+import compileall
+import py_compile
+import re
+import shutil
+import sys
+from pathlib import Path
+
+DEFAULT_BUILD_DIR = Path(__file__).resolve().parent.parent / '.aws-sam' / 'build'
+DEFAULT_SERVICES = ('dynamodb',)
+
+# Top-level packages and modules of the vendored SDK, and their distribution names
+SDK_PACKAGES = ('boto3', 'botocore', 's3transfer', 'jmespath', 'dateutil', 'urllib3', 'six.py')
+SDK_DISTRIBUTIONS = ('boto3', 'botocore', 's3transfer', 'jmespath', 'python_dateutil', 'urllib3', 'six')
+
+DOCS_EXAMPLES = 'examples-1.json'
+
+
+def tree_size(path):
+    if path.is_file():
+        return path.stat().st_size
+    return sum(child.stat().st_size for child in path.rglob('*') if child.is_file())
+
+
+def remove(path, dry_run):
+    size = tree_size(path)
+    if not dry_run:
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    return size
+
+
+def function_directories(build_dir):
+    """
+    Function code directories of a build: those holding Python modules
+    """
+    return sorted(path for path in build_dir.iterdir() if path.is_dir() and any(path.glob('*.py')))
+
+
+def runtime_version(build_dir):
+    """
+    The (major, minor) Python version from the built template's Runtime, if any
+    """
+    template = build_dir / 'template.yaml'
+    if not template.exists():
+        return None
+    match = re.search(r'Runtime:\s*python(\d+)\.(\d+)', template.read_text())
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def api_versions(service_dir):
+    """
+    API version directories of a service that hold a service model, newest first
+    """
+    versions = [path for path in service_dir.iterdir()
+                if path.is_dir() and any(path.glob('service-2.json*'))]
+    return sorted(versions, key=lambda path: path.name, reverse=True)
+
+
+def prune_service_models(function_dir, services, dry_run):
+    data_dir = function_dir / 'botocore' / 'data'
+    if not data_dir.is_dir():
+        return 0
+    removed = 0
+    for service_dir in data_dir.iterdir():
+        if not service_dir.is_dir():
+            continue
+        if service_dir.name not in services:
+            removed += remove(service_dir, dry_run)
+            continue
+        versions = api_versions(service_dir)
+        for version_dir in service_dir.iterdir():
+            if version_dir.is_dir() and (not versions or version_dir != versions[0]):
+                removed += remove(version_dir, dry_run)
+        if versions:
+            examples = versions[0] / DOCS_EXAMPLES
+            if examples.exists():
+                removed += remove(examples, dry_run)
+    return removed
+
+
+def drop_sdk(function_dir, dry_run):
+    removed = 0
+    for name in SDK_PACKAGES:
+        path = function_dir / name
+        if path.exists():
+            removed += remove(path, dry_run)
+    for distribution in SDK_DISTRIBUTIONS:
+        for path in function_dir.glob(f'{distribution}-*'):
+            if path.suffix in ('.dist-info', '.data'):
+                removed += remove(path, dry_run)
+    return removed
+
+
+def drop_bytecode(function_dir, dry_run):
+    return sum(remove(path, dry_run) for path in list(function_dir.rglob('__pycache__')))
+
+
+def precompile(function_dir):
+    return compileall.compile_dir(
+        str(function_dir),
+        quiet=1,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--build-dir', type=Path, default=DEFAULT_BUILD_DIR)
+    parser.add_argument('--keep-service', action='append', default=[],
+                        help='botocore service model to keep besides dynamodb (repeatable), e.g. s3')
+    parser.add_argument('--use-runtime-sdk', action='store_true',
+                        help="remove the vendored SDK and use the Lambda runtime's boto3")
+    parser.add_argument('--no-compile', action='store_true', help='do not write .pyc files')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be removed')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.build_dir.is_dir():
+        sys.exit(f'{args.build_dir} does not exist; run sam build first')
+    services = set(DEFAULT_SERVICES) | set(args.keep_service)
+
+    runtime = runtime_version(args.build_dir)
+    compile_bytecode = not args.no_compile and not args.dry_run
+    if compile_bytecode and runtime and runtime != sys.version_info[:2]:
+        print(f'Not compiling: the functions run on Python {runtime[0]}.{runtime[1]}, '
+              f'this is Python {sys.version_info[0]}.{sys.version_info[1]}')
+        compile_bytecode = False
+
+    for function_dir in function_directories(args.build_dir):
+        before = tree_size(function_dir)
+        removed = drop_bytecode(function_dir, args.dry_run)
+        if args.use_runtime_sdk:
+            removed += drop_sdk(function_dir, args.dry_run)
+        else:
+            removed += prune_service_models(function_dir, services, args.dry_run)
+            if 's3' not in services and (function_dir / 's3transfer').exists():
+                removed += remove(function_dir / 's3transfer', args.dry_run)
+        if compile_bytecode and not precompile(function_dir):
+            sys.exit(f'Compiling {function_dir} failed')
+        after = before - removed if args.dry_run else tree_size(function_dir)
+        print(f'{function_dir.name:28} {before / 2 ** 20:7.1f} MiB -> {after / 2 ** 20:7.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
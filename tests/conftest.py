@@ -0,0 +1,68 @@
+"""
+Shared fixtures: the handlers run against the in-memory AWS stand-ins in
+benchmarks/local_aws.py, installed through each directory's
+aws_clients.override(), so nothing is sent to AWS.
+
+lambda_functions/ and lambda/ both have aws_clients, idempotency, metrics
+and ulid modules; each fixture imports its directory's copies and drops
+them again afterwards (bench_handlers.handler_directory).
+"""
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+TASK_MODULES = ('aws_clients', 'batch_write', 'create_task', 'delete_task', 'get_tasks', 'idempotency', 'router', 'update_task')
+DOCUMENT_MODULES = (
+    'aws_clients', 'document_processing', 'document_search', 'document_upload', 'idempotency', 'result_cache', 'search_index',
+    'text_analysis'
+)
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    # The stand-ins use boto3's serializer and condition builder
+    pytest.importorskip('boto3')
+    from local_aws import LocalAWS
+
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('METRICS_ENABLED', 'false')
+    return LocalAWS(scale=0, seed=0)
+
+
+@pytest.fixture
+def task_api(aws, monkeypatch):
+    """
+    The task handlers, with empty Tasks and TaskIdempotency tables
+    """
+    from bench_handlers import TASK_DIRECTORY, handler_directory
+    from local_aws import TASK_TABLES
+
+    names = aws.create_tables(TASK_TABLES, suffix='-test')
+    monkeypatch.setenv('TABLE_NAME', names['Tasks'])
+    monkeypatch.setenv('IDEMPOTENCY_TABLE', names['TaskIdempotency'])
+    with handler_directory(TASK_DIRECTORY, TASK_MODULES) as modules:
+        aws.install(modules['aws_clients'])
+        yield SimpleNamespace(aws=aws, table=aws.dynamodb.Table(names['Tasks']), **modules)
+
+
+@pytest.fixture
+def document_api(aws, monkeypatch):
+    """
+    The document handlers, with empty document tables and bucket
+    """
+    from bench_handlers import DOCUMENT_BUCKET, DOCUMENT_DIRECTORY, handler_directory
+    from local_aws import DOCUMENT_TABLES
+
+    names = aws.create_tables(DOCUMENT_TABLES, suffix='-test')
+    monkeypatch.setenv('METADATA_TABLE', names['DocumentMetadata'])
+    monkeypatch.setenv('INDEX_TABLE', names['DocumentIndex'])
+    monkeypatch.setenv('IDEMPOTENCY_TABLE', names['DocumentIdempotency'])
+    monkeypatch.setenv('DOCUMENT_BUCKET', DOCUMENT_BUCKET)
+    with handler_directory(DOCUMENT_DIRECTORY, DOCUMENT_MODULES) as modules:
+        aws.install(modules['aws_clients'])
+        yield SimpleNamespace(aws=aws, table=aws.dynamodb.Table(names['DocumentMetadata']), **modules)
@@ -0,0 +1,24 @@
+"""
+Handlers leave boto3 and botocore to aws_clients, which imports them on
+first use, so the import phase of a cold start stays small.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from cold_start import FUNCTIONS  # noqa: E402
+
+CHECK = "import importlib, sys; importlib.import_module(sys.argv[1]); print(sorted(m for m in ('boto3', 'botocore') if m in sys.modules))"
+
+
+@pytest.mark.parametrize('name', sorted(FUNCTIONS))
+def test_importing_the_handler_does_not_load_the_sdk(name):
+    source_dir, module_name, _, _ = FUNCTIONS[name]
+    output = subprocess.run([sys.executable, '-B', '-c', CHECK, module_name], capture_output=True, text=True,
+                            cwd=str(ROOT / source_dir), check=True)
+    assert output.stdout.strip() == '[]'
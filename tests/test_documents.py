@@ -0,0 +1,434 @@
+import json
+import os
+import time
+
+import pytest
+
+from events import LambdaContext, api_event, s3_put_event
+
+pytest.importorskip('boto3')
+
+from bench_handlers import DOCUMENT_BUCKET, seed_document  # noqa: E402
+from local_aws import client_error  # noqa: E402
+
+
+def call(handler, event):
+    response = handler(event, LambdaContext('test'))
+    return response['statusCode'], json.loads(response['body']), response.get('headers') or {}
+
+
+def process(document_api, user_id, document_id, text):
+    key = seed_document(document_api.aws, document_api.table.name, user_id, document_id, text)
+    result = document_api.document_processing.lambda_handler(s3_put_event(DOCUMENT_BUCKET, key), LambdaContext('test'))
+    result = json.loads(result['body'])['results'][0]
+    assert result['status'] == 'completed'
+    return result
+
+
+def search(document_api, **query):
+    return call(document_api.document_search.lambda_handler, api_event('GET', '/search', query=query))
+
+
+# --- Search ranking --------------------------------------------------------------------
+
+def test_relevance_ranks_by_bm25_score(document_api):
+    process(document_api, 'alice', 'doc-many', 'Invoice invoice invoice for the quarterly budget.')
+    process(document_api, 'alice', 'doc-once', 'Meeting notes. The invoice was approved after a long review of the roadmap.')
+    process(document_api, 'alice', 'doc-none', 'Shipment schedule for the release.')
+    process(document_api, 'bob', 'doc-bob', 'Invoice invoice invoice invoice.')
+
+    status, body, _ = search(document_api, userId='alice', searchText='invoice', rank='relevance')
+
+    assert status == 200
+    assert [document['documentId'] for document in body['documents']] == ['doc-many', 'doc-once']
+    scores = [document['score'] for document in body['documents']]
+    assert scores == sorted(scores, reverse=True) and scores[0] > scores[1] > 0
+
+
+def test_and_or_operators(document_api):
+    process(document_api, 'alice', 'doc-both', 'Budget review for the contract.')
+    process(document_api, 'alice', 'doc-budget', 'Budget planning.')
+
+    _, body, _ = search(document_api, userId='alice', searchText='budget review')
+    assert [document['documentId'] for document in body['documents']] == ['doc-both']
+
+    _, body, _ = search(document_api, userId='alice', searchText='budget review', operator='or', rank='relevance')
+    assert [document['documentId'] for document in body['documents']] == ['doc-both', 'doc-budget']
+
+
+def test_reprocessed_document_no_longer_matches_removed_terms(document_api):
+    process(document_api, 'alice', 'doc-1', 'Contract renewal invoice.')
+    process(document_api, 'alice', 'doc-1', 'Contract renewal schedule.')
+
+    _, body, _ = search(document_api, userId='alice', searchText='invoice')
+    assert body['documents'] == []
+    _, body, _ = search(document_api, userId='alice', searchText='schedule')
+    assert [document['documentId'] for document in body['documents']] == ['doc-1']
+
+
+def test_search_validates_limit_and_user_id(document_api):
+    for query in ({'limit': '0'}, {'limit': 'many'}, {'userId': 'alice#bob'}):
+        status, body, _ = search(document_api, **dict({'userId': 'alice'}, **query))
+        assert status == 400, query
+        assert body['error']
+
+
+def test_search_limit_is_capped(document_api):
+    for i in range(3):
+        process(document_api, 'alice', f'doc-{i}', 'Quarterly report.')
+
+    status, body, _ = search(document_api, userId='alice', searchText='report', limit='1000')
+    assert status == 200
+    assert body['count'] == 3
+
+
+def pages(document_api, **query):
+    seen = []
+    while True:
+        status, body, _ = search(document_api, **query)
+        assert status == 200
+        seen.append([document['documentId'] for document in body['documents']])
+        if not body['nextCursor']:
+            return seen
+        query['cursor'] = body['nextCursor']
+
+
+def test_index_searches_page_with_a_cursor(document_api, monkeypatch):
+    for i in range(5):
+        process(document_api, 'alice', f'doc-{i}', 'Quarterly report. ' + 'report ' * i)
+    fetch = document_api.document_search.fetch_documents
+    fetched = []
+
+    def recording_fetch(table_name, document_ids, projection=None):
+        fetched.append(list(document_ids))
+        return fetch(table_name, document_ids, projection)
+    monkeypatch.setattr(document_api.document_search, 'fetch_documents', recording_fetch)
+
+    # Newest (highest ID) first, one BatchGetItem of the page's documents per page
+    assert pages(document_api, userId='alice', searchText='report', limit='2') == [['doc-4', 'doc-3'], ['doc-2', 'doc-1'], ['doc-0']]
+    assert fetched == [['doc-4', 'doc-3'], ['doc-2', 'doc-1'], ['doc-0']]
+
+    ranked = pages(document_api, userId='alice', searchText='report', rank='relevance', limit='2')
+    # Best first: the more often "report" appears, the higher the score
+    assert ranked == [['doc-4', 'doc-3'], ['doc-2', 'doc-1'], ['doc-0']]
+
+
+def test_cursor_from_another_kind_of_search_is_rejected(document_api):
+    for i in range(3):
+        process(document_api, 'alice', f'doc-{i}', 'Quarterly report.')
+    _, body, _ = search(document_api, userId='alice', searchText='report', limit='1')
+
+    for query in ({'rank': 'relevance'}, {'searchText': ''}):
+        status, body_400, _ = search(document_api, **dict({'userId': 'alice', 'searchText': 'report', 'cursor': body['nextCursor']}, **query))
+        assert status == 400, query
+        assert body_400['error']
+
+
+def test_entity_and_sentiment_facets(document_api):
+    process(document_api, 'alice', 'doc-1', 'Acme approved the growth plan in Seattle.')
+    process(document_api, 'alice', 'doc-2', 'Acme reported a loss and a late shipment.')
+    process(document_api, 'alice', 'doc-3', 'Globex approved the budget.')
+    process(document_api, 'bob', 'doc-bob', 'Acme approved it.')
+
+    def found(**query):
+        status, body, _ = search(document_api, userId='alice', **query)
+        assert status == 200
+        return sorted(document['documentId'] for document in body['documents']), body['facets']
+
+    assert found(entity='acme')[0] == ['doc-1', 'doc-2']
+    assert found(entity='ACME', entityType='organization')[0] == ['doc-1', 'doc-2']
+    assert found(entity='Acme', entityType='LOCATION')[0] == []
+    assert found(sentiment='negative')[0] == ['doc-2']
+
+    documents, facets = found(entity='Acme', sentiment='POSITIVE')
+    assert documents == ['doc-1']
+    assert facets == {'sentiment': {'POSITIVE': 1}, 'entityType': {'ORGANIZATION': 1, 'LOCATION': 1}}
+
+    # A reprocessed document loses the facets it no longer has
+    process(document_api, 'alice', 'doc-1', 'Globex approved the plan.')
+    assert found(entity='Acme')[0] == ['doc-2']
+
+
+def test_search_returns_only_the_requested_fields(document_api, monkeypatch):
+    names = ' '.join(f'We met P{chr(97 + i)}x today.' for i in range(15))
+    process(document_api, 'alice', 'doc-1', 'Quarterly report. ' + names)
+    batch_get_item = document_api.aws.dynamodb.batch_get_item
+    requests = []
+
+    def recording_batch_get_item(RequestItems, **params):
+        requests.append(RequestItems)
+        return batch_get_item(RequestItems=RequestItems, **params)
+    monkeypatch.setattr(document_api.aws.dynamodb, 'batch_get_item', recording_batch_get_item)
+
+    status, body, _ = search(document_api, userId='alice', searchText='report', fields='fileName,entities')
+
+    assert status == 200
+    document, = body['documents']
+    assert sorted(document) == ['documentId', 'entities', 'fileName']
+    assert len(document['entities']) == document_api.document_search.MAX_LIST_ELEMENTS
+    # Only the first entities are read, not the whole list or the other attributes
+    request, = requests[0].values()
+    assert '#entities[9]' in request['ProjectionExpression'] and '#entities[10]' not in request['ProjectionExpression']
+    assert 'keyPhrases' not in request['ExpressionAttributeNames'].values()
+
+    status, _, _ = search(document_api, userId='alice', fields='fileName,extractedText')
+    assert status == 400
+
+
+def test_index_refuses_user_ids_containing_the_key_separator(document_api):
+    search_index = document_api.search_index
+    search_index.index_document('doc-a', 'ann', 'growth')
+
+    # "ann#x" would otherwise match the postings of user "ann"
+    with pytest.raises(ValueError):
+        search_index.index_document('doc-b', 'ann#x', 'growth')
+    with pytest.raises(ValueError):
+        search_index.find_documents('growth', user_id='ann#x')
+    assert list(search_index.iter_postings('growth', 'ann')) == [('ann', 'doc-a', 1, 1)]
+
+
+def test_user_search_without_the_index_queries_the_user_index(document_api, monkeypatch):
+    document_api.table.seed(
+        [{'documentId': f'alice-{day}', 'userId': 'alice', 'uploadDate': f'2025-01-{day:02d}T00:00:00',
+          'sentiment': 'POSITIVE' if day % 2 else 'NEGATIVE'} for day in range(1, 8)]
+        + [{'documentId': 'bob-1', 'userId': 'bob', 'uploadDate': '2025-02-01T00:00:00', 'sentiment': 'POSITIVE'}])
+    monkeypatch.delenv('INDEX_TABLE')
+
+    # Newest first, only alice's, filtered and paged with the cursor
+    assert pages(document_api, userId='alice', sentiment='positive', limit='2') == [['alice-7', 'alice-5'], ['alice-3', 'alice-1']]
+    calls = document_api.aws.calls
+    assert calls[('dynamodb', 'Query')] > 0 and calls[('dynamodb', 'Scan')] == 0
+
+
+# --- Upload idempotency ------------------------------------------------------------------
+
+def upload_event(key, file_name='scan.png'):
+    return api_event('POST', '/upload', body={'userId': 'alice', 'fileName': file_name, 'fileType': 'image/png', 'fileSize': 10},
+                     headers={'Idempotency-Key': key})
+
+
+def test_upload_replay_expires_with_the_presigned_url(document_api):
+    upload = document_api.document_upload
+    status, first, _ = call(upload.lambda_handler, upload_event('upload-1'))
+    status, second, headers = call(upload.lambda_handler, upload_event('upload-1'))
+
+    assert status == 200
+    assert second == first and headers['Idempotent-Replayed'] == 'true'
+    record = document_api.aws_clients.table(os.environ['IDEMPOTENCY_TABLE']).get_item(
+        Key={'idempotencyKey': 'document_upload#alice#upload-1'})['Item']
+    assert record['expiresAt'] <= time.time() + upload.UPLOAD_URL_EXPIRES_SECONDS
+
+
+def test_upload_key_reused_for_another_file_is_422(document_api):
+    call(document_api.document_upload.lambda_handler, upload_event('upload-2'))
+    status, _, _ = call(document_api.document_upload.lambda_handler, upload_event('upload-2', file_name='other.png'))
+    assert status == 422
+
+
+def test_upload_rejects_hash_in_user_id(document_api):
+    event = api_event('POST', '/upload', body={'userId': 'a#b', 'fileName': 'scan.png'})
+    status, _, _ = call(document_api.document_upload.lambda_handler, event)
+    assert status == 400
+
+
+# --- Processing --------------------------------------------------------------------------
+
+def handle(document_api, event):
+    response = document_api.document_processing.lambda_handler(event, LambdaContext('test'))
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_every_record_of_an_s3_event_is_processed(document_api):
+    keys = [seed_document(document_api.aws, document_api.table.name, 'alice', f'doc-{i}', f'Report number {i}.') for i in range(3)]
+    event = s3_put_event(DOCUMENT_BUCKET, *keys, 'extracted/doc-0.txt.gz', '')
+
+    status, body = handle(document_api, event)
+
+    # Our own extracted-text object is skipped; the record without a key fails on its own
+    assert status == 207
+    assert (body['processed'], body['failed']) == (3, 1)
+    assert [result['status'] for result in body['results']] == ['completed'] * 3 + ['failed']
+    for i in range(3):
+        item = document_api.table.get_item(Key={'documentId': f'doc-{i}'})['Item']
+        assert item['status'] == 'completed'
+        assert item['extractedTextPreview'] == f'Report number {i}.\n'
+
+def test_result_cache_failure_does_not_fail_the_document(document_api, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('cache unavailable')
+    monkeypatch.setattr(document_api.result_cache, 'save', fail)
+
+    process(document_api, 'alice', 'doc-1', 'Invoice approved.')
+
+    assert document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']['status'] == 'completed'
+
+
+def test_extracted_text_is_stored_in_s3(document_api):
+    text = 'Long contract text. ' * 100
+    process(document_api, 'alice', 'doc-1', text)
+
+    item = document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']
+    assert 'extractedText' not in item
+    assert item['extractedTextKey'] == 'extracted/doc-1.txt.gz'
+    assert item['extractedTextPreview'] == (text + '\n')[:document_api.document_processing.text_store.PREVIEW_CHARS]
+    assert document_api.document_processing.text_store.load_text(DOCUMENT_BUCKET, item['extractedTextKey']) == text + '\n'
+
+
+def test_search_without_the_index_reads_text_from_s3_and_inline(document_api, monkeypatch):
+    process(document_api, 'alice', 'doc-new', 'Renewal of the lease.')
+    # Written before the text moved to S3
+    document_api.table.seed([{'documentId': 'doc-old', 'userId': 'alice', 'uploadDate': '2020-01-01T00:00:00',
+                              'status': 'completed', 'extractedText': 'Lease renewal terms.'}])
+    monkeypatch.delenv('INDEX_TABLE')
+
+    _, body, _ = search(document_api, userId='alice', searchText='enewal')
+
+    assert [document['documentId'] for document in body['documents']] == ['doc-new', 'doc-old']
+    assert body['documents'][1]['extractedTextPreview'] == 'Lease renewal terms....'
+
+
+def comprehend_calls(aws):
+    return {operation: count for (service, operation), count in aws.calls.items() if service == 'comprehend'}
+
+
+def test_documents_of_one_event_share_comprehend_batch_calls(document_api):
+    keys = [seed_document(document_api.aws, document_api.table.name, 'alice', f'doc-{i}', f'Acme report {i} approved.') for i in range(4)]
+
+    status, _ = handle(document_api, s3_put_event(DOCUMENT_BUCKET, *keys))
+
+    assert status == 200
+    assert comprehend_calls(document_api.aws) == {'BatchDetectSentiment': 1, 'BatchDetectEntities': 1, 'BatchDetectKeyPhrases': 1}
+    for i in range(4):
+        item = document_api.table.get_item(Key={'documentId': f'doc-{i}'})['Item']
+        assert item['sentiment'] == 'POSITIVE'
+        assert [entity['Text'] for entity in item['entities']] == ['Acme']
+
+
+def test_a_single_text_uses_the_detect_calls(document_api):
+    process(document_api, 'alice', 'doc-1', 'Acme report approved.')
+    assert comprehend_calls(document_api.aws) == {'DetectSentiment': 1, 'DetectEntities': 1, 'DetectKeyPhrases': 1}
+
+
+def test_long_text_is_analyzed_in_chunks_and_merged(document_api):
+    filler = 'The quarterly numbers were reviewed in detail. ' * 150
+    text = 'Report for Acme. ' + filler + 'We opened an office in Berlin for Acme.'
+    assert len(text.encode('utf-8')) > document_api.text_analysis.MAX_TEXT_BYTES
+
+    process(document_api, 'alice', 'doc-1', text)
+
+    calls = comprehend_calls(document_api.aws)
+    assert calls['BatchDetectEntities'] == 1 and 'DetectEntities' not in calls
+    item = document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']
+    assert item['extractedTextLength'] == len(text) + 1
+    entities = {entity['Text']: entity for entity in item['entities']}
+    # Found in different chunks, with offsets into the whole document
+    assert entities['Berlin']['BeginOffset'] == text.index('Berlin')
+    assert (entities['Acme']['BeginOffset'], entities['Acme']['Occurrences']) == (text.index('Acme'), 2)
+
+
+def test_entities_past_the_stored_cap_are_still_indexed(document_api):
+    names = [f'P{chr(97 + i // 26)}{chr(97 + i % 26)}' for i in range(120)] + ['Berlin']
+    process(document_api, 'alice', 'doc-1', ' '.join(f'We met {name} today.' for name in names))
+
+    item = document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']
+    assert len(item['entities']) == document_api.text_analysis.MAX_ENTITIES
+    assert 'Berlin' not in {entity['Text'] for entity in item['entities']}
+    assert item['entityTypes'] == ['LOCATION', 'OTHER']
+
+    _, body, _ = search(document_api, userId='alice', entity='Berlin', entityType='LOCATION')
+    assert [document['documentId'] for document in body['documents']] == ['doc-1']
+
+
+def textract_completion(job_id, document_id, key, status='SUCCEEDED'):
+    message = {'JobId': job_id, 'Status': status, 'JobTag': document_id,
+               'DocumentLocation': {'S3Bucket': DOCUMENT_BUCKET, 'S3ObjectName': key}}
+    return {'Records': [{'EventSource': 'aws:sns', 'Sns': {'Message': json.dumps(message)}}]}
+
+
+def test_multi_page_document_goes_through_a_textract_job(document_api, monkeypatch):
+    monkeypatch.setattr(document_api.document_processing.textract_jobs, 'RESULT_PAGE_SIZE', 2)
+    lines = [f'Page {i} of the annual report.' for i in range(5)]
+    key = seed_document(document_api.aws, document_api.table.name, 'alice', 'doc-1', '\n'.join(lines), file_name='report.pdf')
+
+    status, body = handle(document_api, s3_put_event(DOCUMENT_BUCKET, key))
+
+    assert status == 200 and body['results'][0]['status'] == 'completed'
+    calls = document_api.aws.calls
+    assert (calls[('textract', 'StartDocumentTextDetection')], calls[('textract', 'DetectDocumentText')]) == (1, 0)
+    # Result pages of two lines each are followed to the end
+    item = document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']
+    assert item['extractedTextLength'] == len(''.join(line + '\n' for line in lines))
+
+
+def test_textract_completion_notification_finishes_the_document(document_api, monkeypatch):
+    monkeypatch.setenv('TEXTRACT_SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:000000000000:textract')
+    monkeypatch.setenv('TEXTRACT_ROLE_ARN', 'arn:aws:iam::000000000000:role/textract')
+    key = seed_document(document_api.aws, document_api.table.name, 'alice', 'doc-1', 'Scanned contract.', file_name='contract.tiff')
+
+    _, body = handle(document_api, s3_put_event(DOCUMENT_BUCKET, key))
+    started = body['results'][0]
+    assert started['status'] == 'extracting'
+    item = document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']
+    assert (item['status'], item['textractJobId']) == ('extracting', started['jobId'])
+
+    status, body = handle(document_api, textract_completion(started['jobId'], 'doc-1', key))
+
+    assert status == 200 and body['results'][0]['status'] == 'completed'
+    assert document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']['extractedTextPreview'] == 'Scanned contract.\n'
+
+
+def test_failed_textract_job_fails_the_document(document_api):
+    status, body = handle(document_api, textract_completion('job-1', 'doc-1', 'documents/alice/doc-1/contract.pdf', status='FAILED'))
+
+    assert status == 500
+    assert body['results'][0]['status'] == 'failed'
+
+
+def analysis_calls(aws):
+    return sum(count for (service, _), count in aws.calls.items() if service in ('textract', 'comprehend'))
+
+
+def cache_entries(document_api):
+    return [item for item in document_api.aws.dynamodb.Table(os.environ['INDEX_TABLE']).items.values()
+            if item['pk'].startswith('CONTENT#')]
+
+
+def test_identical_upload_is_served_from_the_result_cache(document_api):
+    first = process(document_api, 'alice', 'doc-1', 'Invoice from Acme approved.')
+    calls = analysis_calls(document_api.aws)
+
+    second = process(document_api, 'bob', 'doc-2', 'Invoice from Acme approved.')
+
+    assert (first['cached'], second['cached']) == (False, True)
+    assert analysis_calls(document_api.aws) == calls
+    stored = [document_api.table.get_item(Key={'documentId': document_id})['Item'] for document_id in ('doc-1', 'doc-2')]
+    assert stored[1]['sentiment'] == stored[0]['sentiment']
+    assert stored[1]['entities'] == stored[0]['entities']
+
+
+def test_results_of_a_failed_comprehend_call_are_not_cached(document_api, monkeypatch):
+    def throttled(**params):
+        raise client_error('ThrottlingException', 'Rate exceeded', 'DetectEntities')
+    comprehend = document_api.aws.comprehend
+    monkeypatch.setattr(comprehend, 'detect_entities', throttled)
+
+    assert process(document_api, 'alice', 'doc-1', 'Invoice from Acme approved.')['cached'] is False
+    assert document_api.table.get_item(Key={'documentId': 'doc-1'})['Item']['sentiment'] == 'UNKNOWN'
+    assert cache_entries(document_api) == []
+
+    # The next upload of the same bytes is analyzed again, and then cached
+    del comprehend.detect_entities
+    assert process(document_api, 'alice', 'doc-2', 'Invoice from Acme approved.')['cached'] is False
+    assert len(cache_entries(document_api)) == 1
+
+
+def test_stale_cache_entries_are_ignored(document_api):
+    process(document_api, 'alice', 'doc-1', 'Invoice approved.')
+    entry, = cache_entries(document_api)
+
+    entry['version'] = document_api.result_cache.CACHE_VERSION - 1
+    assert process(document_api, 'alice', 'doc-2', 'Invoice approved.')['cached'] is False
+
+    entry, = cache_entries(document_api)
+    entry['expiresAt'] = int(time.time()) - 1
+    assert process(document_api, 'alice', 'doc-3', 'Invoice approved.')['cached'] is False
@@ -0,0 +1,153 @@
+"""
+The benchmarks and tests are only as good as the stand-ins, so the DynamoDB
+behaviour the handlers depend on is pinned here.
+"""
+import json
+
+import pytest
+
+from events import LambdaContext, api_event
+
+pytest.importorskip('boto3')
+
+from boto3.dynamodb.conditions import Attr, Key  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+
+@pytest.fixture
+def table(aws):
+    table = aws.dynamodb.create_table('Items', 'pk', 'sk')
+    table.seed([{'pk': 'p', 'sk': f'{i:02d}', 'kind': 'even' if i % 2 == 0 else 'odd'} for i in range(10)])
+    return table
+
+
+# --- Query and Scan ----------------------------------------------------------------------
+
+def test_limit_counts_items_read_before_the_filter(table):
+    response = table.query(KeyConditionExpression=Key('pk').eq('p'), FilterExpression=Attr('kind').eq('odd'), Limit=4)
+
+    assert response['ScannedCount'] == 4
+    assert [item['sk'] for item in response['Items']] == ['01', '03']
+    assert response['LastEvaluatedKey'] == {'pk': 'p', 'sk': '03'}
+
+
+def test_pages_resume_after_the_last_evaluated_key(table):
+    seen = []
+    params = {'KeyConditionExpression': Key('pk').eq('p'), 'Limit': 3, 'ScanIndexForward': False}
+    while True:
+        response = table.query(**params)
+        seen.extend(item['sk'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    assert seen == [f'{i:02d}' for i in reversed(range(10))]
+
+
+def test_last_page_has_no_last_evaluated_key(table):
+    response = table.scan(Limit=10)
+    assert response['Count'] == 10
+    assert 'LastEvaluatedKey' not in response
+
+
+def test_numbers_come_back_as_decimal_and_floats_are_rejected(table):
+    table.put_item(Item={'pk': 'n', 'sk': '1', 'count': 3})
+    assert type(table.get_item(Key={'pk': 'n', 'sk': '1'})['Item']['count']).__name__ == 'Decimal'
+    with pytest.raises(TypeError):
+        table.put_item(Item={'pk': 'n', 'sk': '2', 'score': 0.5})
+
+
+# --- Conditional writes and transactions -----------------------------------------------------
+
+def test_failed_condition_raises_conditional_check_failed(table):
+    with pytest.raises(ClientError) as raised:
+        table.put_item(Item={'pk': 'p', 'sk': '00'}, ConditionExpression=Attr('pk').not_exists())
+    assert raised.value.response['Error']['Code'] == 'ConditionalCheckFailedException'
+    assert table.get_item(Key={'pk': 'p', 'sk': '00'})['Item']['kind'] == 'even'
+
+
+def test_transaction_with_a_failed_condition_writes_nothing(aws, table):
+    client = aws.dynamodb.meta.client
+    actions = [
+        {'Update': {'TableName': 'Items', 'Key': {'pk': 'p', 'sk': '00'}, 'UpdateExpression': 'SET kind = :kind',
+                    'ExpressionAttributeValues': {':kind': 'changed'}, 'ConditionExpression': 'attribute_exists(pk)'}},
+        {'Put': {'TableName': 'Items', 'Item': {'pk': 'p', 'sk': '99'}}},
+        {'Delete': {'TableName': 'Items', 'Key': {'pk': 'p', 'sk': 'missing'}, 'ConditionExpression': 'attribute_exists(pk)'}},
+    ]
+
+    with pytest.raises(ClientError) as raised:
+        client.transact_write_items(TransactItems=actions)
+
+    error = raised.value.response
+    assert error['Error']['Code'] == 'TransactionCanceledException'
+    assert [reason['Code'] for reason in error['CancellationReasons']] == ['None', 'None', 'ConditionalCheckFailed']
+    assert table.get_item(Key={'pk': 'p', 'sk': '00'})['Item']['kind'] == 'even'
+    assert 'Item' not in table.get_item(Key={'pk': 'p', 'sk': '99'})
+
+
+def test_transaction_is_limited_to_100_actions(aws, table):
+    actions = [{'Put': {'TableName': 'Items', 'Item': {'pk': 't', 'sk': str(i)}}} for i in range(101)]
+    with pytest.raises(ClientError) as raised:
+        aws.dynamodb.meta.client.transact_write_items(TransactItems=actions)
+    assert raised.value.response['Error']['Code'] == 'ValidationException'
+
+
+def test_update_returns_the_old_values_of_updated_attributes(table):
+    response = table.update_item(Key={'pk': 'p', 'sk': '01'}, UpdateExpression='SET kind = :kind, extra = :extra',
+                                 ExpressionAttributeValues={':kind': 'new', ':extra': 1}, ReturnValues='UPDATED_OLD')
+    assert response['Attributes'] == {'kind': 'odd'}
+
+
+# --- Batch operations --------------------------------------------------------------------
+
+def test_batch_write_is_limited_to_25_requests(aws, table):
+    requests = [{'PutRequest': {'Item': {'pk': 'b', 'sk': str(i)}}} for i in range(26)]
+    with pytest.raises(ClientError) as raised:
+        aws.dynamodb.batch_write_item(RequestItems={'Items': requests})
+    assert raised.value.response['Error']['Code'] == 'ValidationException'
+
+
+def test_batch_write_returns_unprocessed_items(aws, table):
+    aws.dynamodb.unprocessed_rate = 0.5
+    requests = [{'PutRequest': {'Item': {'pk': 'b', 'sk': f'{i:02d}'}}} for i in range(20)]
+
+    unprocessed = aws.dynamodb.batch_write_item(RequestItems={'Items': requests})['UnprocessedItems'].get('Items', [])
+
+    assert 0 < len(unprocessed) < 20
+    written = {item['sk'] for item in table.query(KeyConditionExpression=Key('pk').eq('b'))['Items']}
+    assert written | {request['PutRequest']['Item']['sk'] for request in unprocessed} == {f'{i:02d}' for i in range(20)}
+    assert not written & {request['PutRequest']['Item']['sk'] for request in unprocessed}
+
+
+def test_batch_writer_resends_unprocessed_items(aws, table):
+    aws.dynamodb.unprocessed_rate = 0.5
+    with table.batch_writer() as batch:
+        for i in range(40):
+            batch.put_item(Item={'pk': 'w', 'sk': f'{i:02d}'})
+
+    assert len(table.query(KeyConditionExpression=Key('pk').eq('w'))['Items']) == 40
+
+
+def test_batch_create_retries_unprocessed_writes(task_api, monkeypatch):
+    monkeypatch.setattr(task_api.batch_write, 'BACKOFF_BASE_SECONDS', 0)
+    task_api.aws.dynamodb.unprocessed_rate = 0.5
+    event = api_event('POST', '/tasks/batch', body={'tasks': [{'userId': 'alice', 'title': f'Task {i}'} for i in range(30)]})
+
+    response = task_api.create_task.handler(event, LambdaContext('test'))
+
+    assert response['statusCode'] == 201
+    assert len(task_api.table.items) == 30
+    assert task_api.aws.calls[('dynamodb', 'BatchWriteItem')] > 2
+
+
+def test_writes_never_processed_are_reported_with_207(task_api, monkeypatch):
+    monkeypatch.setattr(task_api.batch_write, 'BACKOFF_BASE_SECONDS', 0)
+    task_api.aws.dynamodb.unprocessed_rate = 1.0
+    event = api_event('POST', '/tasks/batch', body={'tasks': [{'userId': 'alice', 'title': 'Never written'}]})
+
+    response = task_api.create_task.handler(event, LambdaContext('test'))
+
+    assert response['statusCode'] == 207
+    assert json.loads(response['body'])['results'][0]['error'] == 'Write not processed after retries'
+    assert task_api.aws.calls[('dynamodb', 'BatchWriteItem')] == task_api.batch_write.MAX_BATCH_ATTEMPTS
+
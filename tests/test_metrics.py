@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+pytest.importorskip('boto3')
+
+from bench_handlers import TASK_DIRECTORY, handler_directory  # noqa: E402
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('METRICS_ENABLED', 'true')
+    with handler_directory(TASK_DIRECTORY, ('metrics',)) as modules:
+        yield modules['metrics']
+
+
+def emitted(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+
+
+def test_failed_request_is_recorded_and_its_error_raised(metrics, capsys):
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import EndpointConnectionError
+
+    # Nothing listens on the discard port, so the connection is refused
+    client = metrics.instrument(boto3.session.Session().client(
+        'dynamodb', endpoint_url='http://127.0.0.1:9',
+        config=Config(connect_timeout=1, retries={'max_attempts': 1})
+    ))
+
+    @metrics.handler
+    def handler(event, context):
+        return client.get_item(TableName='Tasks', Key={'taskId': {'S': 'a'}})
+
+    with pytest.raises(EndpointConnectionError):
+        handler({'httpMethod': 'GET', 'resource': '/tasks'}, None)
+
+    document, = emitted(capsys)
+    assert document['Status'] == 'error'
+    assert document['Calls'] == [{'service': 'dynamodb', 'operation': 'GetItem', 'ms': document['Calls'][0]['ms'],
+                                  'error': 'EndpointConnectionError'}]
+    assert document['DynamoDBCalls'] == 1
+
+
+def test_one_emf_document_per_invocation(metrics, capsys, monkeypatch):
+    import boto3
+    from botocore.stub import Stubber
+
+    monkeypatch.setenv('METRICS_NAMESPACE', 'TestNamespace')
+    client = boto3.session.Session().client('dynamodb')
+    stubber = Stubber(client)
+    stubber.add_response('get_item', {'Item': {'taskId': {'S': 'a'}}})
+    stubber.add_client_error('put_item', 'ConditionalCheckFailedException')
+    stubber.add_response('get_item', {})
+    stubber.activate()
+    metrics.instrument(client)
+
+    @metrics.handler
+    def handler(event, context):
+        with metrics.phase('read'):
+            client.get_item(TableName='Tasks', Key={'taskId': {'S': 'a'}})
+        try:
+            client.put_item(TableName='Tasks', Item={'taskId': {'S': 'a'}})
+        except client.exceptions.ConditionalCheckFailedException:
+            pass
+        return {'statusCode': 201}
+
+    @metrics.handler
+    def s3_handler(event, context):
+        client.get_item(TableName='Tasks', Key={'taskId': {'S': 'b'}})
+        return {'processed': 1}
+
+    handler({'httpMethod': 'POST', 'resource': '/tasks'}, None)
+    s3_handler({'Records': [{'eventSource': 'aws:s3'}]}, None)
+
+    first, second = emitted(capsys)
+    directive, = first['_aws']['CloudWatchMetrics']
+    assert directive['Namespace'] == 'TestNamespace'
+    assert directive['Dimensions'] == [['Route', 'Status']]
+    # Every declared metric is a top-level value of the document
+    assert {metric['Name'] for metric in directive['Metrics']} == {'Duration', 'HandlerDuration', 'DynamoDBDuration', 'DynamoDBCalls'}
+    assert (first['Route'], first['Status'], first['ColdStart'], first['DynamoDBCalls']) == ('POST /tasks', '201', True, 2)
+    assert first['Duration'] >= first['HandlerDuration'] and first['Duration'] >= first['DynamoDBDuration']
+    assert [(call['operation'], call.get('error')) for call in sorted(first['Calls'], key=lambda call: call['operation'])] == [
+        ('GetItem', None), ('PutItem', 'ConditionalCheckFailedException')]
+    assert set(first['Phases']) == {'read'}
+
+    assert (second['Route'], second['Status'], second['ColdStart'], second['DynamoDBCalls']) == ('aws:s3', 'none', False, 1)
+
+
+def test_metrics_can_be_turned_off(metrics, capsys, monkeypatch):
+    monkeypatch.setenv('METRICS_ENABLED', 'false')
+    assert metrics.handler(lambda event, context: {'statusCode': 200})({}, None) == {'statusCode': 200}
+    assert emitted(capsys) == []
@@ -0,0 +1,60 @@
+"""
+lambda_functions/ and lambda/ are deployed separately, so each carries its
+own copy of the shared modules. The copies must stay identical apart from
+the differences listed here.
+"""
+import difflib
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# module -> the (task line, document line) pairs allowed to differ
+ALLOWED_DIFFERENCES = {
+    'aws_clients.py': {
+        ('Shared boto3 clients and resources for the task handlers',
+         'Shared boto3 clients and resources for the document handlers'),
+        ('    max_pool_connections=25,', '    max_pool_connections=50,'),
+    },
+    'idempotency.py': {
+        ('Idempotency-Key handling for the create handlers',
+         'Idempotency-Key handling for document upload requests'),
+    },
+    'metrics.py': {
+        ('Per-request latency metrics for the task handlers, in CloudWatch Embedded Metric Format',
+         'Per-request latency metrics for the document handlers, in CloudWatch Embedded Metric Format'),
+        ("DEFAULT_NAMESPACE = 'TaskManager'", "DEFAULT_NAMESPACE = 'SmartDocuments'"),
+    },
+    'ulid.py': set(),
+}
+
+
+def differences(task_source, document_source):
+    task_lines = task_source.splitlines()
+    document_lines = document_source.splitlines()
+    found = set()
+    matcher = difflib.SequenceMatcher(None, task_lines, document_lines, autojunk=False)
+    for tag, task_start, task_end, document_start, document_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        removed = task_lines[task_start:task_end]
+        added = document_lines[document_start:document_end]
+        if len(removed) != len(added):
+            found.add(('\n'.join(removed), '\n'.join(added)))
+        else:
+            found.update(zip(removed, added))
+    return found
+
+
+def test_every_shared_module_is_checked():
+    task_modules = {path.name for path in (ROOT / 'lambda_functions').glob('*.py')}
+    document_modules = {path.name for path in (ROOT / 'lambda').glob('*.py')}
+    assert task_modules & document_modules == set(ALLOWED_DIFFERENCES)
+
+
+@pytest.mark.parametrize('name', sorted(ALLOWED_DIFFERENCES))
+def test_copies_have_not_drifted(name):
+    task_source = (ROOT / 'lambda_functions' / name).read_text()
+    document_source = (ROOT / 'lambda' / name).read_text()
+    assert differences(task_source, document_source) == ALLOWED_DIFFERENCES[name]
@@ -0,0 +1,314 @@
+import json
+import os
+
+from events import LambdaContext, api_event
+
+
+def call(handler, event):
+    response = handler(event, LambdaContext('test'))
+    return response['statusCode'], json.loads(response['body']), response.get('headers') or {}
+
+
+def create_tasks(task_api, user_id, count):
+    status, body, _ = call(task_api.create_task.handler, api_event('POST', '/tasks/batch', body={
+        'tasks': [{'userId': user_id, 'title': f'Task {i}', 'dueDate': f'2025-01-{i + 1:02d}'} for i in range(count)]
+    }))
+    assert status == 201
+    return [result['taskId'] for result in body['results']]
+
+
+# --- GET /tasks cursor pagination ------------------------------------------------
+
+def test_cursor_pages_through_every_task_once(task_api):
+    task_ids = create_tasks(task_api, 'alice', 7)
+    create_tasks(task_api, 'bob', 3)
+
+    seen = []
+    query = {'userId': 'alice', 'limit': 3}
+    while True:
+        status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query=query))
+        assert status == 200
+        assert body['count'] == len(body['tasks']) <= 3
+        seen.extend(task['taskId'] for task in body['tasks'])
+        if not body['nextCursor']:
+            break
+        query = dict(query, cursor=body['nextCursor'])
+
+    assert sorted(seen) == sorted(task_ids)
+    # UserIndex order: by due date
+    assert seen == task_ids
+
+
+def test_invalid_cursor_and_limit_are_rejected(task_api):
+    for query in ({'userId': 'alice', 'cursor': 'not-a-cursor'}, {'userId': 'alice', 'limit': '0'}, {'userId': 'alice', 'limit': 'ten'}):
+        status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query=query))
+        assert status == 400
+        assert body['error']
+
+
+def test_cursor_for_another_index_or_user_is_rejected(task_api):
+    create_tasks(task_api, 'alice', 3)
+    _, by_due_date, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query={'userId': 'alice', 'limit': 1}))
+    _, by_created, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query={
+        'userId': 'alice', 'limit': 1, 'createdSince': '2000-01-01T00:00:00Z'}))
+
+    for query in (
+        {'userId': 'alice', 'cursor': by_created['nextCursor']},
+        {'userId': 'alice', 'createdSince': '2000-01-01T00:00:00Z', 'cursor': by_due_date['nextCursor']},
+        {'userId': 'bob', 'cursor': by_due_date['nextCursor']},
+    ):
+        status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query=query))
+        assert status == 400, query
+        assert body['error'] == 'Invalid cursor'
+
+
+def test_fields_are_projected_by_dynamodb(task_api, monkeypatch):
+    create_tasks(task_api, 'alice', 2)
+    query = task_api.table.query
+    requests = []
+
+    def recording_query(**params):
+        requests.append(params)
+        return query(**params)
+    monkeypatch.setattr(task_api.table, 'query', recording_query)
+
+    status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query={'userId': 'alice', 'fields': 'title,status'}))
+
+    assert status == 200
+    assert [sorted(task) for task in body['tasks']] == [['status', 'taskId', 'title']] * 2
+    assert requests[0]['ProjectionExpression'] == '#taskId, #title, #status'
+    assert requests[0]['ExpressionAttributeNames'] == {'#taskId': 'taskId', '#title': 'title', '#status': 'status'}
+
+    status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query={'userId': 'alice', 'fields': 'title,owner'}))
+    assert status == 400
+    assert 'owner' in body['error']
+
+
+# --- ULID task IDs and created-time ranges ------------------------------------------
+
+def test_ulids_sort_in_creation_order(task_api):
+    ulid = task_api.create_task.ulid
+    ids = [ulid.generate() for _ in range(1000)]
+    assert sorted(ids) == ids and len(set(ids)) == len(ids)
+    assert all(len(value) == 26 and set(value) <= set(ulid.ENCODING) for value in ids)
+
+    # A clock that steps back does not break the order
+    later = ulid.generate(ulid.timestamp(ids[-1]) + 1000)
+    assert ulid.timestamp(later) == ulid.timestamp(ids[-1]) + 1000
+    assert ulid.generate(ulid.timestamp(ids[-1])) > later
+
+    task_ids = create_tasks(task_api, 'alice', 5)
+    assert sorted(task_ids) == task_ids and task_ids[0] > later
+
+
+def test_created_since_and_before_read_a_range_newest_first(task_api):
+    task_api.table.seed([
+        {'taskId': f'task-{day}', 'userId': 'alice', 'dueDate': 'no-due-date', 'createdAt': f'2025-01-{day:02d}T00:00:00'}
+        for day in range(1, 6)
+    ] + [{'taskId': 'task-bob', 'userId': 'bob', 'dueDate': 'no-due-date', 'createdAt': '2025-01-04T00:00:00'}])
+
+    def created(**query):
+        status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query=dict(query, userId='alice')))
+        assert status == 200
+        return [task['taskId'] for task in body['tasks']]
+
+    assert created(createdSince='2025-01-03T00:00:00Z') == ['task-5', 'task-4', 'task-3']
+    # Offsets are converted to UTC; the upper bound is exclusive
+    assert created(createdSince='2025-01-02T01:00:00+01:00', createdBefore='2025-01-04T00:00:00') == ['task-3', 'task-2']
+    assert created(createdBefore='2025-01-02T00:00:00Z') == ['task-1']
+
+    status, body, _ = call(task_api.get_tasks.handler, api_event('GET', '/tasks', query={'userId': 'alice', 'createdSince': 'yesterday'}))
+    assert status == 400
+    assert 'createdSince' in body['error']
+
+
+# --- POST /tasks/batch -----------------------------------------------------------
+
+def test_batch_create_reports_partial_failure_with_207(task_api):
+    status, body, _ = call(task_api.create_task.handler, api_event('POST', '/tasks/batch', body={
+        'tasks': [{'userId': 'alice', 'title': 'ok'}, 'not an object', {'userId': 'alice', 'title': 'also ok'}]
+    }))
+
+    assert status == 207
+    assert (body['created'], body['failed']) == (2, 1)
+    assert [result['status'] for result in body['results']] == ['created', 'failed', 'created']
+    assert body['results'][1]['index'] == 1
+    for result in (body['results'][0], body['results'][2]):
+        assert task_api.table.get_item(Key={'taskId': result['taskId']})['Item']['title'] == result['task']['title']
+
+
+# --- Idempotency-Key --------------------------------------------------------------
+
+def test_retry_with_same_key_replays_the_original_response(task_api):
+    event = api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'Once'}, headers={'Idempotency-Key': 'key-1'})
+
+    first_status, first, first_headers = call(task_api.create_task.handler, event)
+    second_status, second, second_headers = call(task_api.create_task.handler, event)
+
+    assert first_status == second_status == 201
+    assert second == first
+    assert 'Idempotent-Replayed' not in first_headers
+    assert second_headers['Idempotent-Replayed'] == 'true'
+    assert len(task_api.table.items) == 1
+
+
+def test_same_key_with_a_different_body_is_422(task_api):
+    headers = {'Idempotency-Key': 'key-2'}
+    call(task_api.create_task.handler, api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'A'}, headers=headers))
+
+    status, body, _ = call(task_api.create_task.handler, api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'B'}, headers=headers))
+
+    assert status == 422
+    assert len(task_api.table.items) == 1
+
+
+def test_key_still_in_progress_is_409(task_api):
+    event = api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'Slow'}, headers={'Idempotency-Key': 'key-3'})
+    idempotency = task_api.idempotency
+    table = task_api.aws_clients.table(os.environ['IDEMPOTENCY_TABLE'])
+    # A first attempt that has claimed the key but not finished
+    assert idempotency.claim(table, 'create_task#alice#key-3', idempotency.fingerprint(event)) is None
+
+    status, body, _ = call(task_api.create_task.handler, event)
+
+    assert status == 409
+    assert 'in progress' in body['error']
+    assert not task_api.table.items
+
+
+def test_keys_are_scoped_to_the_user(task_api):
+    headers = {'Idempotency-Key': 'shared-key'}
+    for user_id in ('alice', 'bob'):
+        status, body, response_headers = call(task_api.create_task.handler, api_event(
+            'POST', '/tasks', body={'userId': user_id, 'title': 'Mine'}, headers=headers))
+        assert status == 201
+        assert body['task']['userId'] == user_id
+        assert 'Idempotent-Replayed' not in response_headers
+    assert len(task_api.table.items) == 2
+
+
+def test_unreadable_stored_response_runs_the_request_again(task_api):
+    event = api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'Again'}, headers={'Idempotency-Key': 'key-5'})
+    call(task_api.create_task.handler, event)
+    table = task_api.aws_clients.table(os.environ['IDEMPOTENCY_TABLE'])
+    table.update_item(Key={'idempotencyKey': 'create_task#alice#key-5'}, UpdateExpression='SET #response = :garbage',
+                      ExpressionAttributeNames={'#response': 'response'}, ExpressionAttributeValues={':garbage': b'not gzip'})
+
+    status, _, headers = call(task_api.create_task.handler, event)
+
+    assert status == 201
+    assert 'Idempotent-Replayed' not in headers
+    assert len(task_api.table.items) == 2
+    status, _, headers = call(task_api.create_task.handler, event)
+    assert status == 201 and headers['Idempotent-Replayed'] == 'true'
+
+
+def test_server_errors_are_not_replayed(task_api, monkeypatch):
+    event = api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'Retry me'}, headers={'Idempotency-Key': 'key-4'})
+    monkeypatch.delenv('TABLE_NAME')
+    status, _, _ = call(task_api.create_task.handler, event)
+    assert status == 500
+
+    monkeypatch.setenv('TABLE_NAME', task_api.table.name)
+    status, _, headers = call(task_api.create_task.handler, event)
+    assert status == 201
+    assert 'Idempotent-Replayed' not in headers
+
+
+# --- PATCH /tasks and DELETE /tasks --------------------------------------------------
+
+def test_bulk_update_reports_missing_tasks_with_207(task_api):
+    task_ids = create_tasks(task_api, 'alice', 3)
+
+    status, body, _ = call(task_api.update_task.handler, api_event('PATCH', '/tasks', body={
+        'taskIds': task_ids + ['missing'], 'patch': {'status': 'completed'}
+    }))
+
+    assert status == 207
+    assert (body['updated'], body['failed']) == (3, 1)
+    assert {result['taskId']: result['status'] for result in body['results']} == dict(
+        {task_id: 'updated' for task_id in task_ids}, missing='not_found')
+    assert {task_api.table.get_item(Key={'taskId': task_id})['Item']['status'] for task_id in task_ids} == {'completed'}
+    assert task_api.table.get_item(Key={'taskId': 'missing'}).get('Item') is None
+
+
+def test_atomic_bulk_update_rolls_back_when_a_task_is_missing(task_api):
+    task_ids = create_tasks(task_api, 'alice', 2)
+
+    status, body, _ = call(task_api.update_task.handler, api_event('PATCH', '/tasks', body={
+        'taskIds': task_ids + ['missing'], 'patch': {'priority': 'high'}, 'atomic': True
+    }))
+
+    assert status == 207
+    assert [result['status'] for result in body['results']] == ['rolled_back', 'rolled_back', 'not_found']
+    assert {task_api.table.get_item(Key={'taskId': task_id})['Item']['priority'] for task_id in task_ids} == {'medium'}
+
+
+def test_bulk_update_by_filter(task_api):
+    task_ids = create_tasks(task_api, 'alice', 4)
+    create_tasks(task_api, 'bob', 2)
+
+    status, body, _ = call(task_api.update_task.handler, api_event('PATCH', '/tasks', body={
+        'filter': {'userId': 'alice', 'status': 'pending'}, 'patch': {'category': 'work'}
+    }))
+
+    assert status == 200
+    assert sorted(result['taskId'] for result in body['results']) == sorted(task_ids)
+
+
+def test_bulk_update_requires_a_patch(task_api):
+    status, _, _ = call(task_api.update_task.handler, api_event('PATCH', '/tasks', body={'taskIds': ['a'], 'patch': {'owner': 'x'}}))
+    assert status == 400
+
+
+def test_bulk_delete_by_ids_and_by_filter(task_api):
+    alice = create_tasks(task_api, 'alice', 3)
+    bob = create_tasks(task_api, 'bob', 2)
+
+    status, body, _ = call(task_api.delete_task.handler, api_event('DELETE', '/tasks', body={'taskIds': alice[:2]}))
+    assert status == 200
+    assert body['deleted'] == 2 and not body['hasMore']
+
+    status, body, _ = call(task_api.delete_task.handler, api_event('DELETE', '/tasks', query={'userId': 'bob', 'status': 'pending'}))
+    assert status == 200
+    assert sorted(result['taskId'] for result in body['results']) == sorted(bob)
+
+    assert list(task_api.table.items.values())[0]['taskId'] == alice[2]
+    assert len(task_api.table.items) == 1
+
+
+def test_bulk_delete_needs_ids_or_a_filter(task_api):
+    status, _, _ = call(task_api.delete_task.handler, api_event('DELETE', '/tasks', query={'userId': 'bob'}))
+    assert status == 400
+
+
+# --- Router ------------------------------------------------------------------------
+
+def test_router_dispatches_to_the_task_handlers(task_api):
+    route = task_api.router.handler
+
+    status, body, _ = call(route, api_event('POST', '/tasks', body={'userId': 'alice', 'title': 'Routed'}))
+    assert status == 201
+    task_id = body['task']['taskId']
+
+    status, body, _ = call(route, api_event('PUT', '/tasks/{taskId}', path=f'/tasks/{task_id}', path_parameters={'taskId': task_id},
+                                            body={'status': 'completed'}))
+    assert status == 200
+
+    status, body, _ = call(route, api_event('GET', '/tasks', query={'userId': 'alice'}))
+    assert [(task['taskId'], task['status']) for task in body['tasks']] == [(task_id, 'completed')]
+
+    status, _, _ = call(route, api_event('DELETE', '/tasks/{taskId}', path=f'/tasks/{task_id}', path_parameters={'taskId': task_id}))
+    assert status == 200
+    assert not task_api.table.items
+
+
+def test_router_answers_unknown_routes_with_404_and_405(task_api):
+    status, body, headers = call(task_api.router.handler, api_event('PUT', '/tasks'))
+    assert status == 405
+    assert headers['Allow'] == 'DELETE, GET, PATCH, POST'
+    assert body['error']
+
+    status, _, headers = call(task_api.router.handler, api_event('GET', '/projects'))
+    assert status == 404
+    assert 'Allow' not in headers